@@ -0,0 +1,361 @@
+"""
+Control channel between `input.py` and `run.py`.
+
+`input.py` sends one request and reads one reply over a TCP or Unix
+domain socket. Both are framed as a 4 byte big-endian length followed
+by that many bytes of UTF-8 JSON::
+
+    request = {"nonce": "<nonce from runningconfig>",
+               "argv": ["start", "-n", "my input"]}
+    reply   = {"ok": true, "result": ...}
+    reply   = {"ok": false, "error": "..."}
+
+`run.py` serves requests with `ControlServer`, a non-blocking
+``selectors`` loop, so many clients can be connected at once and a
+slow or malicious client cannot stall the others.
+
+This module only uses the standard library so that `input.py` starts
+fast.
+"""
+
+import json
+import logging
+import os
+import queue
+import secrets
+import selectors
+import socket
+import struct
+import time
+from concurrent.futures import Future
+
+
+_LEN = struct.Struct(">I")
+MAX_FRAME = 16777216  # 16 MiB
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(obj):
+    payload = json.dumps(obj).encode()
+    if len(payload) > MAX_FRAME:
+        raise ProtocolError(f"Frame too big: {len(payload)} bytes!")
+    return _LEN.pack(len(payload)) + payload
+
+
+def parse_address(host, port):
+    """
+    Socket family and address from a `runningconfig` host and port.
+
+    A host of the form ``unix:/path/to/socket`` is a Unix domain
+    socket, anything else is TCP.
+    """
+
+    if host.startswith("unix:"):
+        return socket.AF_UNIX, host[len("unix:"):]
+    if host in ['0.0.0.0', 'localhost', '']:
+        host = '127.0.0.1'
+    return socket.AF_INET, (host, int(port))
+
+
+def connect(family, address, timeout=None):
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _recv_exactly(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("Connection closed by run.py!")
+        buf += chunk
+    return bytes(buf)
+
+
+def request(sock, obj):
+    """Send one request on a connected socket and return the reply."""
+
+    sock.sendall(encode_frame(obj))
+    length, = _LEN.unpack(_recv_exactly(sock, _LEN.size))
+    if length > MAX_FRAME:
+        raise ProtocolError(f"Frame too big: {length} bytes!")
+    return json.loads(_recv_exactly(sock, length).decode())
+
+
+class _Connection:
+    __slots__ = ('sock', 'inbuf', 'outbuf', 'busy', 'eof', 'events',
+                 'last_active')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.busy = False  # a request is being handled
+        self.eof = False  # client closed its side
+        self.events = selectors.EVENT_READ  # registered with selector
+        self.last_active = time.monotonic()
+
+
+class ControlServer:
+    """
+    Serve framed JSON requests on a listening socket.
+
+    Parameters
+    ----------
+    sock : socket.socket
+        Bound and listening.
+    nonce : str
+        Requests with any other nonce get an error reply and are
+        otherwise ignored.
+    handler : callable
+        Called with the request ``dict`` (nonce checked). Returns a
+        reply ``dict``, or a ``concurrent.futures.Future`` of one for
+        slow commands so the loop keeps serving other clients.
+    idle_timeout : float, default=30
+        Connections idle for longer are closed.
+    """
+
+    def __init__(self, sock, nonce, handler, idle_timeout=30):
+        self.sock = sock
+        self.nonce = nonce
+        self.handler = handler
+        self.idle_timeout = idle_timeout
+
+        self._sel = selectors.DefaultSelector()
+        self._conns = {}
+        self._done = queue.SimpleQueue()  # (connection, reply) pairs
+        self._pending = 0
+        self._stopping = False
+
+        sock.setblocking(False)
+        self._sel.register(sock, selectors.EVENT_READ, self._accept)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, self._woken)
+
+    def shutdown(self):
+        """
+        Stop serving after pending replies are sent. Thread safe.
+        """
+
+        self._stopping = True
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def serve_forever(self):
+        while True:
+            for key, mask in self._sel.select(timeout=1):
+                key.data(key.fileobj, mask)
+            self._reap_idle()
+            if self._stopping and self._pending == 0 and \
+                    not any(c.outbuf for c in self._conns.values()):
+                break
+        self.close()
+
+    def close(self):
+        for conn in list(self._conns.values()):
+            self._close(conn)
+        self._sel.close()
+        self.sock.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def _accept(self, sock, mask):
+        try:
+            client, _ = sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        client.setblocking(False)
+        conn = _Connection(client)
+        self._conns[client] = conn
+        self._sel.register(client, selectors.EVENT_READ, self._io)
+
+    def _woken(self, sock, mask):
+        try:
+            while sock.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while True:
+            try:
+                conn, reply = self._done.get_nowait()
+            except queue.Empty:
+                break
+            self._pending -= 1
+            self._reply(conn, reply)
+
+    def _io(self, sock, mask):
+        conn = self._conns.get(sock)
+        if conn is None:
+            return
+        conn.last_active = time.monotonic()
+
+        if mask & selectors.EVENT_WRITE and conn.outbuf:
+            try:
+                n = sock.send(conn.outbuf)
+                del conn.outbuf[:n]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self._close(conn)
+                return
+
+        if mask & selectors.EVENT_READ:
+            try:
+                data = sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b""
+            if data == b"":
+                conn.eof = True
+            elif data:
+                conn.inbuf += data
+
+        self._process(conn)
+        self._update_events(conn)
+
+    def _process(self, conn):
+        """Handle the next complete request of `conn`, if any."""
+
+        if conn.busy or conn.outbuf or len(conn.inbuf) < _LEN.size:
+            return
+        length, = _LEN.unpack_from(conn.inbuf)
+        if length > MAX_FRAME:
+            self._close(conn)
+            return
+        if len(conn.inbuf) < _LEN.size + length:
+            return
+
+        payload = bytes(conn.inbuf[_LEN.size:_LEN.size + length])
+        del conn.inbuf[:_LEN.size + length]
+
+        try:
+            req = json.loads(payload.decode())
+            nonce = str(req.get("nonce", ""))
+        except (ValueError, AttributeError):
+            self._reply(conn, {"ok": False, "error": "Bad request!"})
+            return
+        if not secrets.compare_digest(nonce.encode(), self.nonce.encode()):
+            self._reply(conn, {"ok": False, "error": "Bad nonce!"})
+            return
+
+        conn.busy = True
+        try:
+            reply = self.handler(req)
+        except Exception as e:
+            logging.error("Control handler failed!", exc_info=True)
+            reply = {"ok": False, "error": repr(e)}
+
+        if isinstance(reply, Future):
+            self._pending += 1
+            reply.add_done_callback(
+                lambda f, conn=conn: self._finished(conn, f))
+        else:
+            self._reply(conn, reply)
+
+    def _finished(self, conn, future):
+        """Runs in the thread that completed `future`."""
+
+        try:
+            reply = future.result()
+        except Exception as e:
+            logging.error("Control command failed!", exc_info=True)
+            reply = {"ok": False, "error": repr(e)}
+        self._done.put((conn, reply))
+        self._wake()
+
+    def _reply(self, conn, reply):
+        conn.busy = False
+        if conn.sock not in self._conns:  # client went away
+            return
+        try:
+            conn.outbuf += encode_frame(reply)
+        except (ProtocolError, TypeError, ValueError) as e:
+            conn.outbuf += encode_frame({"ok": False, "error": repr(e)})
+        self._update_events(conn)
+
+    def _update_events(self, conn):
+        """Wait for reads unless busy or at EOF, for writes if any."""
+
+        if conn.sock not in self._conns:
+            return
+        events = 0
+        if not conn.busy and not conn.eof:
+            events |= selectors.EVENT_READ
+        if conn.outbuf:
+            events |= selectors.EVENT_WRITE
+
+        if events == conn.events:
+            return
+        if events == 0 and conn.eof and not conn.busy:
+            self._close(conn)
+        elif events == 0:
+            self._sel.unregister(conn.sock)
+        elif conn.events == 0:
+            self._sel.register(conn.sock, events, self._io)
+        else:
+            self._sel.modify(conn.sock, events, self._io)
+        conn.events = events
+
+    def _reap_idle(self):
+        now = time.monotonic()
+        for conn in list(self._conns.values()):
+            if not conn.busy and not conn.outbuf and \
+                    now - conn.last_active > self.idle_timeout:
+                self._close(conn)
+
+    def _close(self, conn):
+        self._conns.pop(conn.sock, None)
+        if conn.events:
+            self._sel.unregister(conn.sock)
+        conn.events = 0
+        conn.sock.close()
+
+
+def create_server_socket(unix_path=None):
+    """
+    Listening socket for `run.py`, TCP on a random local port or a
+    Unix domain socket at `unix_path`.
+
+    Returns
+    -------
+    sock : socket.socket
+    host : str
+        ``unix:<path>`` for a Unix domain socket.
+    port : int
+    """
+
+    if unix_path:
+        try:
+            os.remove(unix_path)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)  # socket only usable by this user
+        try:
+            sock.bind(unix_path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(128)
+        return sock, f"unix:{unix_path}", 0
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(128)
+    host, port = sock.getsockname()
+    return sock, host, port
@@ -12,10 +12,23 @@ This file takes in the arguments and passes them to `run.py`. The
 arguments just to catch and return any user error.
 
 The `input.py` file communicates (IPC) with the `run.py` file via a
-websocket. The `run.py` files sets up a random websocket when it first
-starts up. The websocket info (host, port, nonce) is saved in the
-`runningconfig` file. `nonce` is like a password so that no one else
-can pass commands to the `run.py` file except for the `input.py` file.
+socket. The `run.py` files sets up a random local TCP port (or a Unix
+domain socket with ``--unix-socket``) when it first starts up. The
+socket info (host, port, nonce) is saved in the `runningconfig` file.
+`nonce` is like a password so that no one else can pass commands to
+the `run.py` file except for the `input.py` file.
+
+With ``--workers N`` `run.py` runs the inputs in N worker processes,
+see `supervisor.py`. ``status`` then also shows the load of every
+worker.
+
+Every command gets a reply from `run.py` which is printed as JSON, see
+`control.py` for the protocol. ``status`` shows the state of every
+running input. The exit code is 1 if the command failed.
+
+If `run.py` is not running, ``start`` spawns it with ``--ready-fd``, a
+pipe `run.py` writes ``ready`` to once it listens, and waits on that
+pipe instead of polling for the socket.
 
 The `input.py` file reads the <host, port, nonce> from the file
 `runningconfig`. The `runningconfig` file is stored in the working
@@ -28,12 +41,16 @@ Usage
 -----
 ::
     usage: input.py [-h] [-c CONFIG] [-p PLUGIN [PLUGIN ...]]
-    [-n NAME [NAME ...]] {start,stop,restart}
+    [-n NAME [NAME ...]] [-r {thread,asyncio}] [--loops LOOPS]
+    [--metrics-port METRICS_PORT] [--watch SECONDS]
+    [--unix-socket UNIX_SOCKET] [--workers WORKERS]
+    {start,stop,restart,status}
 
     Parse Input arguments.
 
     positional arguments:
-      {start,stop,restart}  start, stop, restart
+      {start,stop,restart,status}
+                            start, stop, restart, status
 
     optional arguments:
       -h, --help            show this help message and exit
@@ -43,17 +60,32 @@ Usage
                             plugin names to run
       -n NAME [NAME ...], --name NAME [NAME ...]
                             name of inputs to run
+      -r {thread,asyncio}, --runtime {thread,asyncio}
+                            run each input in a thread or as an asyncio
+                            coroutine
+      --loops LOOPS         number of event loops for the asyncio runtime
+      --metrics-port METRICS_PORT
+                            serve Prometheus metrics on this local port
+      --watch SECONDS       check input configs every SECONDS and restart
+                            changed inputs
+      --unix-socket UNIX_SOCKET
+                            control run.py over this Unix domain socket
+                            (when starting run.py) instead of TCP
+      --workers WORKERS     run inputs in this many worker processes (when
+                            starting run.py)
 """
 
 import argparse
-import logging
+import json
 import os
-import pdb
-import shlex
-import socket
+import select
 import subprocess
 import sys
-import time
+
+import control
+
+
+READY_TIMEOUT = 30  # seconds run.py may take to start listening
 
 
 if __name__ == "__main__":
@@ -63,8 +95,8 @@ if __name__ == "__main__":
     parser.add_argument(
         'command',
         default='start',
-        choices = ['start', 'stop', 'restart'],
-        help="start, stop, restart")
+        choices = ['start', 'stop', 'restart', 'status'],
+        help="start, stop, restart, status")
     parser.add_argument(
         '-c',
         '--config',
@@ -82,69 +114,125 @@ if __name__ == "__main__":
         nargs="+",
         help="name of inputs to run",
     )
+    parser.add_argument(
+        "-r",
+        "--runtime",
+        default="thread",
+        choices=["thread", "asyncio"],
+        help="run each input in a thread or as an asyncio coroutine",
+    )
+    parser.add_argument(
+        "--loops",
+        type=int,
+        default=1,
+        help="number of event loops for the asyncio runtime",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus metrics on this local port",
+    )
+
+    parser.add_argument(
+        "--watch",
+        type=float,
+        metavar="SECONDS",
+        help="check input configs every SECONDS and restart changed "
+             "inputs",
+    )
+    parser.add_argument(
+        "--unix-socket",
+        help="control run.py over this Unix domain socket (when "
+             "starting run.py) instead of TCP",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="run inputs in this many worker processes (when starting "
+             "run.py)",
+    )
+    parser.add_argument(
+        "--log-file",
+        help="log to this file (when starting run.py), default "
+             "input.log in the working directory",
+    )
 
     args = parser.parse_args()
+
+    # run.py gets everything but the options used to start it
+    startup_options = ("--unix-socket", "--workers", "--log-file")
+    argv = []
+    skip = False
+    for arg in sys.argv[1:]:
+        if skip:
+            skip = False
+        elif arg in startup_options:
+            skip = True
+        elif not arg.startswith(tuple(o + "=" for o in startup_options)):
+            argv.append(arg)
     
 
-    host, port, nonce = None, None, None
-    try:
+    def read_runningconfig():
         with open('runningconfig', 'r') as f:
-            host, port, nonce = f.readline().split(',')
-            if host in ['0.0.0.0', 'localhost']:
-                host = '127.0.0.1'
-            port = int(port)
-    except FileNotFoundError:
-        pass
-
-    sock = socket.socket()
+            host, port, nonce = f.readline().strip().split(',')
+        return control.parse_address(host, port) + (nonce,)
+
+    sock, nonce = None, None
     try:
-        sock.connect((host, port))
-    except (ConnectionRefusedError, OSError, TypeError):
-        sock.close()
-        
+        family, address, nonce = read_runningconfig()
+        sock = control.connect(family, address)
+    except (FileNotFoundError, ValueError, OSError):
+        sock = None
+
+    if sock is None:
         if args.command != 'start':
             print("Input module is not running!")
             sys.exit(1)
 
         this_dir = os.path.dirname(__file__)
         run_file = os.path.join(this_dir, "run.py")
-        proc = subprocess.Popen([sys.executable, run_file])
-        pid = proc.pid
-
-        sock = socket.socket()
-        starttime = time.time()
-        while time.time() - starttime < 5: # Allow run.py 5 seconds to create socket and start listening
+        run_cmd = [sys.executable, run_file]
+        if args.unix_socket:
+            run_cmd += ["--unix-socket", os.path.abspath(args.unix_socket)]
+        if args.workers:
+            run_cmd += ["--workers", str(args.workers)]
+        if args.log_file:
+            run_cmd += ["--log-file", os.path.abspath(args.log_file)]
+
+        # run.py writes "ready" to this pipe once it listens. If it dies
+        # first the pipe closes, so there is nothing to poll.
+        ready_r, ready_w = os.pipe()
+        proc = subprocess.Popen(run_cmd + ["--ready-fd", str(ready_w)],
+                                pass_fds=(ready_w,))
+        os.close(ready_w)
+        with os.fdopen(ready_r, 'rb') as ready:
+            if select.select([ready], [], [], READY_TIMEOUT)[0]:
+                ready = ready.readline().strip() == b"ready"
+            else:
+                ready = False
+
+        if ready:
             try:
-                with open('runningconfig', 'r') as f:
-                    host, port, nonce = f.readline().strip().split(',')
-                    if host in ['0.0.0.0', 'localhost']:
-                        host = '127.0.0.1'
-                    port = int(port)
-                sock.connect((host, port))
-
+                family, address, nonce = read_runningconfig()
+                sock = control.connect(family, address)
                 with open('runningconfig', 'a') as f:
-                    f.write(f"{pid}\n")
-                break
-            except (FileNotFoundError, ConnectionRefusedError,
-                    OSError, ValueError):
-                continue
-                
-
-
-    cmd = " ".join(map(shlex.quote, sys.argv[1:]))
-    cmd = cmd.strip()
-    cmd = f"{nonce} {cmd}"
-    cmd = cmd.encode()
-
-    sock.send(cmd)
-    sock.close()
-
-
-        
-    
-        
-
-    
-
+                    f.write(f"{proc.pid}\n")
+            except (FileNotFoundError, OSError, ValueError):
+                sock = None
 
+        if sock is None:
+            print("Failed to start run.py!")
+            sys.exit(1)
 
+    # Commands like start may take a while, so no timeout.
+    try:
+        with sock:
+            reply = control.request(sock, {"nonce": nonce, "argv": argv})
+    except (OSError, control.ProtocolError, ValueError) as e:
+        print(f"No reply from run.py: {e!r}")
+        sys.exit(1)
+
+    if not reply.get("ok"):
+        print("Error:", reply.get("error"))
+        sys.exit(1)
+    print(json.dumps(reply.get("result"), indent=2))
@@ -6,16 +6,12 @@ Updated: 4/13/2021 05:39
 """
 
 import collections.abc
-import gridfs
+import copy
 import json
 import logging
 import os
-import pdb
-import pymongo
 import sys
 
-import tahoe
-
 
 default = {
     "analytics": { 
@@ -27,6 +23,21 @@ default = {
         "url": "http://localhost:5000/",
         "token": "",
         "host" : "localhost",
+        "pool_connections": 10,
+        "pool_maxsize": 10,
+        "pool_block": False,
+        "token_ttl": 300,
+        "start_workers": 16,
+        "rate_limit": 0,
+        "rate_limit_burst": 0,
+        "org_rate_limit": 0,
+        "org_rate_limit_burst": 0,
+        "min_concurrency": 1,
+        "max_concurrency": 64,
+        "target_latency": 2.0,
+        "max_retry_after": 300,
+        "stop_timeout": 5,
+        "async_workers": 128,
     },
     "archive": { 
         "mongo_url": "mongodb://localhost:27017/",
@@ -66,20 +77,46 @@ def update(d, u):
     return d
 
 
+_CONFIG_CACHE = {}  # path: ((mtime_ns, size), config)
+
+
+def _read_config(filename):
+    """
+    Parsed config file, cached until the file's mtime or size
+    changes. Raises `FileNotFoundError` like ``open()``.
+    """
+
+    st = os.stat(filename)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _CONFIG_CACHE.get(filename)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with open(filename, 'r') as f:
+        config = json.load(f)
+    update(config, default)
+    _CONFIG_CACHE[filename] = (stamp, config)
+    return config
+
+
 def get_config(filename='config.json', db='all'):
-    """Read and parse config from config file."""
+    """
+    Read and parse config from config file.
+
+    The parsed file is cached and only read again once its mtime
+    changes, so calling this often is cheap. Every call returns a
+    fresh copy that the caller may modify.
+    """
   
     try:
         """This block succeeds if `filename` is valid absolute path"""
-        with open(filename, 'r') as f:
-            config = json.load(f)
+        config = _read_config(os.path.abspath(filename))
     except FileNotFoundError:
         try:
             """This block succeeds if `filename` is valid relative path"""
             this_dir = os.path.dirname(__file__)
             filename = os.path.join(this_dir, filename)
-            with open(filename, 'r') as f:
-                config = json.load(f)
+            config = _read_config(os.path.abspath(filename))
         except FileNotFoundError:
             """`filename` is not valid"""
             config = default
@@ -91,9 +128,8 @@ def get_config(filename='config.json', db='all'):
         logging.error(f"Bad config file: {filename}", exc_info=True)
         sys.exit(1)  # 1 = error in linux
 
-    update(config, default)
     """
-    Updates the input config file with default values.
+    `_read_config()` updates the input config file with default values.
 
     e.g. If only `mongo_url` is given for `archive`
     then it is assumed that `db = tahoe_db, coll = instance`.
@@ -107,7 +143,7 @@ def get_config(filename='config.json', db='all'):
 
         config = config[db]
 
-    return config
+    return copy.deepcopy(config)
 
 
 def get_api(filename='config.json'):
@@ -127,6 +163,22 @@ def get_api(filename='config.json'):
         JWT token to authenticate with the API.
     host : str
         Hostname of the api (e.g. `localhost`).
+
+    Notes
+    -----
+    The api config also takes `pool_connections`, `pool_maxsize` and
+    `pool_block` which size the HTTP connection pool shared by all
+    inputs. See `plugin.session.PooledSession`. `token_ttl` is how
+    many seconds `run.py` reuses the API token of an org, and
+    `start_workers` how many inputs it starts at the same time.
+
+    `rate_limit`, `rate_limit_burst`, `org_rate_limit`,
+    `org_rate_limit_burst`, `min_concurrency`, `max_concurrency`,
+    `target_latency` and `max_retry_after` limit posting to the API,
+    see `plugin.ratelimit.ApiLimiter`. `stop_timeout` is how many
+    seconds stopping inputs waits for them to exit gracefully.
+    `async_workers` sizes the thread pool of the asyncio runtime, see
+    `plugin.aio.AsyncRuntime`.
     """
         
     apiconfig = get_config(filename, 'api')
@@ -152,6 +204,9 @@ def get_cache_db(filename='config.json'):
         Lookup pymongo gridfs to know more.
     """
      
+    import gridfs
+    import pymongo
+
     cacheconfig = get_config(filename, 'cache')
     mongo_url = cacheconfig['mongo_url']
     dbname = cacheconfig['db']
@@ -187,6 +242,8 @@ def _get_backend(filename='config.json', db='tahoe'):
         Lookup pymongo gridfs to know more.
     """
 
+    import tahoe
+
     if db not in {"analytics", "archive", "report", "tahoe"}:
         raise ValueError(f"Invalid db name: {db}")
     
@@ -324,6 +381,8 @@ def get_identity_backend(filename='config.json'):
         with the identity db.
     """
     
+    import tahoe.identity
+
     idenityconfig = get_config(filename, 'identity')
     mongo_url = idenityconfig['mongo_url']
     dbname = idenityconfig['db']
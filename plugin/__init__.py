@@ -1 +1,35 @@
-from .websocket import WebSocket
+"""
+CYBEX-P input plugins.
+
+Names are imported on first use (PEP 562), so ``import plugin`` or
+``from plugin.metrics import Registry`` does not load ``requests``,
+``lomond`` and every plugin.
+"""
+
+import importlib
+
+_LAZY = {
+    "WebSocket": ".websocket",
+    "HttpFeed": ".httpfeed",
+    "FileTail": ".filetail",
+    "Listener": ".listener",
+    "ApiLimiter": ".ratelimit",
+    "PooledSession": ".session",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    try:
+        module = _LAZY[name]
+    except KeyError:
+        raise AttributeError(
+            f"module '{__name__}' has no attribute '{name}'") from None
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,105 @@
+"""asyncio runtime for input plugins."""
+
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import threading
+
+
+class AsyncInput:
+    """
+    Thread-like handle of an input running on an `AsyncRuntime`.
+
+    ``run.py`` treats the values of ``_RUNNING`` as threads. This
+    handle gives a coroutine based input the same ``join()``,
+    ``is_alive()``, ``exit_graceful()`` and ``exit_now()`` methods.
+    Other attributes are looked up on the wrapped plugin.
+    """
+
+    def __init__(self, plugin, future):
+        self.plugin = plugin
+        self.future = future
+
+    def __getattr__(self, name):
+        return getattr(self.plugin, name)
+
+    def __repr__(self):
+        state = "stopped" if self.future.done() else "running"
+        return f"<AsyncInput({self.plugin.name_}, {state})>"
+
+    def exit_graceful(self):
+        self.plugin.exit_graceful()
+
+    def exit_now(self):
+        self.plugin.exit_now()
+
+    def is_alive(self):
+        return not self.future.done()
+
+    def join(self, timeout=None):
+        concurrent.futures.wait([self.future], timeout)
+
+
+class AsyncRuntime:
+    """
+    Run many inputs as coroutines on a few event loops.
+
+    Each event loop runs in its own daemon thread. Inputs are given
+    to the loops round robin. Plugins that only implement the
+    synchronous ``fetch()`` are run through ``InputPlugin.arun()``
+    whose default ``afetch()`` and ``apost()`` call the synchronous
+    methods in a shared thread pool. A synchronous ``fetch()`` holds
+    a worker of the pool while it waits for messages, so the pool
+    should have about as many workers as such inputs.
+
+    Parameters
+    ----------
+    n_loops : int, default=1
+        Number of event loops (threads).
+    max_workers : int, optional
+        Size of the thread pool used for synchronous ``fetch()``
+        and ``post()``. Defaults to ``ThreadPoolExecutor`` default.
+        ``run.py`` passes ``async_workers`` of the api config.
+    """
+
+    def __init__(self, n_loops=1, max_workers=None):
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="input-executor")
+        self.n_loops = max(1, n_loops)
+        self._loops = []
+        for i in range(self.n_loops):
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever,
+                                      name=f"input-loop-{i}", daemon=True)
+            thread.start()
+            self._loops.append(loop)
+        self._next = itertools.cycle(self._loops)
+
+    def start(self, plugin):
+        """
+        Schedule ``plugin.arun()`` on one of the event loops.
+
+        Returns
+        -------
+        handle : AsyncInput
+        """
+
+        loop = next(self._next)
+        future = asyncio.run_coroutine_threadsafe(
+            plugin.arun(self.executor), loop)
+        future.add_done_callback(self._log_error)
+        return AsyncInput(plugin, future)
+
+    def close(self):
+        """Stop the event loops and the thread pool."""
+
+        for loop in self._loops:
+            loop.call_soon_threadsafe(loop.stop)
+        self.executor.shutdown(wait=False)
+
+    @staticmethod
+    def _log_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error("Input coroutine failed!",
+                          exc_info=future.exception())
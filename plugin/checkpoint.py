@@ -0,0 +1,66 @@
+"""
+Durable per-input state, e.g. how far an input has read its source.
+
+Plugins that poll a source keep a cursor (last id, timestamp, ETag,
+file offset) so a restart resumes where the input left off instead
+of posting everything again. ``InputPlugin`` saves the state returned
+by ``checkpoint()`` only once the events fetched up to that state are
+posted (or spooled), see ``InputPlugin.commit()``.
+"""
+
+import json
+import logging
+import os
+
+
+class Checkpoint:
+    """
+    JSON state of one input in a file.
+
+    Writes go to a temporary file that replaces the old one, so a
+    crash leaves either the old or the new state, never a torn file.
+
+    Parameters
+    ----------
+    path : str
+        File of this input, its directory is created if missing.
+    fsync : bool, default=True
+        ``fsync()`` the file before replacing the old one.
+    """
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def __repr__(self):
+        return f"Checkpoint({self.path!r})"
+
+    def load(self):
+        """
+        Returns
+        -------
+        state : dict
+            The last saved state, empty if none or if the file is bad.
+        """
+
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logging.error(f"Bad checkpoint, starting over: '{self.path}'")
+            return {}
+        return state if isinstance(state, dict) else {}
+
+    def save(self, state):
+        """Replace the saved state with `state`, a JSON-able dict."""
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, self.path)
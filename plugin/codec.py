@@ -0,0 +1,116 @@
+"""JSON encoding and decoding with the fastest codec installed."""
+
+import json
+import logging
+import math
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def available():
+    """Names of the installed codecs, fastest first."""
+
+    return [name for name, module in (("orjson", orjson), ("ujson", ujson))
+            if module is not None] + ["json"]
+
+
+def _json_dumps(obj):
+    return json.dumps(obj).encode()
+
+
+def _non_finite(obj):
+    """``True`` if `obj` holds a ``NaN`` or infinite float."""
+
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_non_finite(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_non_finite(v) for v in obj)
+    return False
+
+
+def get_codec(name="auto", exact=False):
+    """
+    Get JSON functions by codec name.
+
+    Fast codecs fall back to the standard library for the few values
+    they cannot handle (e.g. integers over 64 bits, ``NaN``), so they
+    accept everything ``json`` does.
+
+    Parameters
+    ----------
+    name : {"auto", "orjson", "ujson", "json"}, default="auto"
+        ``auto`` picks the first of `available()`. A codec that is not
+        installed falls back to ``json``.
+    exact : bool, default=False
+        Encode byte for byte like ``json.dumps()`` (``", "`` and
+        ``": "`` separators, ASCII escapes). Only the standard library
+        does that, so this forces ``json`` for encoding; decoding
+        still uses `name`. Inputs use this unless ``json_exact =
+        False``, so what they upload does not depend on the codecs a
+        host has installed.
+
+    Returns
+    -------
+    name : str
+        Name of the codec actually used for decoding.
+    dumps : callable
+        Object to ``bytes``.
+    loads : callable
+        ``str`` or ``bytes`` to object.
+    """
+
+    if name == "auto":
+        name = available()[0]
+    if name not in ("orjson", "ujson", "json"):
+        raise ValueError(f"Unknown JSON codec: '{name}'!")
+    if name not in available():
+        logging.warning(f"{name} is not installed, using json!")
+        name = "json"
+
+    if name == "orjson":
+        def dumps(obj):
+            try:
+                encoded = orjson.dumps(obj)
+            except TypeError:  # also orjson.JSONEncodeError
+                return _json_dumps(obj)
+            # orjson writes NaN and infinity as null
+            if b"null" in encoded and _non_finite(obj):
+                return _json_dumps(obj)
+            return encoded
+
+        def loads(s):
+            try:
+                return orjson.loads(s)
+            except ValueError:
+                return json.loads(s)
+
+    elif name == "ujson":
+        def dumps(obj):
+            try:
+                return ujson.dumps(obj, ensure_ascii=False,
+                                   escape_forward_slashes=False).encode()
+            except (TypeError, OverflowError):
+                return _json_dumps(obj)
+
+        def loads(s):
+            try:
+                return ujson.loads(s)
+            except ValueError:
+                return json.loads(s)
+
+    else:
+        dumps, loads = _json_dumps, json.loads
+
+    if exact:
+        dumps = _json_dumps
+    return name, dumps, loads
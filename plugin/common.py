@@ -1,15 +1,81 @@
 #!/usr/bin/env python3
 """InputPlugin base class."""
 
-import json
+import asyncio
+import contextlib
+import hashlib
 import logging
+import os
+import queue
 import random
+import re
 import requests
 import threading
 import time
 
+from .checkpoint import Checkpoint
+from .codec import get_codec
+from .compress import get_compressor
+from .dedup import DedupCache, digest
+from .flush import FlushPolicy
+from .metrics import Registry
+from .ratelimit import Cancelled, RetryAfter, parse_retry_after
+from .spool import Spool
 
 
+def _option(input_config, key, default=None):
+    """
+    Read an optional setting from an input config.
+
+    Input config values are stored as single item lists, e.g.
+    ``input_config['data']['period'] = [10]``. Returns `default` if
+    `key` is not set.
+    """
+    
+    try:
+        return input_config['data'][key][0]
+    except (KeyError, IndexError, TypeError):
+        return default
+
+
+class Delivery:
+    """
+    Encoded events of one batch and how far posting them got.
+
+    ``InputPlugin.prepare()`` encodes and packs events once. Each
+    item of `parts` is the arguments of one HTTP request. `cursor`
+    is the index of the first request not posted yet, so a retry
+    after a failure does not re-encode or resend earlier requests.
+    `digests`, if the input has a dedup cache, are the `digest` of
+    each event of each part, added to the cache once it is posted.
+    """
+
+    __slots__ = ('parts', 'cursor', 'digests')
+
+    def __init__(self, parts, digests=None):
+        self.parts = parts
+        self.cursor = 0
+        self.digests = digests
+
+    def __repr__(self):
+        return f"Delivery(posted={self.cursor}/{len(self.parts)})"
+
+    @property
+    def done(self):
+        return self.cursor >= len(self.parts)
+
+    @property
+    def remaining(self):
+        """Number of events not posted yet."""
+
+        return sum(part[3] for part in self.parts[self.cursor:])
+
+    def advance(self):
+        self.cursor += 1
+
+
+_STOP = object()  # tells the post stage of the pipeline to stop
+
 
 class InputPlugin(threading.Thread):
     """
@@ -40,10 +106,59 @@ class InputPlugin(threading.Thread):
         You can spin up two instances of the WebSocket plugin two
         bring data from two different URLs. Those two instances will
         have `plugin=websocket` but different values for `name_`.
+    raw : bool
+        If ``True`` messages are passed through ``decode()`` to the
+        upload without being parsed. Set by the optional input config
+        keys ``raw`` and ``raw_validate``.
+    flush : plugin.flush.FlushPolicy
+        Count, bytes and time limits plugins use to decide when
+        ``fetch()`` returns a batch.
+    batch : bool
+        If ``True`` upload many events per request as one newline
+        delimited payload, bounded by `batch_max_events` and
+        `batch_max_bytes`. Set by the optional input config keys
+        ``batch``, ``batch_max_events`` and ``batch_max_bytes``.
+    session : requests.Session or module
+        Used to post to the API. ``run.py`` passes one pooled session
+        shared by all inputs. Defaults to the ``requests`` module.
+    limiter : plugin.ratelimit.ApiLimiter or None
+        Rate and concurrency limits of posting, shared by all inputs.
+        ``run.py`` passes one. A 429 or 503 answer is retried after its
+        ``Retry-After`` with or without a limiter.
+    pipeline_depth : int
+        If greater than 0, ``run()`` fetches and posts concurrently
+        with up to this many fetched batches waiting to be posted.
+        Set by the optional input config key ``pipeline_depth``.
+    metrics : plugin.metrics.Registry
+        Counters, gauges and latency histograms of this input, labelled
+        with its name and plugin. ``run.py`` exposes them.
+    timing : dict
+        ``{'fetch': Histogram, 'post': Histogram}``, time spent in
+        successful ``fetch()`` and ``post()`` calls.
+    compression : str or None
+        ``gzip`` or ``zstd``, from the optional input config key
+        ``compression``. Payloads smaller than
+        ``compression_min_bytes`` (default 1024) are sent as is.
+        Compressed uploads have the form field ``content_encoding``.
+    dedup : plugin.dedup.DedupCache or None
+        If the input config has ``dedup = True``, events with the same
+        content as one posted in the last ``dedup_window`` seconds are
+        not posted. Also takes ``dedup_max_entries``, ``dedup_bloom``
+        and ``dedup_bloom_capacity``.
+    spool : plugin.spool.Spool or None
+        If the input config has ``spool_dir``, fetched events are
+        written to a spool in ``spool_dir/<name>`` and posted from
+        there, see `plugin.spool`. Also takes ``spool_segment_bytes``,
+        ``spool_max_bytes`` and ``spool_fsync``.
+    checkpoints : plugin.checkpoint.Checkpoint or None
+        If the input config has ``checkpoint_dir``, the state returned
+        by ``checkpoint()`` is saved to ``checkpoint_dir/<name>.json``
+        by ``commit()``. `saved_state` is what was saved last time.
     
     """
     
-    def __init__(self, input_config, api_raw_url, api_token):
+    def __init__(self, input_config, api_raw_url, api_token,
+                 session=None, limiter=None):
         self.post_url = api_raw_url
         self.token = "Bearer " + api_token
         self.name_ = input_config['data']['name'][0]
@@ -59,11 +174,102 @@ class InputPlugin(threading.Thread):
         self.exit_graceful_event = threading.Event()
         self.exit_now_event = threading.Event()
 
+        # Fetch and post in separate threads joined by a bounded queue
+        self.pipeline_depth = int(_option(input_config, 'pipeline_depth', 0))
+        self.pipeline_queue = None
+
+        # Compress uploads of at least `compression_min_bytes`
+        compression = _option(input_config, 'compression')
+        self.compression_min_bytes = int(
+            _option(input_config, 'compression_min_bytes', 1024))
+        if compression:
+            self.compression, self.compress = get_compressor(
+                compression, _option(input_config, 'compression_level'))
+        else:
+            self.compression, self.compress = None, None
+
+        # Drop events whose content was posted within `dedup_window` seconds
+        if _option(input_config, 'dedup', False):
+            bloom = _option(input_config, 'dedup_bloom', False)
+            self.dedup = DedupCache(
+                float(_option(input_config, 'dedup_window', 600)),
+                int(_option(input_config, 'dedup_max_entries', 100000)),
+                int(_option(input_config, 'dedup_bloom_capacity', 1000000))
+                    if bloom else None)
+        else:
+            self.dedup = None
+
+        # Durable on-disk spool between fetch and post
+        spool_dir = _option(input_config, 'spool_dir')
+        if spool_dir is None:
+            self.spool = None
+        else:
+            self.spool = Spool(
+                os.path.join(spool_dir, re.sub(r'[^\w.-]', '_', self.name_)),
+                int(_option(input_config, 'spool_segment_bytes', 16777216)),
+                int(_option(input_config, 'spool_max_bytes', 1073741824)),
+                _option(input_config, 'spool_fsync', 'interval'))
+
+        # Where a polling plugin left off, see `checkpoint()`
+        checkpoint_dir = _option(input_config, 'checkpoint_dir')
+        if checkpoint_dir is None:
+            self.checkpoints = None
+            self.saved_state = {}
+        else:
+            self.checkpoints = Checkpoint(os.path.join(
+                checkpoint_dir,
+                re.sub(r'[^\w.-]', '_', self.name_) + '.json'))
+            self.saved_state = self.checkpoints.load()
+
+        # Set by `arun()` when running on `plugin.aio.AsyncRuntime`
+        self._loop = None
+        self._executor = None
+        self._aexit_graceful_event = None
+        self._aexit_now_event = None
+
+        # Pass messages through as str/bytes instead of parsing them
+        self.raw = bool(_option(input_config, 'raw', False))
+        self.raw_validate = _option(input_config, 'raw_validate', 'none')
+        if self.raw_validate not in ('none', 'prefix', 'json'):
+            raise ValueError(f"Invalid raw_validate: '{self.raw_validate}'!")
+
+        # JSON codec of decode() and post(), see `plugin.codec`
+        self.json_codec, self._dumps, self._loads = get_codec(
+            _option(input_config, 'json_codec', 'auto'),
+            bool(_option(input_config, 'json_exact', True)))
+
+        # When plugins return a batch from fetch(), see `plugin.flush`
+        max_bytes = _option(input_config, 'flush_max_bytes')
+        self.flush = FlushPolicy(
+            int(_option(input_config, 'flush_max_events', 10)),
+            None if max_bytes is None else int(max_bytes),
+            float(_option(input_config, 'flush_max_linger', 15)),
+            bool(_option(input_config, 'flush_adaptive', False)),
+            int(_option(input_config, 'flush_adaptive_max_events', 1000)))
+
+        # Batched upload: many events per POST as newline-delimited payload
+        self.batch = bool(_option(input_config, 'batch', False))
+        self.batch_max_events = int(_option(input_config,
+                                            'batch_max_events', 100))
+        self.batch_max_bytes = int(_option(input_config,
+                                           'batch_max_bytes', 1048576))
+
+        # Shared keep-alive session, see `plugin.session.PooledSession`
+        self.session = requests if session is None else session
+        self.limiter = limiter
+
         self.headers = {"Authorization": self.token}
         self.data = {'name': self.name_, 'orgid': self.orgid,
             'typetag': self.typetag, 'timezone': self.timezone}
+        self.batch_data = dict(self.data, format='ndjson')
+        self._key_prefix = f"{self.orgid}/{self.name_}\n".encode()
+
+        self.invalid = 0  # messages skipped by decode_or_skip()
+        self._init_metrics()
         
-        super().__init__()
+        # Not inherited from the creating thread, `run.py` creates
+        # inputs in pool threads, which are daemons on Python 3.8
+        super().__init__(daemon=False)
 
 
     def __str__(self):
@@ -73,9 +279,100 @@ class InputPlugin(threading.Thread):
             f"orgid = {self.orgid}, typetag = {self.typetag}, "
             f"timezone = {self.timezone}, period = {self.period}.")
 
-    def exponential_backoff(self, n):
+    def _init_metrics(self):
+        m = self.metrics = Registry({'input': self.name_,
+                                     'plugin': self.plugin})
+        self.timing = {
+            'fetch': m.histogram('cybexp_input_fetch_seconds',
+                                 "Duration of successful fetch() calls."),
+            'post': m.histogram('cybexp_input_post_seconds',
+                                "Duration of successfully posting a batch."),
+        }
+        self._m_fetched = m.counter('cybexp_input_events_fetched_total',
+                                    "Events returned by fetch().")
+        self._m_posted = m.counter('cybexp_input_events_posted_total',
+                                   "Events accepted by the API.")
+        self._m_requests = m.counter('cybexp_input_requests_total',
+                                     "Successful requests to the API.")
+        self._m_bytes = m.counter('cybexp_input_bytes_posted_total',
+                                  "Payload bytes accepted by the API.")
+        self._m_errors = {
+            stage: m.counter(f'cybexp_input_{stage}_errors_total',
+                             f"Failed {stage}() calls.")
+            for stage in ('fetch', 'post')}
+        self._m_backoffs = m.counter('cybexp_input_backoffs_total',
+                                     "Times the input backed off.")
+        self._m_backoff = m.gauge('cybexp_input_backoff_seconds',
+                                  "Current back-off wait, 0 if none.")
+        m.counter('cybexp_input_invalid_total',
+                  "Messages skipped because they could not be parsed.",
+                  lambda: self.invalid)
+        self._m_throttled = m.counter('cybexp_input_throttled_total',
+                                      "429 and 503 answers of the API.")
+        self._m_last_success = m.gauge(
+            'cybexp_input_last_success_timestamp_seconds',
+            "Unix time of the last successful post.")
+        m.gauge('cybexp_input_queue_batches',
+                "Batches waiting in the pipeline queue.",
+                self._queue_batches)
+        if self.dedup is not None:
+            m.counter('cybexp_input_dedup_hits_total',
+                      "Duplicate events dropped.", lambda: self.dedup.hits)
+            m.counter('cybexp_input_dedup_misses_total',
+                      "Events not seen before.", lambda: self.dedup.misses)
+        if self.spool is not None:
+            m.counter('cybexp_input_spool_dropped_total',
+                      "Events dropped because the spool was full.",
+                      lambda: self.spool.dropped)
+            m.gauge('cybexp_input_spool_bytes',
+                    "Bytes in the spool not posted yet.",
+                    lambda: len(self.spool))
+
+    def _queue_batches(self):
+        if self.pipeline_queue is not None:
+            return self.pipeline_queue.qsize()
+        return 0
+
+    def _fetched(self, events, seconds):
+        self.timing['fetch'].observe(seconds)
+        if events:
+            self._m_fetched.inc(len(events) if isinstance(events, list)
+                                else 1)
+
+    def _posted(self, seconds):
+        self.timing['post'].observe(seconds)
+        self._m_last_success.set(time.time())
+
+    def _backoff_seconds(self, n):
         s = min(3600, (2 ** n) + (random.randint(0, 1000) / 1000))
-        self.exit_graceful_event.wait(s)
+        self._m_backoffs.inc()
+        self._m_backoff.set(s)
+        return s
+
+    def exponential_backoff(self, n, event=None):
+        """
+        Wait after the `n` th failure, or until `event` is set
+        (default `exit_graceful_event`).
+        """
+
+        s = self._backoff_seconds(n)
+        if event is None:
+            event = self.exit_graceful_event
+        event.wait(s)
+        self._m_backoff.set(0)
+
+    def _retry_after(self, e, n):
+        """
+        Seconds to wait after the API answered `e` (`RetryAfter`),
+        exponential back-off for the `n` th failure if it didn't say.
+        """
+
+        logging.warning(f"API busy, {e}: '{self.name_}'")
+        self._m_throttled.inc()
+        if e.seconds is None:
+            return self._backoff_seconds(n)
+        self._m_backoff.set(e.seconds)
+        return e.seconds
 
     def fetch(self):
         """
@@ -88,69 +385,342 @@ class InputPlugin(threading.Thread):
         events : dict or str or bytes or list
             If `events` is ``dict``, ``json.dumps(events)`` must not
             raise error. If `events` is ``list``, it may contain
-            ``dict, str, bytes`` but nothing else. `events` cannot
-            be empty.
+            ``dict, str, bytes`` but nothing else. `events` may be
+            an empty list if there is nothing new.
         """
         
         raise NotImplementedError
+
+    def checkpoint(self):
+        """
+        State to save once the events of the last ``fetch()`` are
+        posted.
+
+        Plugins that keep a cursor into their source (last id, ETag,
+        file offset) return it here as a JSON-able dict, and read it
+        back from `saved_state` when they start. ``run()`` calls this
+        right after ``fetch()`` and passes the result to ``commit()``
+        once those events are posted, or written to the spool. The
+        default ``None`` saves nothing.
+        """
+
+        return None
+
+    def commit(self, state):
+        """
+        Save `state` from ``checkpoint()``, its events are posted.
+
+        Writes `checkpoints` if the input config has a
+        ``checkpoint_dir``. Plugins may extend this, e.g. to forget
+        what they no longer need to re-read.
+        """
+
+        if self.checkpoints is not None:
+            self.checkpoints.save(state)
+        self.saved_state = state
+
+    def _commit(self, state):
+        if state is None:
+            return
+        try:
+            self.commit(state)
+        except Exception:
+            logging.error(f"error saving checkpoint: '{self.name_}'",
+                          exc_info=True)
+
+    def drain(self):
+        """
+        Events read from the source that ``fetch()`` did not return
+        yet, e.g. messages queued by a reader thread.
+
+        ``run()`` calls this once when the input exits gracefully and
+        posts (or spools) the events before it stops. It is not called
+        after ``exit_now()``. The default has none.
+
+        Returns
+        -------
+        events : list
+        """
+
+        return []
+
+    def _rest(self):
+        """``drain()`` on a graceful exit, ``[]`` after ``exit_now()``."""
+
+        if self.exit_now_event.is_set():
+            return []
+        try:
+            return self.drain()
+        except Exception:
+            logging.error(f"error draining '{self.name_}'", exc_info=True)
+            return []
         
 
+    def decode(self, message):
+        """
+        Turn one message read from the source into an event.
+
+        Plugins call this for every message (``str`` or ``bytes``).
+        In parsed mode (default) the message is parsed as JSON with the
+        codec of the input, see `plugin.codec`. In raw mode (``raw = True`` in the input
+        config) it is passed through untouched, which saves parsing it
+        here and serializing it again in ``post()``.
+
+        Raw mode can optionally validate messages, set by the input
+        config key ``raw_validate``:
+
+        - ``none`` (default), no check.
+        - ``prefix``, first non-blank character must be ``{`` or ``[``.
+        - ``json``, message must parse as JSON (not cheap).
+
+        Returns
+        -------
+        event : dict or list or str or bytes or None
+            ``None`` if the message failed validation. It is logged
+            and should be skipped.
+        """
+
+        if not self.raw:
+            return self._loads(message)
+
+        if self.raw_validate == 'prefix':
+            head = message.lstrip()[:1]
+            if head not in ('{', '[', b'{', b'['):
+                logging.warning(f"skipping non-JSON message: '{self.name_}'")
+                return None
+        elif self.raw_validate == 'json':
+            try:
+                self._loads(message)
+            except ValueError:
+                logging.warning(f"skipping invalid JSON: '{self.name_}'")
+                return None
+        return message
+
+    def decode_or_skip(self, message):
+        """
+        ``decode()``, but ``None`` for a message that fails to parse.
+
+        Skipped messages are counted in ``self.invalid``, exposed as
+        ``cybexp_input_invalid_total``.
+        """
+
+        try:
+            event = self.decode(message)
+        except ValueError:
+            logging.warning(f"skipping invalid JSON: '{self.name_}'")
+            event = None
+        if event is None:
+            self.invalid += 1
+        return event
+
     def post(self, events):
         """
         Post one or more events to the CYBEX-P API.
 
         Parameters
         ----------
-        events : dict or str or bytes or list
+        events : dict or str or bytes or list or Delivery
             If `events` is `dict`, `json.dumps(events)` must not
             raise error. If `events` is `list`, it may contain
             `dict, str, or bytes` but nothing else. `events` cannot
-            be empty.
+            be empty. A `Delivery` from ``prepare()`` resumes after
+            its last successfully posted request.
 
         Returns
         -------
         api_response : list
             Response of API for posting each event.
 
+        Raises
+        ------
+        plugin.ratelimit.Cancelled
+            ``exit_now()`` was called before every request was posted.
+            A `Delivery` keeps the requests that were not.
+
         Notes
         -----
         General error-handling, including exponential backoff,
         is done in ``self.run()``.
         """
 
-        if not events:
+        if not isinstance(events, Delivery):
+            events = self.prepare(events)
+        delivery = events
+        if delivery.done:
             return
+
+        logging.info(f"posting '{delivery.remaining}' events "
+                     f"from '{self.name_}'")
+
+        while not delivery.done:
+            if self.exit_now_event.is_set():
+                raise Cancelled
+            part = delivery.parts[delivery.cursor]
+            self._post_file(*part)
+            if delivery.digests is not None:
+                for key in delivery.digests[delivery.cursor]:
+                    self.dedup.add(key)
+            delivery.advance()
+            self._m_requests.inc()
+            self._m_posted.inc(part[3])
+            self._m_bytes.inc(len(part[0]))
+
+    def prepare(self, events):
+        """
+        Encode and pack `events` once, for ``post()`` and its retries.
+
+        If the input has a `dedup` cache, events already posted within
+        its window, or repeated in `events`, are dropped here. They are
+        only added to the cache once ``post()`` posted them, so events
+        of a failed post are not dropped when they are fetched again.
+        Payloads of at least
+        `compression_min_bytes` are compressed here too, so retries
+        reuse the compressed bytes.
+
+        Every event gets an idempotency key, the sha256 of the input
+        name, orgid and the encoded event. The keys are sent in the
+        form field ``idempotency_key`` (one per event) and the request
+        header ``Idempotency-Key`` (one per request) so the API can
+        drop events it already stored.
+
+        Returns
+        -------
+        delivery : Delivery
+        """
+
+        if not events:
+            return Delivery([])
         if not isinstance(events, list):
             events = [events]
 
-        logging.info(f"posting '{len(events)}' events from '{self.name_}'")
+        encoded = self._encode(events)
+        digests = None
+        if self.dedup is not None:
+            fresh = {}  # encoded: digest, in order
+            for e in encoded:
+                if e in fresh:  # repeated within `events`
+                    self.dedup.hits += 1
+                    continue
+                key = digest(e)
+                if not self.dedup.seen(key):
+                    fresh[e] = key
+            encoded, digests = list(fresh), []
+
+        parts = []
+        for group, data in self._pack(encoded):
+            if digests is not None:
+                digests.append([fresh[e] for e in group])
+            keys = [self._event_key(e) for e in group]
+            if len(keys) == 1:
+                request_key = keys[0]
+            else:
+                request_key = hashlib.sha256(
+                    "".join(keys).encode()).hexdigest()
+            payload = b"\n".join(group)
+            if self.compress is not None and \
+                    len(payload) >= self.compression_min_bytes:
+                payload = self.compress(payload)
+                data = dict(data, content_encoding=self.compression)
+            parts.append((payload,
+                          dict(data, idempotency_key=keys),
+                          dict(self.headers,
+                               **{"Idempotency-Key": request_key}),
+                          len(group)))
+        return Delivery(parts, digests)
+
+    def _event_key(self, encoded):
+        """Stable idempotency key of one encoded event."""
 
+        return hashlib.sha256(self._key_prefix + encoded).hexdigest()
 
+    def _encode(self, events):
+        """
+        Encode each event to ``bytes``, the way it will be uploaded.
+
+        Dicts are encoded byte for byte like ``json.dumps()``, so the
+        payloads and their idempotency keys are the same whichever JSON
+        codecs a host has. With ``json_exact = False`` in the input
+        config they are encoded as compact JSON by the codec of the
+        input (``json_codec``, fastest installed by default), which is
+        faster but makes the bytes and keys depend on that codec.
+        """
+        
+        dumps = self._dumps
+        encoded = []
         for e in events:
-            if self.exit_now_event.is_set():
-                break
-            
             if isinstance(e, dict):
-                e = json.dumps(e)
-            if isinstance(e, str):
+                e = dumps(e)
+            elif isinstance(e, str):
                 e = e.encode()
-            elif isinstance(event, bytes):
+            elif isinstance(e, bytes):
                 pass
             else:
                 raise TypeError(f"events = '{type(events)}'")
+            encoded.append(e)
+        return encoded
+
+    def _pack(self, encoded):
+        """
+        Group encoded events into upload payloads.
 
-            files = {'file': e}
-            
-            with requests.post(self.post_url, files=files,
-                               headers=self.headers, data=self.data) as r:
-                if r.status_code >= 400:
-                    logging.error((
-                        f"error posting: name = {self.name_}, "
-                        f"status_code = '{r.status_code}', "
-                        f"API response = '{r.content.decode()}'"))
-                    raise Exception
+        Yields ``(events, data)`` pairs, one per HTTP request. Without
+        batching every event is its own payload. With batching events
+        are joined by newlines (NDJSON) until either `batch_max_events`
+        or `batch_max_bytes` would be exceeded. An event that contains
+        a newline itself cannot be framed and is uploaded on its own.
+        """
+
+        if not self.batch:
+            for e in encoded:
+                yield [e], self.data
+            return
+
+        batch, size = [], 0
+        for e in encoded:
+            if b"\n" in e:
+                yield [e], self.data
+                continue
+            if batch and (len(batch) >= self.batch_max_events or
+                          size + len(e) + 1 > self.batch_max_bytes):
+                yield batch, self.batch_data
+                batch, size = [], 0
+            batch.append(e)
+            size += len(e) + 1
+        if batch:
+            yield batch, self.batch_data
+
+    def _post_file(self, payload, data, headers, n_events=1):
+        """
+        Upload one payload to the API `raw` endpoint, within the limits
+        of `limiter`. Raises `plugin.ratelimit.RetryAfter` on a 429 or
+        503 answer.
+        """
+        
+        files = {'file': payload}
+        if self.limiter is None:
+            admission = contextlib.nullcontext()
+        else:
+            admission = self.limiter.request(self.orgid,
+                                             self.exit_now_event)
+        
+        with admission as req, self.session.post(
+                self.post_url, files=files, headers=headers, data=data) as r:
+            if req is not None:
+                req.status_code = r.status_code
+            if r.status_code in (429, 503):
+                raise RetryAfter(parse_retry_after(
+                    r.headers.get('Retry-After'),
+                    maximum=300 if self.limiter is None
+                        else self.limiter.max_retry_after),
+                    r.status_code)
+            if r.status_code >= 400:
+                logging.error((
+                    f"error posting: name = {self.name_}, "
+                    f"status_code = '{r.status_code}', "
+                    f"API response = '{r.content.decode()}'"))
+                raise Exception
 
-                r.close() # redundant?
+            r.close() # redundant?
 
 
     def run(self):
@@ -162,68 +732,372 @@ class InputPlugin(threading.Thread):
             events = self.fetch()
             apis_response = self.post(events)
 
+        If ``pipeline_depth > 0`` fetching and posting run in separate
+        threads joined by a queue of at most `pipeline_depth` batches.
+        ``fetch()`` blocks when the queue is full, so a slow API slows
+        the fetch stage down instead of piling up batches in memory.
+
+        If the input has a `spool`, fetched events are written to it
+        and a drainer thread posts them from the spool instead.
+
+        The ``checkpoint()`` taken after each ``fetch()`` is passed to
+        ``commit()`` once its events are posted (or spooled). On a
+        graceful exit the events of ``drain()`` are posted last.
+
         Notes
         -----
         Does general error handling. Exponentially backs off (1hr max)
         if either ``self.fetch()`` or ``self.post()`` fails.
         """
 
+        if self.spool is not None:
+            self._run_spooled()
+            return
+        if self.pipeline_depth > 0:
+            self._run_pipeline()
+            return
+
         while True:
             if self.exit_graceful_event.is_set() or \
                     self.exit_now_event.is_set():
                 break
 
+            events = self._fetch_retry()
+            if events is None:
+                break
+            state = self.checkpoint()
+            if self._post_retry(events):
+                self._commit(state)
+
+            self.exit_graceful_event.wait(self.period)
+
+        rest = self._rest()
+        if rest:
+            self._post_retry(rest)
+
+    def _run_pipeline(self):
+        """Fetch stage of ``run()``, posting happens in another thread."""
+
+        q = queue.Queue(self.pipeline_depth)
+        self.pipeline_queue = q
+        poster = threading.Thread(target=self._post_stage, args=(q,),
+                                  name=f"{self.name}-post", daemon=True)
+        poster.start()
+
+        while not self.exit_graceful_event.is_set():
+            events = self._fetch_retry()
+            if events is None or \
+                    not self._put_batch(q, (events, self.checkpoint())):
+                break
+            self.exit_graceful_event.wait(self.period)
+
+        rest = self._rest()
+        if rest:
+            self._put_batch(q, (rest, None))
+        self._put_batch(q, _STOP)  # post stage drains the queue, then stops
+        poster.join()
+
+    def _run_spooled(self):
+        """Fetch stage of ``run()`` when events go through the spool."""
+
+        drainer = threading.Thread(target=self._drain_spool,
+                                   name=f"{self.name}-drain", daemon=True)
+        drainer.start()
+
+        try:
+            while not self.exit_graceful_event.is_set():
+                events = self._fetch_retry()
+                if events is None:
+                    break
+                state = self.checkpoint()
+                if events:
+                    if not isinstance(events, list):
+                        events = [events]
+                    self.spool.append(self._encode(events))
+                self._commit(state)
+                self.exit_graceful_event.wait(self.period)
+            rest = self._rest()
+            if rest:
+                self.spool.append(self._encode(rest))
+        finally:
+            drainer.join()
+            self.spool.close()
+
+    def _drain_spool(self):
+        """Post events from the spool until the input exits."""
+
+        n = self.batch_max_events if self.batch else 100
+        while not self.exit_graceful_event.is_set():
+            records, pos = self.spool.read(n, timeout=1)
+            if records and self._post_retry(records):
+                self.spool.commit(pos)
+
+    def _post_stage(self, q):
+        """Post stage of ``run()`` when the pipeline is enabled."""
+
+        while not self.exit_now_event.is_set():
+            try:
+                events = q.get(timeout=1)
+            except queue.Empty:
+                continue
+            if events is _STOP:
+                break
+            events, state = events
+            if self._post_retry(events):
+                self._commit(state)
+
+    def _put_batch(self, q, events):
+        """Put `events` in the pipeline queue, waiting while it is full."""
+
+        while not self.exit_now_event.is_set():
+            try:
+                q.put(events, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fetch_retry(self):
+        """
+        Call ``fetch()`` until it succeeds, backing off between failures.
+
+        Returns ``None`` if the input was asked to exit first.
+        """
+
+        n_failed_fetch = 0
+        while not self.exit_graceful_event.is_set():
+            try:
+                t = time.perf_counter()
+                events = self.fetch()
+                self._fetched(events, time.perf_counter() - t)
+                return events
+            except KeyboardInterrupt:
+                self.exit_now()
+            except NotImplementedError:
+                logging.error(f"fetch() not implemented: '{self.plugin}'!")
+                self.exit_now()
+            except:
+                logging.error(f"error fetching '{self.name_}'!",
+                              exc_info=True)
+                self._m_errors['fetch'].inc()
+                n_failed_fetch += 1
+                self.exponential_backoff(n_failed_fetch)
+        return None
+
+    def _post_retry(self, events):
+        """
+        Call ``post(events)`` until it succeeds, backing off between
+        failures. Returns ``True`` only if every event was posted,
+        ``False`` if the input was asked to exit first.
+
+        `events` are encoded once, retries only post the requests that
+        did not succeed yet. Back-off only ends early on ``exit_now()``,
+        so the drain after ``exit_graceful()`` still waits between
+        failures.
+        """
+
+        n_failed_post = 0
+        delivery = events if isinstance(events, Delivery) else None
+        while not self.exit_now_event.is_set():
+            try:
+                t = time.perf_counter()
+                if delivery is None:
+                    delivery = self.prepare(events)
+                self.post(delivery)
+                self._posted(time.perf_counter() - t)
+                return delivery.done
+            except KeyboardInterrupt:
+                self.exit_now()
+            except Cancelled:
+                break
+            except RetryAfter as e:
+                n_failed_post += 1
+                self.exit_now_event.wait(self._retry_after(e, n_failed_post))
+                self._m_backoff.set(0)
+            except:
+                logging.error(f"error posting: '{self.name_}'", exc_info=True)
+                self._m_errors['post'].inc()
+                n_failed_post += 1
+                self.exponential_backoff(n_failed_post, self.exit_now_event)
+        return False
+
+    async def afetch(self):
+        """
+        Async version of ``fetch()`` used by the asyncio runtime.
+
+        Plugins may override this with a native coroutine. The default
+        runs the synchronous ``fetch()`` in the runtime thread pool.
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.fetch)
+
+    async def apost(self, events):
+        """
+        Async version of ``post()`` used by the asyncio runtime.
+
+        The default runs the synchronous ``post()`` in the runtime
+        thread pool.
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.post, events)
+
+    async def _await_exit(self, timeout, now=False):
+        """
+        Coroutine version of ``self.exit_graceful_event.wait()``, or of
+        ``self.exit_now_event.wait()`` if `now`.
+        """
+
+        event = self._aexit_now_event if now else self._aexit_graceful_event
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _abackoff(self, n, now=False):
+        await self._await_exit(self._backoff_seconds(n), now)
+        self._m_backoff.set(0)
+
+    async def arun(self, executor=None):
+        """
+        Coroutine version of ``run()``, see `plugin.aio.AsyncRuntime`.
+
+        Parameters
+        ----------
+        executor : concurrent.futures.Executor, optional
+            Runs synchronous ``fetch()`` and ``post()``.
+
+        Notes
+        -----
+        Inputs with a `spool` or a `pipeline_depth` need threads for
+        their stages, so their whole ``run()`` runs in a thread of its
+        own rather than holding a worker of `executor` for good.
+        """
+
+        if self.spool is not None or self.pipeline_depth > 0:
+            loop = asyncio.get_running_loop()
+            done = loop.create_future()
+            threading.Thread(target=self._run_thread, args=(loop, done),
+                             name=f"{self.name}-run", daemon=True).start()
+            await done
+            return
+
+        self._executor = executor
+        self._aexit_graceful_event = asyncio.Event()
+        self._aexit_now_event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        if self.exit_graceful_event.is_set():
+            self._aexit_graceful_event.set()
+        if self.exit_now_event.is_set():
+            self._aexit_now_event.set()
+
+        while not self.exit_graceful_event.is_set():
             n_failed_fetch = 0
-            while True:
+            while not self.exit_graceful_event.is_set():
                 if self.exit_now_event.is_set():
-                    break
-                
+                    return
                 try:
-                    events = self.fetch()
+                    t = time.perf_counter()
+                    events = await self.afetch()
+                    self._fetched(events, time.perf_counter() - t)
+                    state = self.checkpoint()
                     break
-                except KeyboardInterrupt:
-                    self.exit()
                 except NotImplementedError:
-                    logging.error("fetch() not implemented: '{self.plugin}'!")
-                    self.exit()
-                except:
-                    logging.error("error fetching '{self.name_}'!",
+                    logging.error(f"fetch() not implemented: '{self.plugin}'!")
+                    self.exit_now()
+                    return
+                except Exception:
+                    logging.error(f"error fetching '{self.name_}'!",
                                   exc_info=True)
+                    self._m_errors['fetch'].inc()
                     n_failed_fetch += 1
-
-                if n_failed_fetch > 0:
-                    self.exponential_backoff(n_failed_fetch)
+                await self._abackoff(n_failed_fetch)
+            else:  # exit_graceful() while fetch() was failing
+                break
 
             n_failed_post = 0
+            delivery = None
             while True:
                 if self.exit_now_event.is_set():
-                    break
-            
+                    return
                 try:
-                    api_response = self.post(events)
+                    t = time.perf_counter()
+                    if delivery is None:
+                        delivery = self.prepare(events)
+                    await self.apost(delivery)
+                    self._posted(time.perf_counter() - t)
+                    if not delivery.done:  # interrupted
+                        return
+                    self._commit(state)
                     break
-                except KeyboardInterrupt:
-                    self.exit()
-                except:
-                    logging.error("error posting: '{self.name_}'", exc_info=True)
+                except Cancelled:
+                    return
+                except RetryAfter as e:
+                    n_failed_post += 1
+                    await self._await_exit(self._retry_after(e, n_failed_post),
+                                           now=True)
+                    self._m_backoff.set(0)
+                    continue
+                except Exception:
+                    logging.error(f"error posting: '{self.name_}'",
+                                  exc_info=True)
+                    self._m_errors['post'].inc()
                     n_failed_post += 1
+                await self._abackoff(n_failed_post, now=True)
 
-                if n_failed_post > 0:
-                    self.exponential_backoff(n_failed_post)
+            await self._await_exit(self.period)
 
-            self.exit_graceful_event.wait(self.period)
-        
+        loop = asyncio.get_running_loop()
+        rest = await loop.run_in_executor(executor, self._rest)
+        if rest:
+            await loop.run_in_executor(executor, self._post_retry, rest)
+
+    def _run_thread(self, loop, done):
+        """``run()`` for ``arun()``, the result is set on `done`."""
+
+        try:
+            self.run()
+        except BaseException as e:
+            loop.call_soon_threadsafe(done.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(done.set_result, None)
+
+    def _wake_loop(self, now=False):
+        """Wake ``arun()`` if it is waiting on the asyncio runtime."""
+
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._aexit_graceful_event.set)
+            if now:
+                self._loop.call_soon_threadsafe(self._aexit_now_event.set)
 
     def exit_graceful(self):
         "Shutdown the input plugin gracefully."""
         
         self.exit_graceful_event.set()
+        self._wake_loop()
         
     def exit_now(self):
         """Shutdown the input plugin immediately."""
         
         self.exit_graceful_event.set()
         self.exit_now_event.set()
+        self._wake_loop(now=True)
+        try:
+            self.interrupt()
+        except Exception:
+            logging.warning(f"error interrupting '{self.name_}'",
+                            exc_info=True)
+
+    def interrupt(self):
+        """
+        Unblock I/O the plugin may be blocked in, called by
+        ``exit_now()`` from another thread.
+
+        Plugins that block on a socket or a file (e.g. waiting for a
+        message) override this to close it, so ``fetch()`` returns or
+        raises right away. The default does nothing.
+        """
 
         
         
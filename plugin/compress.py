@@ -0,0 +1,45 @@
+"""Compression of uploaded payloads."""
+
+import gzip
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def get_compressor(name, level=None):
+    """
+    Get a compression function by name.
+
+    Parameters
+    ----------
+    name : {"gzip", "zstd"}
+        ``zstd`` needs the optional ``zstandard`` package. Without it
+        ``gzip`` is used instead.
+    level : int, optional
+        Compression level, defaults to a fast level of each codec.
+
+    Returns
+    -------
+    encoding : str
+        Name of the codec actually used, sent to the API so it knows
+        how to decompress.
+    compress : callable
+        Takes and returns ``bytes``.
+    """
+
+    if name == "zstd":
+        if zstandard is not None:
+            compressor = zstandard.ZstdCompressor(
+                level=3 if level is None else level)
+            return "zstd", compressor.compress
+        logging.warning("zstandard is not installed, using gzip!")
+        name = "gzip"
+
+    if name == "gzip":
+        level = 6 if level is None else level
+        return "gzip", lambda b: gzip.compress(b, compresslevel=level)
+
+    raise ValueError(f"Unknown compression: '{name}'!")
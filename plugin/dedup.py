@@ -0,0 +1,158 @@
+"""Drop events that were already posted a short while ago."""
+
+import collections
+import hashlib
+import math
+import time
+
+
+def digest(encoded):
+    """128 bit content hash of an encoded event."""
+
+    return hashlib.blake2b(encoded, digest_size=16).digest()
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over 128 bit digests.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of items the filter is sized for.
+    error_rate : float, default=0.001
+        False positive rate at `capacity` items.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.n_bits = max(8, int(-capacity * math.log(error_rate) /
+                                 (math.log(2) ** 2)))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: h1 + i*h2 from the two halves of the digest.
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7))
+                   for p in self._positions(key))
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class DedupCache:
+    """
+    Remember content hashes of recently posted events.
+
+    ``seen()`` checks a digest, ``add()`` remembers it once its event
+    was posted. A digest expires `window` seconds after it was first
+    added, repeats do not extend that, so an event resent more often
+    than `window` still gets through once per window.
+
+    By default an ordered dict of at most `max_entries` digests is
+    kept, the oldest are dropped first. With `bloom_capacity` two
+    rotating Bloom filters are used instead, for windows too large to
+    keep every digest. A filter is retired once it is older than
+    `window` or holds `bloom_capacity` digests, so repeats are caught
+    for one to two windows (with rare false positives).
+
+    Parameters
+    ----------
+    window : float, default=600
+        Seconds within which a repeated event is dropped.
+    max_entries : int, default=100000
+    bloom_capacity : int, optional
+    """
+
+    def __init__(self, window=600, max_entries=100000, bloom_capacity=None):
+        self.window = window
+        self.max_entries = max_entries
+        self.bloom_capacity = bloom_capacity
+        self.hits = 0
+        self.misses = 0
+
+        self._lru = collections.OrderedDict()  # digest: first added
+        if bloom_capacity:
+            self._blooms = [BloomFilter(bloom_capacity),
+                            BloomFilter(bloom_capacity)]
+            self._bloom_start = time.monotonic()
+
+    def seen(self, key):
+        """
+        Check one event, without remembering it.
+
+        Parameters
+        ----------
+        key : bytes
+            `digest` of the encoded event.
+
+        Returns
+        -------
+        seen : bool
+            ``True`` if `key` was added within the window.
+        """
+
+        now = time.monotonic()
+        if self.bloom_capacity:
+            current, previous = self._rotate_bloom(now)
+            hit = key in current or key in previous
+        else:
+            self._expire_lru(now)
+            hit = key in self._lru
+
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return hit
+
+    def add(self, key):
+        """Remember `key`, a `digest`, if it is not remembered yet."""
+
+        now = time.monotonic()
+        if self.bloom_capacity:
+            current, previous = self._rotate_bloom(now)
+            if key not in current and key not in previous:
+                current.add(key)
+            return
+
+        lru = self._lru
+        self._expire_lru(now)
+        if key in lru:
+            return
+        lru[key] = now
+        if len(lru) > self.max_entries:
+            lru.popitem(last=False)
+
+    def _expire_lru(self, now):
+        lru = self._lru
+        while lru:
+            oldest, t = next(iter(lru.items()))
+            if now - t <= self.window:
+                break
+            del lru[oldest]
+
+    def _rotate_bloom(self, now):
+        current = self._blooms[0]
+        age = now - self._bloom_start
+        if age > 2 * self.window:  # both filters are stale
+            current = BloomFilter(self.bloom_capacity)
+        if age > self.window or current.count >= self.bloom_capacity:
+            self._blooms = [BloomFilter(self.bloom_capacity), current]
+            self._bloom_start = now
+        return self._blooms
+
+    def stats(self):
+        """Hits, misses and hit rate of this cache."""
+
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
@@ -0,0 +1,363 @@
+"""File and directory tail input plugin."""
+
+import collections
+import glob
+import logging
+import os
+import threading
+
+from .common import InputPlugin, _option
+
+
+def _file_key(st):
+    """Identity of a file that survives renames, ``"<dev>:<inode>"``."""
+
+    return f"{st.st_dev}:{st.st_ino}"
+
+
+class _TailedFile:
+    """An open file being tailed, and how far it was read."""
+
+    __slots__ = ('key', 'path', 'f', 'offset', 'pending', 'skipping')
+
+    def __init__(self, key, path, f, offset):
+        self.key = key
+        self.path = path
+        self.f = f
+        self.offset = offset  # end of the last complete line read
+        self.pending = b""  # start of a line not complete yet
+        self.skipping = False  # in a line over `max_line_bytes`
+
+    def __repr__(self):
+        return f"_TailedFile({self.path!r}, offset={self.offset})"
+
+
+class FileTail(InputPlugin):
+    """
+    Tail local log files, e.g. Cowrie JSON lines or syslog files.
+
+    Every line is one event. Files are read with large buffered reads,
+    new data is noticed through inotify (watchdog) or, without it, by
+    polling.
+
+    Input config keys, besides those of `InputPlugin`:
+
+    - ``path``, a file or a glob pattern like ``/var/log/cowrie/*.json``.
+      Files that show up later are tailed from their start.
+    - ``format``, ``json`` (default) parses every line with
+      ``decode()``, ``text`` posts ``{"message": line}``.
+    - ``start_at``, ``end`` (default) or ``beginning``, where to start
+      files that exist when the input first starts (no checkpoint).
+    - ``read_bytes``, read size, default 1 MiB.
+    - ``max_line_bytes``, longer lines are skipped, default 1 MiB.
+    - ``poll``, seconds between checks for new data and files when
+      there are no file events, default 1.
+
+    Files are tracked by device and inode, so a log rotated by rename
+    (``cowrie.json`` to ``cowrie.json.1``) is read to its end before it
+    is let go, and the new file is read from the start. A file that
+    gets shorter than the offset read (``copytruncate``) is read again
+    from the start.
+
+    The offset of the last line of every file posted is saved with
+    ``checkpoint_dir`` in the input config (see
+    ``InputPlugin.checkpoint()``), so a restart resumes after it,
+    also in a file rotated since. Lines that are not valid JSON are
+    logged, counted in ``cybexp_input_invalid_total`` and skipped,
+    see ``InputPlugin.decode_or_skip()``.
+    """
+
+    def __init__(self, input_config, api_raw_url, api_token,
+                 session=None, limiter=None):
+        self.path = os.path.abspath(
+            os.path.expanduser(input_config['data']['path'][0]))
+        self.format = _option(input_config, 'format', 'json')
+        if self.format not in ('json', 'text'):
+            raise ValueError(f"Invalid format: '{self.format}'!")
+        self.start_at = _option(input_config, 'start_at', 'end')
+        if self.start_at not in ('beginning', 'end'):
+            raise ValueError(f"Invalid start_at: '{self.start_at}'!")
+        self.read_bytes = int(_option(input_config, 'read_bytes', 1048576))
+        self.max_line_bytes = int(_option(input_config, 'max_line_bytes',
+                                          1048576))
+        self.poll = float(_option(input_config, 'poll', 1))
+
+        super().__init__(input_config, api_raw_url, api_token, session,
+                         limiter)
+
+        self._files = {}  # key: _TailedFile
+        self._lines = collections.deque()  # (key, line, end offset)
+        self._posted = {}  # key: offset of the last line in a batch
+        self._wake = threading.Event()
+        self._observer = None
+        self._started = False
+        self._checkpointed = None  # last state from checkpoint()
+
+    def fetch(self):
+        if not self._started:
+            self._start()
+
+        if self._lines:
+            self._check_truncation()
+        batch = self.flush.batch()
+        while not self.exit_graceful_event.is_set():
+            while self._lines and not batch.full():
+                key, line, end = self._lines.popleft()
+                self._posted[key] = end
+                event = self._event(line)
+                if event is not None:
+                    batch.add(event, len(line))
+            if batch.ready():
+                break
+            if not self._read():
+                self._wake.wait(min(batch.remaining(), self.poll))
+                self._wake.clear()
+                self._scan()
+        return batch.close()
+
+    def checkpoint(self):
+        state = {"files": {
+            key: {"path": tf.path, "offset": self._posted[key]}
+            for key, tf in self._files.items() if key in self._posted}}
+        if state == self._checkpointed:
+            return None
+        self._checkpointed = state
+        return state
+
+    def interrupt(self):
+        self._wake.set()
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            self._stop()
+
+    async def arun(self, executor=None):
+        try:
+            await super().arun(executor)
+        finally:
+            self._stop()
+
+    def _event(self, line):
+        line = line.rstrip(b"\r")
+        if not line.strip():
+            return None
+        if self.format == 'text':
+            return {"message": line.decode('utf-8', 'replace')}
+        return self.decode_or_skip(line)
+
+    def _start(self):
+        self._started = True
+        saved = self.saved_state.get("files")
+        if saved:
+            self._resume(saved)
+        # Files that show up while the input was down are new
+        self._scan(self.start_at == 'end' and saved is None)
+        self._watch()
+
+    def _resume(self, saved):
+        """Open the files of a checkpoint, wherever they are now."""
+
+        for key, info in saved.items():
+            path = info["path"]
+            if not self._same_file(path, key):
+                path = self._find_rotated(os.path.dirname(path), key)
+            if path is None:
+                logging.warning(f"file of checkpoint is gone: "
+                                f"'{info['path']}' in '{self.name_}'")
+                continue
+            self._open(path, info["offset"])
+
+    @staticmethod
+    def _same_file(path, key):
+        try:
+            return _file_key(os.stat(path)) == key
+        except OSError:
+            return False
+
+    @staticmethod
+    def _find_rotated(directory, key):
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and \
+                            _file_key(entry.stat()) == key:
+                        return entry.path
+        except OSError:
+            pass
+        return None
+
+    def _open(self, path, offset):
+        try:
+            f = open(path, 'rb', buffering=0)
+        except OSError as e:
+            logging.warning(f"cannot open '{path}': {e}")
+            return
+        st = os.fstat(f.fileno())
+        key = _file_key(st)
+        if key in self._files:
+            f.close()
+            return
+        if offset > st.st_size:
+            logging.info(f"truncated, reading from start: '{path}'")
+            offset = 0
+        f.seek(offset)
+        self._files[key] = _TailedFile(key, path, f, offset)
+        self._posted.setdefault(key, offset)
+
+    def _scan(self, at_end=False):
+        """
+        Open new files matching `path`, follow renames, and let go of
+        rotated files that are read to their end.
+        """
+
+        current = {}
+        for path in glob.glob(self.path):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path):
+                current[_file_key(st)] = (path, st.st_size)
+
+        for key, (path, size) in current.items():
+            tf = self._files.get(key)
+            if tf is None:
+                self._open(path, size if at_end else 0)
+            elif tf.path != path:
+                tf.path = path
+
+        for key, tf in list(self._files.items()):
+            if key in current:
+                continue
+            if self._drain(tf):  # rotated away, read what's left
+                continue
+            if any(k == key for k, _, _ in self._lines):
+                continue
+            tf.f.close()
+            del self._files[key]
+            self._posted.pop(key, None)
+
+    def _drain(self, tf):
+        """Read `tf` once, ``True`` if it had more lines."""
+
+        n = len(self._lines)
+        self._read_file(tf)
+        return len(self._lines) > n
+
+    def _read(self):
+        """Read every file once, ``True`` if any had new data."""
+
+        more = False
+        for tf in list(self._files.values()):
+            more |= self._read_file(tf)
+        return more
+
+    def _read_file(self, tf):
+        """Read `tf` once, ``True`` if there was new data."""
+
+        fd = tf.f.fileno()
+        try:
+            size = os.fstat(fd).st_size
+        except OSError:
+            return False
+        if not self._truncated(tf, size) and \
+                size == tf.offset + len(tf.pending):
+            return False
+
+        data = tf.f.read(self.read_bytes)
+        if not data:
+            return False
+        data = tf.pending + data
+        last = data.rfind(b"\n")
+        if last < 0:
+            tf.pending = data
+            if len(tf.pending) > self.max_line_bytes:
+                self._skip_line(tf, len(tf.pending))
+            return True
+
+        offset = tf.offset
+        start = 0
+        if tf.skipping:  # the end of a skipped line
+            start = data.index(b"\n") + 1
+            offset += start
+            tf.skipping = False
+        while start <= last:
+            end = data.index(b"\n", start)
+            offset += end - start + 1
+            if end - start <= self.max_line_bytes:
+                self._lines.append((tf.key, data[start:end], offset))
+            else:
+                logging.warning(f"skipping line over max_line_bytes in "
+                                f"'{tf.path}'")
+            start = end + 1
+        tf.offset = offset
+        tf.pending = data[last + 1:]
+        return True
+
+    def _truncated(self, tf, size):
+        """
+        Read `tf` from the start if it is shorter than what was read
+        (``copytruncate``), ``True`` if it was.
+        """
+
+        if size >= tf.offset + len(tf.pending):
+            return False
+        logging.info(f"truncated, reading from start: '{tf.path}'")
+        tf.f.seek(0)
+        tf.offset, tf.pending, tf.skipping = 0, b"", False
+        self._posted[tf.key] = 0
+        # Their offsets are in the old content, not the new one
+        self._lines = collections.deque(
+            item for item in self._lines if item[0] != tf.key)
+        return True
+
+    def _check_truncation(self):
+        """Drop buffered lines of files truncated since they were read."""
+
+        for tf in list(self._files.values()):
+            try:
+                size = os.fstat(tf.f.fileno()).st_size
+            except OSError:
+                continue
+            self._truncated(tf, size)
+
+    def _skip_line(self, tf, n):
+        logging.warning(f"skipping line over max_line_bytes in '{tf.path}'")
+        tf.offset += n
+        tf.pending = b""
+        tf.skipping = True
+
+    def _watch(self):
+        """Wake ``fetch()`` on file events in the directory of `path`."""
+
+        directory = os.path.dirname(self.path)
+        if glob.has_magic(directory) or not os.path.isdir(directory):
+            return
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            logging.warning(f"watchdog not installed, polling every "
+                            f"{self.poll}s: '{self.name_}'")
+            return
+
+        wake = self._wake
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wake.set()
+
+        self._observer = Observer()
+        self._observer.schedule(Handler(), directory)
+        self._observer.daemon = True
+        self._observer.start()
+
+    def _stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        for tf in self._files.values():
+            tf.f.close()
+        self._files.clear()
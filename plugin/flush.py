@@ -0,0 +1,121 @@
+"""When a plugin should stop collecting messages and return a batch."""
+
+import time
+
+
+class Batch:
+    """
+    Messages collected by one ``fetch()`` under a `FlushPolicy`.
+
+    Use ``add()`` for every message, and return `events` once
+    ``ready()`` is ``True``. Plugins that wait for messages can block
+    for at most ``remaining()`` seconds.
+    """
+
+    __slots__ = ('policy', 'events', 'nbytes', 'start', 'max_events')
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.events = []
+        self.nbytes = 0
+        self.start = time.monotonic()
+        self.max_events = policy.current_max_events
+
+    def __len__(self):
+        return len(self.events)
+
+    def add(self, event, nbytes=None):
+        """
+        Add one event. `nbytes` defaults to ``len(event)`` for ``str``
+        and ``bytes`` and 0 otherwise.
+        """
+
+        if nbytes is None:
+            nbytes = len(event) if isinstance(event, (str, bytes)) else 0
+        self.events.append(event)
+        self.nbytes += nbytes
+
+    def full(self):
+        return len(self.events) >= self.max_events or (
+            self.policy.max_bytes is not None and
+            self.nbytes >= self.policy.max_bytes)
+
+    def remaining(self):
+        """Seconds until the batch must be flushed because of linger."""
+
+        return max(0.0, self.policy.max_linger -
+                   (time.monotonic() - self.start))
+
+    def ready(self):
+        """``True`` if the batch is full or has lingered long enough."""
+
+        return self.full() or self.remaining() <= 0
+
+    def close(self):
+        """
+        Finish the batch and let an adaptive policy learn from it.
+
+        Returns
+        -------
+        events : list
+        """
+
+        self.policy._learn(self)
+        return self.events
+
+
+class FlushPolicy:
+    """
+    Count, bytes and time limits of a batch of fetched events.
+
+    A batch is flushed as soon as it has `max_events` events,
+    `max_bytes` bytes, or is `max_linger` seconds old, whichever comes
+    first. With `adaptive` the event limit grows (doubling, up to
+    `adaptive_max_events`) while batches keep filling up before the
+    linger time, and shrinks back towards `max_events` once they
+    don't, so high-rate sources get big batches and low-rate sources
+    are not held back.
+
+    Every `InputPlugin` has one as ``self.flush``, built from the
+    optional input config keys ``flush_max_events``,
+    ``flush_max_bytes``, ``flush_max_linger``, ``flush_adaptive`` and
+    ``flush_adaptive_max_events``.
+
+    Examples
+    --------
+    ::
+
+        batch = self.flush.batch()
+        while not batch.ready():
+            batch.add(read_one_message(timeout=batch.remaining()))
+        return batch.close()
+    """
+
+    def __init__(self, max_events=10, max_bytes=None, max_linger=15.0,
+                 adaptive=False, adaptive_max_events=1000):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.max_linger = max_linger
+        self.adaptive = adaptive
+        self.adaptive_max_events = max(adaptive_max_events, max_events)
+        self.current_max_events = max_events
+
+    def __repr__(self):
+        return (f"FlushPolicy(max_events={self.current_max_events}, "
+                f"max_bytes={self.max_bytes}, "
+                f"max_linger={self.max_linger})")
+
+    def batch(self):
+        """Start collecting a new batch."""
+
+        return Batch(self)
+
+    def _learn(self, batch):
+        if not self.adaptive:
+            return
+        if len(batch) >= batch.max_events and batch.remaining() > 0:
+            self.current_max_events = min(self.adaptive_max_events,
+                                          self.current_max_events * 2)
+        elif len(batch) < batch.max_events // 4:
+            self.current_max_events = max(self.max_events,
+                                          self.current_max_events // 2)
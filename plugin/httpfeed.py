@@ -0,0 +1,270 @@
+"""HTTP feed polling input plugin."""
+
+import codecs
+import json
+import logging
+import math
+import re
+import requests
+import time
+
+from .common import InputPlugin, _option
+
+
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def iter_records(chunks, max_record_bytes=16777216):
+    """
+    Records of a streamed JSON document, one at a time.
+
+    The document is either a top-level array, whose items are the
+    records, or a sequence of JSON values such as NDJSON. Only the
+    record being parsed is kept in memory.
+
+    Parameters
+    ----------
+    chunks : iterable of str
+        The document, in pieces of any size.
+    max_record_bytes : int, default=16 MiB
+        A record that does not parse within this many characters is
+        invalid, rather than read to the end of the document.
+
+    Yields
+    ------
+    record : object
+        The parsed record.
+    text : str
+        The record as it appears in the document.
+    """
+
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf, pos = "", 0
+    in_array = None
+    eof = False
+
+    while True:
+        pos = _SEPARATORS.match(buf, pos).end()
+        if pos < len(buf):
+            if in_array is None:
+                in_array = buf[pos] == "["
+                if in_array:
+                    pos += 1
+                    continue
+            if in_array and buf[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof or len(buf) - pos > max_record_bytes:
+                    raise ValueError(f"Invalid JSON record at "
+                                     f"'{buf[pos:pos + 50]}'") from None
+            else:
+                if end < len(buf) or eof:  # a number may go on
+                    yield record, buf[pos:end]
+                    pos = end
+                    continue
+        elif eof:
+            if in_array:
+                raise ValueError("JSON array is not closed!")
+            return
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+        else:
+            buf, pos = buf[pos:] + chunk, 0
+
+
+def cursor_key(value):
+    """
+    Sort key of a cursor value, ``None`` if it cannot be compared.
+
+    Numbers and numeric strings (``42``, ``"42"``) compare as numbers
+    and before any other string, so a feed that mixes ids of both
+    types, or a cursor saved as a string, still compares. Other
+    strings, e.g. ISO 8601 timestamps, compare as strings.
+    """
+
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return (0, value) if math.isfinite(value) else None
+    if isinstance(value, str):
+        for number in (int, float):
+            try:
+                n = number(value)
+            except ValueError:
+                continue
+            if math.isfinite(n):
+                return (0, n)
+        return (1, value)
+    return None
+
+
+class HttpFeed(InputPlugin):
+    """
+    Poll a threat feed over HTTP every `period` seconds (default 300).
+
+    The feed is JSON: a top-level array of records or NDJSON. It is
+    downloaded as a stream, parsed one record at a time, and posted in
+    batches as per the flush policy (see `plugin.flush.FlushPolicy`),
+    so a large feed is never held in memory whole.
+
+    Polls are conditional. The ``ETag`` and ``Last-Modified`` of the
+    last download are sent back as ``If-None-Match`` and
+    ``If-Modified-Since``, and a ``304 Not Modified`` posts nothing.
+
+    Input config keys, besides those of `InputPlugin`:
+
+    - ``url``, the feed.
+    - ``cursor_field``, optional. Record key that grows with every new
+      record, e.g. an id or an ISO 8601 timestamp. Records not above
+      the largest value already posted are skipped, values are
+      compared by `cursor_key`. Records whose value cannot be
+      compared (e.g. a list) are skipped with a warning.
+    - ``cursor_param``, optional. Query parameter to send that
+      largest value in, for feeds that can filter (e.g. ``since``).
+    - ``http_headers``, optional dict of request headers, e.g. an
+      API key of the feed.
+    - ``http_timeout``, seconds to connect and between reads,
+      default 30.
+
+    The ETag, Last-Modified and cursor are saved after the whole
+    poll is posted (see ``InputPlugin.checkpoint()``), with
+    ``checkpoint_dir`` in the input config they survive restarts. If
+    a poll breaks off, the next one starts over with the old cursor;
+    records posted again have the same idempotency keys.
+    """
+
+    def __init__(self, input_config, api_raw_url, api_token,
+                 session=None, limiter=None):
+        self.url = input_config['data']['url'][0]
+        self.cursor_field = _option(input_config, 'cursor_field')
+        self.cursor_param = _option(input_config, 'cursor_param')
+        self.http_headers = dict(_option(input_config, 'http_headers', {}))
+        self.http_timeout = float(_option(input_config, 'http_timeout', 30))
+        self.feed_session = requests.Session()
+
+        super().__init__(input_config, api_raw_url, api_token, session,
+                         limiter)
+
+        # `run()` waits `period` after every batch, polls wait it here
+        self.poll_period = float(_option(input_config, 'period', 300))
+        self.period = 0
+        self._next_poll = 0.0
+        self._state = dict(self.saved_state)  # of the last complete poll
+        self._pending = None  # state once the current poll is posted
+        self._records = None  # records of the current poll
+        self._response = None
+
+    def fetch(self):
+        if self._records is None:
+            delay = self._next_poll - time.monotonic()
+            if delay > 0 and self.exit_graceful_event.wait(delay):
+                return []
+            self._next_poll = time.monotonic() + self.poll_period
+            self._records = self._poll()
+
+        batch = self.flush.batch()
+        try:
+            for event, nbytes in self._records:
+                batch.add(event, nbytes)
+                if batch.full() or self.exit_graceful_event.is_set():
+                    break
+            else:
+                self._records = None
+        except BaseException:
+            self._end_poll()
+            raise
+        return batch.close()
+
+    def checkpoint(self):
+        state, self._pending = self._pending, None
+        return state
+
+    def interrupt(self):
+        """Close the download so a blocked read returns."""
+
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def _end_poll(self):
+        self._records = None
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def _request_headers(self):
+        headers = dict(self.http_headers)
+        if self._state.get('etag'):
+            headers['If-None-Match'] = self._state['etag']
+        if self._state.get('last_modified'):
+            headers['If-Modified-Since'] = self._state['last_modified']
+        return headers
+
+    def _poll(self):
+        """
+        Download the feed once, yielding ``(event, nbytes)`` of every
+        new record. Sets `_pending` once the download is complete.
+        """
+
+        params = None
+        cursor = self._state.get('cursor')
+        if self.cursor_param and cursor is not None:
+            params = {self.cursor_param: cursor}
+
+        r = self.feed_session.get(self.url, params=params,
+                                  headers=self._request_headers(),
+                                  stream=True, timeout=self.http_timeout)
+        self._response = r
+        if r.status_code == 304:
+            logging.debug(f"feed not modified: '{self.name_}'")
+            self._end_poll()
+            return
+        if r.status_code >= 400:
+            logging.error((
+                f"error fetching: name = {self.name_}, "
+                f"status_code = '{r.status_code}', url = '{self.url}'"))
+            self._end_poll()
+            raise Exception
+
+        # JSON is UTF-8 (RFC 8259), even if served as text/* which
+        # requests would decode as ISO-8859-1
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        chunks = (decoder.decode(chunk)
+                  for chunk in r.iter_content(chunk_size=65536))
+
+        start = None if cursor is None else cursor_key(cursor)
+        largest, largest_key = cursor, start
+        for record, text in iter_records(chunks):
+            if self.cursor_field is not None:
+                value = record.get(self.cursor_field) \
+                    if isinstance(record, dict) else None
+                key = None if value is None else cursor_key(value)
+                if value is None:
+                    pass
+                elif key is None:
+                    logging.warning(f"cannot compare {self.cursor_field} "
+                                    f"= {value!r}, skipping record: "
+                                    f"'{self.name_}'")
+                    continue
+                elif start is not None and key <= start:
+                    continue
+                elif largest_key is None or key > largest_key:
+                    largest, largest_key = value, key
+            if self.raw:
+                event = self.decode(text)
+                if event is None:
+                    continue
+            else:
+                event = record
+            yield event, len(text)
+
+        self._state = {'etag': r.headers.get('ETag'),
+                       'last_modified': r.headers.get('Last-Modified'),
+                       'cursor': largest}
+        self._pending = dict(self._state)
+        self._end_poll()
@@ -0,0 +1,400 @@
+"""Syslog and raw TCP/UDP listener input plugin."""
+
+import collections
+import logging
+import re
+import selectors
+import socket
+import sys
+
+from .common import InputPlugin, _option
+
+
+# Cumulative count of datagrams the kernel dropped because the receive
+# buffer was full, attached to received datagrams (Linux >= 2.6.33)
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL',
+                      40 if sys.platform.startswith('linux') else None)
+
+_RFC5424 = re.compile(
+    rb"1 (?P<timestamp>\S+) (?P<hostname>\S+) (?P<app_name>\S+) "
+    rb"(?P<procid>\S+) (?P<msgid>\S+) ?")
+
+
+def split_frames(data, framing='auto', max_message_bytes=65536):
+    """
+    Split received TCP data into syslog messages (RFC 6587).
+
+    Parameters
+    ----------
+    data : bytes or bytearray
+        Data received and not split yet.
+    framing : {'auto', 'octet', 'newline'}, default='auto'
+        ``octet`` is octet counting (``"<length> <message>"``),
+        ``newline`` is one message per line. ``auto`` tells them
+        apart by the first character of every frame, a digit starts
+        an octet-counted frame, ``<`` (the syslog priority) a line.
+    max_message_bytes : int, default=64 KiB
+
+    Returns
+    -------
+    messages : list of bytes
+    rest : bytes or bytearray or None
+        The start of a message not received in full yet. ``None`` if
+        the data after `messages` is not a valid frame (a bad octet
+        count, or a message over `max_message_bytes`), the sender
+        should be disconnected.
+    """
+
+    messages = []
+    pos, n = 0, len(data)
+    while pos < n:
+        if data[pos] in b"\r\n":  # trailer of an octet-counted frame
+            pos += 1
+            continue
+        if framing == 'octet' or (framing == 'auto' and
+                                  48 <= data[pos] <= 57):
+            space = data.find(b" ", pos, pos + 11)
+            if space < 0:
+                if n - pos > 10 or not data[pos:].isdigit():
+                    return messages, None
+                break
+            count = data[pos:space]
+            if not count.isdigit() or int(count) > max_message_bytes:
+                return messages, None
+            length = int(count)
+            end = space + 1 + length
+            if end > n:
+                break
+            messages.append(bytes(data[space + 1:end]))
+            pos = end
+        else:
+            end = data.find(b"\n", pos)
+            if end < 0:
+                if n - pos > max_message_bytes:
+                    return messages, None
+                break
+            messages.append(bytes(data[pos:end]).rstrip(b"\r"))
+            pos = end + 1
+    return messages, data[pos:]
+
+
+def parse_syslog(message):
+    """
+    Split the header off a syslog message.
+
+    Parses the priority of RFC 3164 and RFC 5424 messages, and the
+    header fields of RFC 5424 messages. The rest, including RFC 5424
+    structured data, is left in ``message`` for the API to parse.
+
+    Parameters
+    ----------
+    message : bytes
+
+    Returns
+    -------
+    event : dict
+        ``{"message": str}``, with ``facility`` and ``severity`` if
+        the message has a priority, and ``timestamp``, ``hostname``,
+        ``app_name``, ``procid`` and ``msgid`` if it is RFC 5424
+        (``None`` where the sender left them out).
+    """
+
+    event = {}
+    if message[:1] == b"<":
+        end = message.find(b">", 1, 5)
+        pri = message[1:end]
+        if end > 0 and pri.isdigit():
+            event["facility"], event["severity"] = divmod(int(pri), 8)
+            message = message[end + 1:]
+            m = _RFC5424.match(message)
+            if m is not None:
+                for field, value in m.groupdict().items():
+                    event[field] = None if value == b"-" else \
+                        value.decode('utf-8', 'replace')
+                message = message[m.end():]
+    event["message"] = message.decode('utf-8', 'replace')
+    return event
+
+
+class _Connection:
+    """A TCP sender and what it sent that is not split yet."""
+
+    __slots__ = ('sock', 'peer', 'buf')
+
+    def __init__(self, sock, peer):
+        self.sock = sock
+        self.peer = peer
+        self.buf = b""
+
+
+class Listener(InputPlugin):
+    """
+    Receive events pushed over syslog, or raw TCP or UDP.
+
+    One non-blocking socket (UDP, or a TCP server with any number of
+    senders) is served by a ``selectors`` loop in ``fetch()``. Every
+    wakeup reads up to ``recv_batch`` datagrams, or everything a TCP
+    sender has sent, before messages are turned into events, and
+    batches are returned as per the flush policy (see
+    `plugin.flush.FlushPolicy`). Use ``pipeline_depth`` so the socket
+    is read while batches are posted; the kernel receive buffer only
+    holds what arrives in between.
+
+    Input config keys, besides those of `InputPlugin`:
+
+    - ``port``, port to listen on.
+    - ``host``, address to listen on, default ``0.0.0.0``.
+    - ``protocol``, ``udp`` (default) or ``tcp``.
+    - ``format``, ``syslog`` (default) parses the syslog header with
+      `parse_syslog`, ``json`` parses every message with
+      ``decode()``, ``text`` posts ``{"message": str}``. ``syslog`` and
+      ``text`` events have the sender address as ``source``.
+    - ``framing``, TCP only, ``auto``, ``octet`` or ``newline``, see
+      `split_frames`. Default ``auto`` for ``syslog``, ``newline``
+      for ``json`` and ``text``, whose lines may start with a digit.
+    - ``rcvbuf``, ``SO_RCVBUF`` bytes, default 8 MiB. The kernel
+      caps it at ``net.core.rmem_max``, raise that for bursty senders.
+    - ``recv_batch``, datagrams read per wakeup, default 1024.
+    - ``max_message_bytes``, longer datagrams are cut, TCP senders of
+      longer messages are disconnected, default 64 KiB.
+
+    Metrics, besides those of every input:
+    ``cybexp_input_listener_received_total``,
+    ``cybexp_input_listener_connections`` and, on Linux,
+    ``cybexp_input_listener_dropped_total``, datagrams the kernel
+    dropped because the receive buffer was full. Messages that do not
+    parse and TCP streams closed for a bad frame count in
+    ``cybexp_input_invalid_total``.
+    """
+
+    def __init__(self, input_config, api_raw_url, api_token,
+                 session=None, limiter=None):
+        self.host = _option(input_config, 'host', '0.0.0.0')
+        self.port = int(input_config['data']['port'][0])
+        self.protocol = _option(input_config, 'protocol', 'udp')
+        if self.protocol not in ('udp', 'tcp'):
+            raise ValueError(f"Invalid protocol: '{self.protocol}'!")
+        self.format = _option(input_config, 'format', 'syslog')
+        if self.format not in ('syslog', 'json', 'text'):
+            raise ValueError(f"Invalid format: '{self.format}'!")
+        self.framing = _option(input_config, 'framing',
+                               'auto' if self.format == 'syslog'
+                               else 'newline')
+        if self.framing not in ('auto', 'octet', 'newline'):
+            raise ValueError(f"Invalid framing: '{self.framing}'!")
+        self.rcvbuf = int(_option(input_config, 'rcvbuf', 8388608))
+        self.recv_batch = int(_option(input_config, 'recv_batch', 1024))
+        self.max_message_bytes = int(_option(input_config,
+                                             'max_message_bytes', 65536))
+
+        super().__init__(input_config, api_raw_url, api_token, session,
+                         limiter)
+
+        self.address = None  # bound (host, port), once started
+        self.received = 0
+        self.dropped = 0
+        self._messages = collections.deque()  # (message, sender address)
+        self._sel = None
+        self._sock = None
+        self._conns = {}
+        self._wake_r = self._wake_w = None
+        self._buf = bytearray(self.max_message_bytes)
+        self._ancsize = 0
+
+        m = self.metrics
+        m.counter('cybexp_input_listener_received_total',
+                  "Messages received.", lambda: self.received)
+        m.gauge('cybexp_input_listener_connections',
+                "Connected TCP senders.", lambda: len(self._conns))
+        if SO_RXQ_OVFL is not None:
+            m.counter('cybexp_input_listener_dropped_total',
+                      "Datagrams dropped by the kernel, receive buffer full.",
+                      lambda: self.dropped)
+
+    def fetch(self):
+        if self._sel is None:
+            self._start()
+
+        batch = self.flush.batch()
+        while not self.exit_graceful_event.is_set():
+            while self._messages and not batch.full():
+                message, source = self._messages.popleft()
+                event = self._event(message, source)
+                if event is not None:
+                    batch.add(event, len(message))
+            if batch.ready():
+                break
+            for key, mask in self._sel.select(
+                    min(batch.remaining(), 1.0)):
+                key.data(key.fileobj)
+        return batch.close()
+
+    def interrupt(self):
+        wake_w = self._wake_w
+        if wake_w is not None:
+            try:
+                wake_w.send(b"\0")
+            except OSError:
+                pass
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            self._stop()
+
+    async def arun(self, executor=None):
+        try:
+            await super().arun(executor)
+        finally:
+            self._stop()
+
+    def _event(self, message, source):
+        if not message.strip():
+            return None
+        if self.format == 'json':
+            return self.decode_or_skip(message)
+        if self.format == 'syslog':
+            event = parse_syslog(message)
+        else:
+            event = {"message": message.decode('utf-8', 'replace')}
+        event["source"] = source
+        return event
+
+    def _start(self):
+        """Bind the socket and set up the selector."""
+
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        if self.protocol == 'udp':
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+        else:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            self.rcvbuf)
+            sock.bind((self.host, self.port))
+            if self.protocol == 'tcp':
+                sock.listen(socket.SOMAXCONN)
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+
+        rcvbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if rcvbuf < self.rcvbuf:  # Linux reports twice what it allows
+            logging.warning(f"SO_RCVBUF is {rcvbuf} bytes, not "
+                            f"{self.rcvbuf}, raise net.core.rmem_max: "
+                            f"'{self.name_}'")
+        if self.protocol == 'udp' and SO_RXQ_OVFL is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self._ancsize = socket.CMSG_SPACE(4)
+            except OSError:
+                pass
+
+        self._sock = sock
+        self.address = sock.getsockname()[:2]
+        self._sel = selectors.DefaultSelector()
+        self._sel.register(sock, selectors.EVENT_READ,
+                           self._recv if self.protocol == 'udp'
+                           else self._accept)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, self._woken)
+        logging.info(f"listening on {self.protocol}/{self.address}: "
+                     f"'{self.name_}'")
+
+    def _woken(self, sock):
+        try:
+            while sock.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _recv(self, sock):
+        """Read up to `recv_batch` datagrams."""
+
+        buf, ancsize = self._buf, self._ancsize
+        view = memoryview(buf)
+        messages = self._messages
+        n = 0
+        for n in range(1, self.recv_batch + 1):
+            try:
+                if ancsize:
+                    nbytes, ancdata, _, addr = sock.recvmsg_into(
+                        [buf], ancsize)
+                    for level, type_, data in ancdata:
+                        if level == socket.SOL_SOCKET and \
+                                type_ == SO_RXQ_OVFL and len(data) >= 4:
+                            self.dropped = int.from_bytes(data[:4],
+                                                          sys.byteorder)
+                else:
+                    nbytes, addr = sock.recvfrom_into(buf)
+            except (BlockingIOError, InterruptedError):
+                n -= 1
+                break
+            except OSError as e:
+                logging.warning(f"error receiving: '{self.name_}': {e}")
+                n -= 1
+                break
+            messages.append((view[:nbytes].tobytes().rstrip(b"\r\n"),
+                             addr[0]))
+        self.received += n
+
+    def _accept(self, sock):
+        for _ in range(64):
+            try:
+                client, addr = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:  # e.g. out of file descriptors
+                logging.warning(f"error accepting: '{self.name_}': {e}")
+                return
+            client.setblocking(False)
+            self._conns[client] = _Connection(client, addr[0])
+            self._sel.register(client, selectors.EVENT_READ, self._io)
+
+    def _io(self, sock):
+        conn = self._conns.get(sock)
+        if conn is None:
+            return
+        try:
+            data = sock.recv(1048576)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+
+        if data:
+            messages, conn.buf = split_frames(
+                conn.buf + data, self.framing, self.max_message_bytes)
+            if conn.buf is None:
+                self.invalid += 1
+                logging.warning(f"closing connection of {conn.peer}, bad "
+                                f"frame or message too long: "
+                                f"'{self.name_}'")
+                self._close(conn)
+        else:  # EOF, a last line may lack its newline
+            messages = split_frames(conn.buf + b"\n", self.framing,
+                                    self.max_message_bytes)[0]
+            self._close(conn)
+
+        self.received += len(messages)
+        self._messages.extend((message, conn.peer) for message in messages)
+
+    def _close(self, conn):
+        self._conns.pop(conn.sock, None)
+        self._sel.unregister(conn.sock)
+        conn.sock.close()
+
+    def _stop(self):
+        if self._sel is None:
+            return
+        for conn in list(self._conns.values()):
+            self._close(conn)
+        self._sel.close()
+        self._sock.close()
+        self._wake_r.close()
+        self._wake_w.close()
+        self._sel = None
@@ -0,0 +1,244 @@
+"""
+Per-input metrics and Prometheus text exposition.
+
+Every `InputPlugin` has a `Registry` as ``self.metrics``. ``run.py``
+serves all registries as one Prometheus text page with
+`MetricsServer`.
+
+Updating a metric is a plain attribute update without a lock. Each
+metric is updated by the threads of one input only, so at worst a
+concurrent update is lost, never corrupted. That keeps the posting
+hot path cheap.
+"""
+
+import bisect
+import threading
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    """
+    Value that only goes up.
+
+    If `function` is given the value is read from it at collection
+    time instead, for counts kept elsewhere.
+    """
+
+    type_ = "counter"
+
+    def __init__(self, name, help_, function=None):
+        self.name = name
+        self.help = help_
+        self.value = 0
+        self.function = function
+
+    def inc(self, n=1):
+        self.value += n
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def samples(self):
+        yield self.name, {}, self.get()
+
+
+class Gauge:
+    """
+    Value that goes up and down.
+
+    If `function` is given the value is read from it at collection
+    time instead.
+    """
+
+    type_ = "gauge"
+
+    def __init__(self, name, help_, function=None):
+        self.name = name
+        self.help = help_
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, n=1):
+        self.value += n
+
+    def dec(self, n=1):
+        self.value -= n
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def samples(self):
+        yield self.name, {}, self.get()
+
+
+class Histogram:
+    """Distribution of observed values in fixed buckets."""
+
+    type_ = "histogram"
+
+    def __init__(self, name, help_, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def __repr__(self):
+        return (f"Histogram({self.name}, count={self.count}, "
+                f"mean={self.mean:.6f})")
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for le, n in zip(self.buckets, self.counts):
+            cumulative += n
+            yield f"{self.name}_bucket", {"le": repr(float(le))}, cumulative
+        cumulative += self.counts[-1]
+        yield f"{self.name}_bucket", {"le": "+Inf"}, cumulative
+        yield f"{self.name}_sum", {}, self.sum
+        yield f"{self.name}_count", {}, self.count
+
+
+class Registry:
+    """
+    Metrics of one input (or of the process).
+
+    Parameters
+    ----------
+    labels : dict, optional
+        Labels added to every sample, e.g. ``{"input": name}``.
+    """
+
+    def __init__(self, labels=None):
+        self.labels = labels or {}
+        self._metrics = {}
+
+    def __iter__(self):
+        return iter(list(self._metrics.values()))
+
+    def _get(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name, help_, function=None):
+        return self._get(Counter, name, help_, function)
+
+    def gauge(self, name, help_, function=None):
+        return self._get(Gauge, name, help_, function)
+
+    def histogram(self, name, help_, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_, buckets)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+                     .replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"'
+                          for k, v in labels.items()) + "}"
+
+
+def exposition(registries):
+    """
+    Render metrics in the Prometheus text exposition format.
+
+    Metrics with the same name from different registries are grouped
+    in one family, told apart by the registry labels.
+
+    Parameters
+    ----------
+    registries : iterable of Registry
+
+    Returns
+    -------
+    text : str
+    """
+
+    families = {}
+    for registry in registries:
+        for metric in registry:
+            families.setdefault(metric.name, []).append((registry, metric))
+
+    lines = []
+    for name, members in families.items():
+        first = members[0][1]
+        lines.append(f"# HELP {name} {first.help}")
+        lines.append(f"# TYPE {name} {first.type_}")
+        for registry, metric in members:
+            try:
+                samples = list(metric.samples())
+            except Exception:  # a failing gauge function
+                continue
+            for sample, labels, value in samples:
+                labels = dict(registry.labels, **labels)
+                lines.append(f"{sample}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer(threading.Thread):
+    """
+    Serve ``GET /metrics`` on a local port in a daemon thread.
+
+    Parameters
+    ----------
+    collect : callable
+        Returns the list of `Registry` to expose.
+    port : int
+    host : str, default="127.0.0.1"
+    """
+
+    def __init__(self, collect, port, host="127.0.0.1"):
+        import http.server
+
+        super().__init__(name="metrics-server", daemon=True)
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exposition(collect()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
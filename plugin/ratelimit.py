@@ -0,0 +1,334 @@
+"""
+Rate limits and adaptive concurrency of posting to the CYBEX-P API.
+
+All inputs of a process post through one `ApiLimiter`, so they back
+off together when the API is overloaded instead of each retrying on
+its own schedule.
+"""
+
+import email.utils
+import threading
+import time
+
+
+class RetryAfter(Exception):
+    """
+    The API answered 429 or 503, try again in `seconds`.
+
+    Attributes
+    ----------
+    seconds : float or None
+        From the ``Retry-After`` response header, ``None`` if the API
+        did not say.
+    status_code : int
+    """
+
+    def __init__(self, seconds, status_code=429):
+        super().__init__(f"status_code = '{status_code}', "
+                         f"Retry-After = {seconds}")
+        self.seconds = seconds
+        self.status_code = status_code
+
+
+class Cancelled(Exception):
+    """Waiting for the limiter was cancelled, the input is exiting."""
+
+
+def parse_retry_after(value, default=None, maximum=300.0):
+    """
+    Seconds to wait from a ``Retry-After`` header value.
+
+    Parameters
+    ----------
+    value : str or None
+        Delay in seconds, or an HTTP date.
+    default : float or None, default=None
+        Returned if `value` is missing or invalid.
+    maximum : float, default=300.0
+        Upper bound, so a bad header can't stall inputs for days.
+    """
+
+    if not value:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return default
+        if date is None:
+            return default
+        seconds = date.timestamp() - time.time()
+    return min(maximum, max(0.0, seconds))
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average and bursts of up to
+    `burst` requests.
+
+    Requests reserve a token even if the bucket is empty, and are told
+    how long to wait for it, so waiting requests are served in order.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"TokenBucket(rate={self.rate}, burst={self.burst})"
+
+    def reserve(self, n=1):
+        """Take `n` tokens, returns seconds to wait until they are due."""
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on requests in flight.
+
+    The limit grows by one per `limit` requests answered within
+    `target_latency` seconds (additive increase). It is halved on an
+    overload error, and cut by 10% on a slow answer (multiplicative
+    decrease), at most once per `cooldown` seconds so one burst of
+    failures counts once.
+
+    Parameters
+    ----------
+    min_limit : int, default=1
+    max_limit : int, default=64
+        Also the starting limit, so the limiter is out of the way until
+        the API shows trouble.
+    target_latency : float, default=2.0
+    cooldown : float, default=1.0
+    """
+
+    def __init__(self, min_limit=1, max_limit=64, target_latency=2.0,
+                 cooldown=1.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return (f"AdaptiveConcurrency(limit={int(self.limit)}, "
+                f"in_flight={self.in_flight})")
+
+    def acquire(self, cancel=None):
+        """Wait for a free slot, raises `Cancelled` if `cancel` is set."""
+
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled
+                self._cond.wait(0.5)
+            self.in_flight += 1
+
+    def release(self, latency=None, overloaded=False):
+        """
+        Free a slot and adapt the limit.
+
+        Parameters
+        ----------
+        latency : float or None
+            Seconds the request took, ``None`` if it failed without an
+            answer (counts as overloaded).
+        overloaded : bool, default=False
+            The API answered 429 or 5xx.
+        """
+
+        with self._cond:
+            self.in_flight -= 1
+            if overloaded or latency is None:
+                self._decrease(0.5)
+            elif latency > self.target_latency:
+                self._decrease(0.9)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify()
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.decreases += 1
+
+
+class _Request:
+    """One request admitted by `ApiLimiter.request()`."""
+
+    __slots__ = ('status_code', 'start')
+
+    def __init__(self):
+        self.status_code = None
+        self.start = time.monotonic()
+
+
+class ApiLimiter:
+    """
+    Central limits on posting to the API, shared by all inputs.
+
+    A request waits, in order, until a ``Retry-After`` pause is over,
+    for a token of its org's bucket, for a token of the global bucket,
+    and for a slot of the adaptive concurrency limit.
+
+    ``run.py`` makes one from the optional keys of the ``api`` config:
+    ``rate_limit`` and ``rate_limit_burst`` (requests/s of the process,
+    0 is unlimited), ``org_rate_limit`` and ``org_rate_limit_burst``
+    (requests/s of each orgid), ``min_concurrency``,
+    ``max_concurrency`` and ``target_latency`` (see
+    `AdaptiveConcurrency`), and ``max_retry_after``. With ``--workers``
+    every worker process has its own limiter.
+
+    Examples
+    --------
+    ::
+
+        with limiter.request(orgid, cancel=exit_now_event) as req:
+            r = session.post(...)
+            req.status_code = r.status_code
+    """
+
+    def __init__(self, rate=0, burst=None, org_rate=0, org_burst=None,
+                 min_concurrency=1, max_concurrency=64, target_latency=2.0,
+                 max_retry_after=300.0):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.org_rate = org_rate
+        self.org_burst = org_burst
+        self.org_buckets = {}
+        self.concurrency = AdaptiveConcurrency(
+            min_concurrency, max_concurrency, target_latency)
+        self.max_retry_after = max_retry_after
+        self.paused_until = {}  # orgid or None (all): time.monotonic()
+        self.pauses = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"ApiLimiter(global={self.bucket}, {self.concurrency})"
+
+    def stats(self):
+        """
+        Returns
+        -------
+        stats : dict
+            ``{"concurrency_limit": int, "in_flight": int,
+            "pauses": int, "paused_for": float}``, `paused_for` is the
+            seconds left of a pause of every org.
+        """
+
+        return {"concurrency_limit": int(self.concurrency.limit),
+                "in_flight": self.concurrency.in_flight,
+                "pauses": self.pauses,
+                "paused_for": round(self.wait_time(None), 3)}
+
+    def _org_bucket(self, orgid):
+        with self.lock:
+            bucket = self.org_buckets.get(orgid)
+            if bucket is None:
+                bucket = TokenBucket(self.org_rate, self.org_burst)
+                self.org_buckets[orgid] = bucket
+            return bucket
+
+    def pause(self, seconds, orgid=None):
+        """
+        Hold requests of `orgid`, or of every org if ``None``, for
+        `seconds`.
+        """
+
+        seconds = min(seconds, self.max_retry_after)
+        until = time.monotonic() + seconds
+        with self.lock:
+            self.pauses += 1
+            if until > self.paused_until.get(orgid, 0):
+                self.paused_until[orgid] = until
+
+    def wait_time(self, orgid):
+        """Seconds left of the pauses that hold `orgid`."""
+
+        now = time.monotonic()
+        return max(0.0, self.paused_until.get(None, 0) - now,
+                   self.paused_until.get(orgid, 0) - now)
+
+    def _wait(self, seconds, cancel):
+        if seconds <= 0:
+            return
+        if cancel is None:
+            time.sleep(seconds)
+        elif cancel.wait(seconds):
+            raise Cancelled
+
+    def request(self, orgid, cancel=None):
+        """
+        Context manager admitting one request of `orgid`.
+
+        Set ``status_code`` of the object it returns once the API
+        answered. A 429 pauses the org, a 503 pauses every org (by the
+        ``RetryAfter`` raised in the block, if any), 429 and 5xx shrink
+        the concurrency limit.
+
+        Parameters
+        ----------
+        orgid : str
+        cancel : threading.Event, optional
+            Stop waiting and raise `Cancelled` once set.
+        """
+
+        return _Admission(self, orgid, cancel)
+
+
+class _Admission:
+
+    __slots__ = ('limiter', 'orgid', 'cancel', 'req')
+
+    def __init__(self, limiter, orgid, cancel):
+        self.limiter = limiter
+        self.orgid = orgid
+        self.cancel = cancel
+
+    def __enter__(self):
+        limiter, cancel = self.limiter, self.cancel
+        while True:  # a pause may be extended while waiting
+            wait = limiter.wait_time(self.orgid)
+            if wait <= 0:
+                break
+            limiter._wait(wait, cancel)
+        if limiter.org_rate:
+            limiter._wait(limiter._org_bucket(self.orgid).reserve(), cancel)
+        if limiter.bucket is not None:
+            limiter._wait(limiter.bucket.reserve(), cancel)
+        limiter.concurrency.acquire(cancel)
+        self.req = _Request()
+        return self.req
+
+    def __exit__(self, exc_type, exc, tb):
+        limiter, status = self.limiter, self.req.status_code
+        if isinstance(exc, RetryAfter) and exc.seconds is not None:
+            limiter.pause(exc.seconds,
+                          self.orgid if exc.status_code == 429 else None)
+        if status is None:
+            limiter.concurrency.release(None)
+        else:
+            limiter.concurrency.release(
+                time.monotonic() - self.req.start,
+                overloaded=status == 429 or status >= 500)
+        return False
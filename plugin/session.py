@@ -0,0 +1,65 @@
+"""Process wide HTTP session with a keep-alive connection pool."""
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PooledSession(requests.Session):
+    """
+    A ``requests.Session`` shared by all input plugins.
+
+    Every plugin thread posts through the same session so TCP (and
+    TLS) connections to the CYBEX-P API are kept alive and reused
+    instead of being opened for every event.
+
+    Parameters
+    ----------
+    pool_connections : int, default=10
+        Number of per-host connection pools to keep.
+    pool_maxsize : int, default=10
+        Maximum number of connections kept open to a single host.
+    pool_block : bool, default=False
+        If ``True`` a thread waits for a free connection when
+        `pool_maxsize` connections to a host are busy. Otherwise
+        an extra connection is opened and discarded after use.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10,
+                 pool_block=False):
+        super().__init__()
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block)
+        self.mount('http://', self.adapter)
+        self.mount('https://', self.adapter)
+
+    def stats(self):
+        """
+        Connection pool statistics, per host.
+
+        Returns
+        -------
+        stats : dict
+            ``{host: {"requests": int, "hits": int, "misses": int,
+            "open": int, "idle": int}}``. A miss is a request that had
+            to open a new connection, a hit reused a kept-alive one.
+        """
+
+        stats = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            q = pool.pool
+            idle = sum(1 for conn in list(q.queue) if conn is not None)
+            busy = q.maxsize - q.qsize()
+            misses = pool.num_connections
+            stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "requests": pool.num_requests,
+                "hits": max(0, pool.num_requests - misses),
+                "misses": misses,
+                "open": idle + busy,
+                "idle": idle,
+            }
+        return stats
@@ -0,0 +1,322 @@
+"""
+Durable on-disk spool of encoded events.
+
+An input with a spool writes every fetched event to append-only
+segment files before posting. A separate drainer thread reads the
+spool and posts to the API, so an API outage or a restart does not
+lose fetched events.
+
+Layout of a spool directory::
+
+    00000000000000000001.seg    oldest segment
+    00000000000000000002.seg    ...
+    cursor                      "<segment id> <offset>" of next record
+
+Each record in a segment is framed as ``length (4 bytes) | crc32
+(4 bytes) | payload``, both big-endian. A record that was only
+partly written (crash, power loss) fails the length or crc check and
+is cut off when the spool is opened.
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+
+_HEADER = struct.Struct(">II")
+_SUFFIX = ".seg"
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+def _segment_name(segid):
+    return f"{segid:020d}{_SUFFIX}"
+
+
+class Spool:
+    """
+    Append-only, segment based event spool.
+
+    One thread appends (``append()``) while another reads
+    (``read()``) and acknowledges (``commit()``) records.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of this spool, created if missing. Use a
+        different directory for every input.
+    segment_bytes : int, default=16 MiB
+        Start a new segment file once the current one is this big.
+    max_bytes : int, default=1 GiB
+        If the spool grows bigger than this, the oldest segments are
+        deleted, even if they were not posted yet.
+    fsync : {"always", "interval", "never"}, default="interval"
+        When to ``fsync()`` segment files. ``always`` after every
+        ``append()``, ``interval`` at most once per `fsync_interval`
+        seconds, ``never`` leaves it to the operating system.
+    fsync_interval : float, default=1.0
+
+    Attributes
+    ----------
+    dropped : int
+        Records deleted because of `max_bytes` before being posted.
+    """
+
+    def __init__(self, directory, segment_bytes=16777216,
+                 max_bytes=1073741824, fsync="interval",
+                 fsync_interval=1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy: '{fsync}'!")
+
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.dropped = 0
+
+        self._cond = threading.Condition()
+        self._last_fsync = time.monotonic()
+
+        os.makedirs(directory, exist_ok=True)
+        self._segments = self._list_segments()  # {segid: size}
+        if self._segments:
+            self._recover(max(self._segments))
+        else:
+            self._segments[1] = 0
+
+        self._write_id = max(self._segments)
+        self._writer = open(self._path(self._write_id), "ab")
+        self._read_pos = self._load_cursor()
+
+    def __len__(self):
+        """Bytes in the spool that are not committed yet."""
+
+        with self._cond:
+            segid, offset = self._read_pos
+            return sum(size for i, size in self._segments.items()
+                       if i >= segid) - offset
+
+    def _path(self, segid):
+        return os.path.join(self.directory, _segment_name(segid))
+
+    def _list_segments(self):
+        segments = {}
+        for fname in os.listdir(self.directory):
+            if fname.endswith(_SUFFIX):
+                try:
+                    segid = int(fname[:-len(_SUFFIX)])
+                except ValueError:
+                    continue
+                segments[segid] = os.path.getsize(
+                    os.path.join(self.directory, fname))
+        return segments
+
+    def _recover(self, segid):
+        """Truncate a partly written record at the end of a segment."""
+
+        path = self._path(segid)
+        good = 0
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                good += _HEADER.size + length
+
+        if good < self._segments[segid]:
+            logging.warning(f"spool: truncating '{path}' from "
+                            f"{self._segments[segid]} to {good} bytes")
+            with open(path, "r+b") as f:
+                f.truncate(good)
+            self._segments[segid] = good
+
+    def _load_cursor(self):
+        first = min(self._segments)
+        try:
+            with open(os.path.join(self.directory, "cursor")) as f:
+                segid, offset = map(int, f.read().split())
+        except (FileNotFoundError, ValueError):
+            return first, 0
+
+        if segid < first or segid not in self._segments:
+            return first, 0
+        return segid, min(offset, self._segments[segid])
+
+    def _save_cursor(self, pos):
+        path = os.path.join(self.directory, "cursor")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(f"{pos[0]} {pos[1]}")
+            if self.fsync == "always":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _sync(self, force=False):
+        now = time.monotonic()
+        if self.fsync == "always" or force or (
+                self.fsync == "interval" and
+                now - self._last_fsync >= self.fsync_interval):
+            os.fsync(self._writer.fileno())
+            self._last_fsync = now
+
+    def _roll(self):
+        """Start a new segment."""
+
+        self._sync(force=self.fsync != "never")
+        self._writer.close()
+        self._write_id += 1
+        self._segments[self._write_id] = 0
+        self._writer = open(self._path(self._write_id), "ab")
+
+    def _enforce_max_bytes(self):
+        while sum(self._segments.values()) > self.max_bytes and \
+                len(self._segments) > 1:
+            oldest = min(self._segments)
+            if oldest == self._write_id:
+                break
+
+            segid, offset = self._read_pos
+            if oldest >= segid:
+                n = self._count_records(oldest,
+                                        offset if oldest == segid else 0)
+                self.dropped += n
+                logging.error(f"spool full, dropping {n} events: "
+                              f"'{self.directory}'")
+                self._read_pos = (oldest + 1, 0)
+
+            del self._segments[oldest]
+            os.remove(self._path(oldest))
+
+    def _count_records(self, segid, offset):
+        n = 0
+        with open(self._path(segid), "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return n
+                length, _ = _HEADER.unpack(header)
+                f.seek(length, os.SEEK_CUR)
+                n += 1
+
+    def append(self, records):
+        """
+        Append encoded events to the spool.
+
+        Parameters
+        ----------
+        records : list of bytes
+        """
+
+        if not records:
+            return
+
+        with self._cond:
+            for r in records:
+                if self._segments[self._write_id] >= self.segment_bytes:
+                    self._roll()
+                self._writer.write(_HEADER.pack(len(r), zlib.crc32(r)))
+                self._writer.write(r)
+                self._segments[self._write_id] += _HEADER.size + len(r)
+
+            self._writer.flush()
+            self._sync()
+            self._enforce_max_bytes()
+            self._cond.notify_all()
+
+    def read(self, max_records=100, timeout=None):
+        """
+        Read the oldest uncommitted records.
+
+        Reading does not remove records. Call ``commit(pos)`` once they
+        are posted, else the next ``read()`` returns them again.
+
+        Parameters
+        ----------
+        max_records : int, default=100
+        timeout : float, optional
+            Seconds to wait for records if the spool is empty.
+
+        Returns
+        -------
+        records : list of bytes
+            Empty if nothing arrived before `timeout`.
+        pos : tuple
+            Spool position just after the last record returned.
+        """
+
+        with self._cond:
+            if not self._has_unread():
+                self._cond.wait(timeout)
+            segid, offset = self._read_pos
+            end = self._segments.get(segid, 0)
+
+        records = []
+        while len(records) < max_records:
+            if offset >= end:
+                with self._cond:
+                    end = self._segments.get(segid, 0)
+                    if offset < end:
+                        continue
+                    if segid >= self._write_id:
+                        break
+                    segid, offset = min(
+                        i for i in self._segments if i > segid), 0
+                    end = self._segments[segid]
+                continue
+
+            try:
+                f = open(self._path(segid), "rb")
+            except FileNotFoundError:  # dropped by `max_bytes`
+                break
+            with f:
+                f.seek(offset)
+                while len(records) < max_records and offset < end:
+                    length, crc = _HEADER.unpack(f.read(_HEADER.size))
+                    payload = f.read(length)
+                    offset += _HEADER.size + length
+                    if zlib.crc32(payload) != crc:
+                        logging.error(f"spool: corrupt record skipped in "
+                                      f"'{self._path(segid)}'")
+                        continue
+                    records.append(payload)
+
+        return records, (segid, offset)
+
+    def commit(self, pos):
+        """
+        Acknowledge all records before `pos`, as returned by ``read()``.
+
+        Segments that are fully committed are deleted.
+        """
+
+        with self._cond:
+            if pos < self._read_pos:  # segments dropped meanwhile
+                return
+            self._read_pos = pos
+            self._save_cursor(pos)
+            for segid in [i for i in self._segments if i < pos[0]]:
+                del self._segments[segid]
+                os.remove(self._path(segid))
+
+    def _has_unread(self):
+        segid, offset = self._read_pos
+        return segid < self._write_id or \
+            offset < self._segments.get(segid, 0)
+
+    def close(self):
+        """Flush and close the segment being written."""
+
+        with self._cond:
+            self._writer.flush()
+            self._sync(force=self.fsync != "never")
+            self._writer.close()
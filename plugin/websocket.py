@@ -4,35 +4,186 @@ import logging
 import lomond
 from lomond.persist import persist
 import pdb
-import time
+import queue
+import threading
+
+from .common import InputPlugin, _option
+
+
+_SKIP = object()  # message failed validation in `InputPlugin.decode()`
 
-from .common import InputPlugin
 
 class WebSocket(InputPlugin):
-    def __init__(self, input_config, api_raw_url, api_token):
+    """
+    Fetch events from a websocket URL.
+
+    By default every ``fetch()`` connects, reads one batch of messages
+    (10 messages or 15 seconds unless the input config sets a flush
+    policy, see `plugin.flush.FlushPolicy`), then closes the
+    connection. With ``stream = True`` in
+    the input config one connection is kept open for the life of the
+    input. A reader thread hands messages to ``fetch()`` through a
+    queue of up to ``stream_queue_size`` messages, and reconnects only
+    when the connection drops, after ``reconnect_min_wait`` to
+    ``reconnect_max_wait`` seconds (default 5 to 30). If the reader
+    fails, ``fetch()`` raises once so the input backs off, then starts
+    a new reader. Messages still queued when the input exits
+    gracefully are posted before it stops, see ``drain()``.
+
+    With ``raw = True`` messages are posted as received instead of
+    being parsed as JSON, see ``InputPlugin.decode()``. Frames that are
+    not valid JSON are logged, counted in ``cybexp_input_invalid_total``
+    and skipped, see ``InputPlugin.decode_or_skip()``.
+    """
+
+    def __init__(self, input_config, api_raw_url, api_token,
+                 session=None, limiter=None):
         self.url = input_config['data']['url'][0]
         self.ws = lomond.WebSocket(self.url)
-        super().__init__(input_config, api_raw_url, api_token)
+
+        self.stream = bool(_option(input_config, 'stream', False))
+        self._stream_queue = queue.Queue(
+            int(_option(input_config, 'stream_queue_size', 10000)))
+        self.reconnect_min_wait = float(
+            _option(input_config, 'reconnect_min_wait', 5))
+        self.reconnect_max_wait = float(
+            _option(input_config, 'reconnect_max_wait', 30))
+        self._reader = None
+        self._reader_error = None
+
+        super().__init__(input_config, api_raw_url, api_token, session,
+                         limiter)
 
     def fetch(self):
-        events = []
-        count = 0
-        start = time.time()
-        for event in persist(self.ws):
+        if self.stream:
+            return self._fetch_stream()
+
+        batch = self.flush.batch()
+        for event in persist(self.ws, poll=min(5, self.flush.max_linger),
+                             exit_event=self.exit_graceful_event):
             if self.exit_graceful_event.is_set():
                 break
-            
-            if event.name == "text":
-                events.append(event.json)
-                count += 1
-            else:
+
+            decoded = self._decode_event(event)
+            if decoded is _SKIP:
+                pass
+            elif decoded is not None:
+                batch.add(decoded, self._size(event))
+            elif event.name != "poll":
                 logging.info(event.name + " " + str(self))
 
-            if count == 10:
-                break
-            if time.time() - start > 15:
+            if batch.ready():
                 break
 
         self.ws.close()
-        return events
-            
+        return batch.close()
+
+    def interrupt(self):
+        """Close the socket under ``persist()`` so it stops waiting."""
+
+        session = self.ws.session
+        if session is not None:
+            session.close()
+
+    def drain(self):
+        """Messages the stream reader queued but ``fetch()`` did not take."""
+
+        if self._reader is not None:
+            self._reader.join(5)  # it stops queueing on exit_graceful()
+        events = []
+        while True:
+            try:
+                event, nbytes = self._stream_queue.get_nowait()
+            except queue.Empty:
+                return events
+            events.append(event)
+
+    @staticmethod
+    def _size(event):
+        if event.name == "text":
+            return len(event.text.encode('utf-8'))
+        return len(event.data)
+
+    def _decode_event(self, event):
+        """
+        Event to post from a lomond event, ``None`` if it is not a
+        message. In raw mode text frames are passed through as ``str``
+        and binary frames as ``bytes``.
+        """
+
+        if event.name == "text":
+            message = event.text
+        elif event.name == "binary" and self.raw:
+            message = event.data
+        else:
+            return None
+        event = self.decode_or_skip(message)
+        return _SKIP if event is None else event
+
+    def _fetch_stream(self):
+        """Collect one batch, as per `self.flush`, from the reader."""
+
+        if self._reader is not None and not self._reader.is_alive() \
+                and not self.exit_graceful_event.is_set():
+            self._reader = None
+            error, self._reader_error = self._reader_error, None
+            raise RuntimeError(
+                f"stream reader stopped: '{self.name_}'") from error
+        if self._reader is None:
+            self._reader = threading.Thread(target=self._read_stream,
+                                            daemon=True)
+            self._reader.start()
+
+        batch = self.flush.batch()
+        while not batch.ready() and not self.exit_graceful_event.is_set():
+            try:
+                event, nbytes = self._stream_queue.get(
+                    timeout=min(batch.remaining(), 1))
+            except queue.Empty:
+                continue
+            batch.add(event, nbytes)
+        return batch.close()
+
+    def _read_stream(self):
+        """
+        Reader thread of streaming mode.
+
+        ``persist()`` reconnects with back-off only when the connection
+        is lost. It exits once the websocket is closed after
+        ``exit_graceful()``. If it fails the error is kept for
+        ``fetch()`` to raise.
+        """
+
+        try:
+            for event in persist(self.ws, poll=1,
+                                 min_wait=self.reconnect_min_wait,
+                                 max_wait=self.reconnect_max_wait,
+                                 exit_event=self.exit_graceful_event):
+                if self.exit_graceful_event.is_set():
+                    if self.ws.is_active:
+                        self.ws.close()
+                    continue
+
+                decoded = self._decode_event(event)
+                if decoded is _SKIP:
+                    continue
+                elif decoded is not None:
+                    self._put_stream((decoded, self._size(event)))
+                elif event.name != "poll":
+                    logging.info(event.name + " " + str(self))
+        except Exception as e:
+            logging.error(f"stream reader failed: '{self.name_}'",
+                          exc_info=True)
+            self._reader_error = e
+            self.interrupt()
+
+    def _put_stream(self, event):
+        """Queue one message, waiting while the queue is full."""
+
+        while not self.exit_graceful_event.is_set():
+            try:
+                self._stream_queue.put(event, timeout=1)
+                return
+            except queue.Full:
+                continue
+
@@ -6,112 +6,487 @@ The `run.py` file keeps running in the background.
 """
 
 import argparse
+import concurrent.futures
+import importlib
 import logging
 import os
-import pdb
+import resource
 import secrets
 import socket
-import sys
+import threading
 import time
 
-from tahoe.identity import IdentityBackend
-
+import control
 from loadconfig import get_identity_backend, get_config
-from plugin import WebSocket
+from plugin.metrics import MetricsServer, Registry
+from tokencache import TokenCache
+from watcher import ConfigWatcher, config_key, diff_configs
 
 
 # Logging
-logging.basicConfig(filename = 'input.log') 
-logging.basicConfig(level=logging.DEBUG,
-    format='\n\n%(asctime)s %(levelname)s: File %(filename)s,' \
-        ' line %(lineno)s in %(funcName)s \n%(message)s')
+def configure_logging(filename='input.log'):
+    """Log to `filename`, relative paths are in the working directory."""
+
+    logging.basicConfig(filename = filename) 
+    logging.basicConfig(level=logging.DEBUG,
+        format='\n\n%(asctime)s %(levelname)s: File %(filename)s,' \
+            ' line %(lineno)s in %(funcName)s \n%(message)s')
 
 
+# Plugin classes are imported when an input first needs them, so
+# `run.py` listens for commands without loading every plugin first.
 _PLUGIN_CLASS_MAP = {
-    "websocket": WebSocket,
+    "websocket": "plugin.websocket.WebSocket",
+    "httpfeed": "plugin.httpfeed.HttpFeed",
+    "filetail": "plugin.filetail.FileTail",
+    "listener": "plugin.listener.Listener",
 }
 
 _RUNNING = dict()  # names of inputs running now
+_RUNNING_CONFIG = dict()  # name: (input_config, runtime, n_loops)
+_STOPPING = dict()  # name: input that did not exit when it was stopped
 _API_CONFIG = None
 _IDENTITY_BACKEND = None  # IdentityBackend
+_CONFIG_FILENAME = None  # config file `configure()` read
+_FILE_CONFIG = None  # api and identity config last read from it
+_SESSION = None  # PooledSession shared by all inputs
+_LIMITER = None  # ApiLimiter shared by all inputs
+_TOKEN_CACHE = None  # TokenCache of org hash to API token
+_ASYNC_RUNTIME = None  # AsyncRuntime, created on first asyncio start
+_METRICS_SERVER = None  # MetricsServer, if started with --metrics-port
+_WATCHER = None  # ConfigWatcher, if started with --watch
+_SUPERVISOR = None  # Supervisor, if started with --workers
+_PROCESS_METRICS = Registry()
+_COMMAND_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    1, thread_name_prefix="command")
+_STATUS_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    1, thread_name_prefix="status")
+_STOP_NOW_TIMEOUT = 2.0  # seconds to wait for inputs after exit_now()
+# api config keys inputs are started with, a change restarts them
+_RESTART_KEYS = ('url', 'token', 'host')
+# api config keys of the shared session, limiter and asyncio runtime
+_STARTUP_KEYS = ('pool_connections', 'pool_maxsize', 'pool_block',
+                 'rate_limit', 'rate_limit_burst', 'org_rate_limit',
+                 'org_rate_limit_burst', 'min_concurrency',
+                 'max_concurrency', 'target_latency', 'max_retry_after',
+                 'async_workers')
 
 
 def configure(config_filename='config.json'):
-    global _API_CONFIG, _IDENTITY_BACKEND
+    global _API_CONFIG, _IDENTITY_BACKEND, _CONFIG_FILENAME, \
+        _FILE_CONFIG, _SESSION, _TOKEN_CACHE, _LIMITER
+
+    from plugin import ApiLimiter, PooledSession
     
+    _CONFIG_FILENAME = config_filename
     _IDENTITY_BACKEND = get_identity_backend(config_filename)
     _API_CONFIG = get_config(config_filename, 'api')
-
-
-def restart_input(plugin_lst=None, name_lst=None):
-    stop_input(plugin_lst, name_lst)
-    start_input(plugin_lst, name_lst)
-
-
-def start_input(plugin_lst=None, name_lst=None):
-    global _RUNNING, _API_CONFIG, _IDENTITY_BACKEND, _PLUGIN_CLASS_MAP
+    _FILE_CONFIG = {'api': dict(_API_CONFIG),
+                    'identity': get_config(config_filename, 'identity')}
+    _TOKEN_CACHE = TokenCache(_IDENTITY_BACKEND, _API_CONFIG['token_ttl'],
+                              _API_CONFIG['start_workers'])
+    _SESSION = PooledSession(_API_CONFIG['pool_connections'],
+                             _API_CONFIG['pool_maxsize'],
+                             _API_CONFIG['pool_block'])
+    _LIMITER = ApiLimiter(_API_CONFIG['rate_limit'],
+                          _API_CONFIG['rate_limit_burst'],
+                          _API_CONFIG['org_rate_limit'],
+                          _API_CONFIG['org_rate_limit_burst'],
+                          _API_CONFIG['min_concurrency'],
+                          _API_CONFIG['max_concurrency'],
+                          _API_CONFIG['target_latency'],
+                          _API_CONFIG['max_retry_after'])
+
+
+def _pool_stat(key):
+    if _SESSION is None:
+        return 0
+    return sum(host[key] for host in _SESSION.stats().values())
+
+
+_PROCESS_METRICS.gauge('cybexp_input_running', "Inputs running now.",
+                       lambda: len(_RUNNING))
+for _key in ('requests', 'hits', 'misses', 'open', 'idle'):
+    _PROCESS_METRICS.gauge(f'cybexp_input_pool_{_key}',
+                           f"HTTP connection pool {_key}, all hosts.",
+                           lambda key=_key: _pool_stat(key))
+_PROCESS_METRICS.gauge('cybexp_input_api_concurrency_limit',
+                       "Adaptive limit of requests in flight to the API.",
+                       lambda: _LIMITER.concurrency.limit if _LIMITER else 0)
+_PROCESS_METRICS.gauge('cybexp_input_api_in_flight',
+                       "Requests in flight to the API.",
+                       lambda: _LIMITER.concurrency.in_flight
+                           if _LIMITER else 0)
+_PROCESS_METRICS.counter('cybexp_input_api_pauses_total',
+                         "Retry-After pauses of all inputs or of an org.",
+                         lambda: _LIMITER.pauses if _LIMITER else 0)
+
+
+def collect_metrics():
+    """Metric registries of the process and of every running input."""
+
+    return [_PROCESS_METRICS] + [thread.metrics
+                                 for thread in list(_RUNNING.values())]
+
+
+def start_metrics_server(port):
+    """Serve Prometheus metrics on ``127.0.0.1:port/metrics``."""
+
+    global _METRICS_SERVER
+
+    if _METRICS_SERVER is None:
+        _METRICS_SERVER = MetricsServer(collect_metrics, port)
+        _METRICS_SERVER.start()
+        logging.info(f"metrics at http://127.0.0.1:{_METRICS_SERVER.port}"
+                     "/metrics")
+    return _METRICS_SERVER
+
+
+def get_plugin_class(plugin):
+    """Class of `plugin` (e.g. ``websocket``) in `_PLUGIN_CLASS_MAP`."""
+
+    module, _, name = _PLUGIN_CLASS_MAP[plugin].rpartition(".")
+    return getattr(importlib.import_module(module), name)
+
+
+def get_async_runtime(n_loops=1):
+    """
+    The asyncio runtime, created with `n_loops` event loops on first
+    use. Its loops can't change later, a different `n_loops` is
+    ignored with a warning.
+    """
+
+    global _ASYNC_RUNTIME
+
+    if _ASYNC_RUNTIME is None:
+        from plugin.aio import AsyncRuntime
+        _ASYNC_RUNTIME = AsyncRuntime(n_loops, _API_CONFIG['async_workers'])
+    elif n_loops != _ASYNC_RUNTIME.n_loops:
+        logging.warning(f"asyncio runtime already runs "
+                        f"{_ASYNC_RUNTIME.n_loops} loops, ignoring "
+                        f"--loops {n_loops}!")
+    return _ASYNC_RUNTIME
+
+
+def restart_input(plugin_lst=None, name_lst=None, runtime='thread',
+                  n_loops=1):
+    stopped = stop_input(plugin_lst, name_lst)
+    return dict(start_input(plugin_lst, name_lst, runtime, n_loops),
+                **stopped)
+
+
+def start_input(plugin_lst=None, name_lst=None, runtime='thread',
+                n_loops=1):
+    """
+    Start inputs that match `plugin_lst` or `name_lst`.
+
+    `runtime` is either ``thread`` (one OS thread per input) or
+    ``asyncio`` (inputs are coroutines on `n_loops` event loops).
+    Org tokens come from `_TOKEN_CACHE`, and inputs are constructed
+    and started by up to ``start_workers`` (api config) threads.
+
+    Returns
+    -------
+    result : dict
+        ``{"started": [names], "running": [names already running],
+        "stopping": [names], "failed": [names]}``. An input that was
+        stopped but has not exited yet (see `_stop_names()`) is
+        `stopping` and is not started again until it has.
+    """
+    
+    global _RUNNING, _API_CONFIG, _IDENTITY_BACKEND, _PLUGIN_CLASS_MAP, \
+           _SESSION, _TOKEN_CACHE, _LIMITER
 
     if _API_CONFIG is None:
         raise ValueError("API config is None!")
     api_raw_url = _API_CONFIG['url'] + '/raw'
 
     all_input_config = _IDENTITY_BACKEND.get_config(plugin_lst, name_lst)
+    result = {"started": [], "running": [], "stopping": [], "failed": []}
+    _reap_stopping()
 
+    to_start = {}  # name: input_config
     for input_config in all_input_config:
         try:
             name = input_config['data']['name'][0]
-            if name in _RUNNING:
+            if name in _RUNNING or name in to_start:
                 logging.info(f"Input already running: '{name}'!")
+                result["running"].append(name)
                 continue
+            if name in _STOPPING:
+                logging.error(f"Input still stopping, not started: "
+                              f"'{name}'!")
+                result["stopping"].append(name)
+                continue
+            orgid = input_config['data']['orgid'][0]
         except:
             logging.error(f"Failed to run input: '{input_config}'!",
                           exc_info=True)
+            continue
+        to_start[name] = input_config
 
-        try:
-            orgid = input_config['data']['orgid'][0]
-            org = _IDENTITY_BACKEND.find_org(_hash=orgid, parse=True)
-            if org is None:
-                raise ValueError(f"Unknown orgid={orgid} for input name={name}!")
+    if not to_start:
+        return result
 
-            admin = org.get_admins()[0]            
-            api_token = admin.token        
-        
-            plugin = input_config['data']['plugin'][0]
-            Plugin = _PLUGIN_CLASS_MAP[plugin]
-            
-            thread =  Plugin(input_config, api_raw_url, api_token)
+    # One lookup per org, not per input
+    tokens = _TOKEN_CACHE.resolve(
+        [c['data']['orgid'][0] for c in to_start.values()])
+    if runtime == 'asyncio':
+        get_async_runtime(n_loops)  # create it before the workers race
+
+    def start_one(name, input_config):
+        orgid = input_config['data']['orgid'][0]
+        api_token = tokens[orgid]
+        if isinstance(api_token, Exception):
+            raise ValueError(f"No token for orgid={orgid} of input "
+                             f"name={name}!") from api_token
+
+        plugin = input_config['data']['plugin'][0]
+        Plugin = get_plugin_class(plugin)
+
+        thread =  Plugin(input_config, api_raw_url, api_token,
+                         session=_SESSION, limiter=_LIMITER)
+        if runtime == 'asyncio':
+            thread = get_async_runtime(n_loops).start(thread)
+        else:
             thread.start()
+        return thread
+
+    n_workers = min(_API_CONFIG['start_workers'], len(to_start))
+    with concurrent.futures.ThreadPoolExecutor(
+            n_workers, thread_name_prefix="start") as ex:
+        futures = {name: ex.submit(start_one, name, input_config)
+                   for name, input_config in to_start.items()}
 
-            _RUNNING[name] = thread
+    for name, future in futures.items():
+        try:
+            _RUNNING[name] = future.result()
+            _RUNNING_CONFIG[name] = (to_start[name], runtime, n_loops)
+            result["started"].append(name)
         except:
             logging.error(f"Failed to run input: '{name}'!", exc_info=True)
+            result["failed"].append(name)
+
+    return result
 
 
 def stop_input(plugin_lst=None, name_lst=None):
+    """
+    Stop inputs that match `plugin_lst` or `name_lst`.
+
+    Returns
+    -------
+    result : dict
+        ``{"stopped": [names], "not_running": [names],
+        "stuck": [names]}``, see `_stop_names()`.
+    """
+
     global _RUNNING, _IDENTITY_BACKEND
     
     all_input_config = _IDENTITY_BACKEND.get_config(plugin_lst, name_lst)
+    names = [input_config['data']['name'][0]
+             for input_config in all_input_config]
+    return _stop_names(names)
 
-    for input_config in all_input_config:
-        name = input_config['data']['name'][0]
-        plugin = input_config['data']['plugin'][0]
-        
-        if name not in _RUNNING:
+
+def _join_all(threads, timeout):
+    """Join `threads` together for at most `timeout` seconds overall."""
+
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+    return [thread for thread in threads if thread.is_alive()]
+
+
+def _reap_stopping():
+    """Forget inputs of `_STOPPING` that have exited by now."""
+
+    for name, thread in list(_STOPPING.items()):
+        if not thread.is_alive():
+            logging.info(f"stuck input has exited: '{name}'")
+            del _STOPPING[name]
+
+
+def _stop_names(names):
+    """
+    Stop running inputs `names` all at once.
+
+    Every input is asked to exit gracefully, then they are joined
+    together for the api config's ``stop_timeout`` seconds overall.
+    Inputs still running are told to exit now, which interrupts their
+    blocking I/O, and are given ``_STOP_NOW_TIMEOUT`` more seconds.
+    Inputs that are still alive after that are reported as `stuck`
+    and kept in `_STOPPING` until they exit, so the same name is not
+    started twice. Stopping a stuck input again waits for it again.
+    """
+
+    result = {"stopped": [], "not_running": [], "stuck": []}
+    _reap_stopping()
+
+    threads = {}
+    for name in names:
+        if name in _RUNNING:
+            threads[name] = _RUNNING[name]
+        elif name in _STOPPING:
+            threads[name] = _STOPPING[name]
+        else:
             logging.info(f"input is not running: '{name}'!")
+            result["not_running"].append(name)
             continue
-
-        thread = _RUNNING[name]
-        thread.exit_graceful()
-        thread.join(3.0)
-        if thread.is_alive():
-            thread.exit_now()
-        _ = _RUNNING.pop(name)
+        threads[name].exit_graceful()
+
+    timeout = _API_CONFIG['stop_timeout'] if _API_CONFIG else 5
+    alive = _join_all(list(threads.values()), timeout)
+    for thread in alive:
+        thread.exit_now()
+    alive = set(_join_all(alive, _STOP_NOW_TIMEOUT))
+
+    for name, thread in threads.items():
+        _ = _RUNNING.pop(name, None)
+        _ = _RUNNING_CONFIG.pop(name, None)
+        if thread in alive:
+            logging.error(f"input did not exit in time: '{name}'!")
+            _STOPPING[name] = thread
+            result["stuck"].append(name)
+        else:
+            _STOPPING.pop(name, None)
+            result["stopped"].append(name)
+
+    return result
+
+
+def _close_backend(backend):
+    """Close the MongoDB client of a replaced identity backend."""
+
+    try:
+        backend.database.client.close()
+    except Exception:
+        logging.warning("Error closing identity backend!", exc_info=True)
+
+
+def reload_config():
+    """
+    Apply changes to the api and identity config in the config file.
+
+    A new identity config replaces `_IDENTITY_BACKEND`, the old one is
+    closed. Changed api keys are applied, except `_STARTUP_KEYS`,
+    which size the session, limiter and asyncio runtime shared by
+    running inputs and need a restart of `run.py`.
+
+    Returns
+    -------
+    restart : bool
+        ``True`` if one of `_RESTART_KEYS` changed, running inputs
+        have to be restarted to use it.
+    """
+
+    global _IDENTITY_BACKEND, _FILE_CONFIG, _TOKEN_CACHE
+
+    if _FILE_CONFIG is None:
+        return False
+    filename = _CONFIG_FILENAME
+    if not os.path.exists(filename):  # as in `get_config()`
+        filename = os.path.join(os.path.dirname(__file__), filename)
+    if not os.path.exists(filename):
+        return False  # being replaced, not the defaults
+    try:
+        api = get_config(filename, 'api')
+        identity = get_config(filename, 'identity')
+    except SystemExit:  # bad JSON, e.g. saved half way, logged
+        return False
+    old = _FILE_CONFIG
+    _FILE_CONFIG = {'api': dict(api), 'identity': identity}
+    changed = [key for key in api if config_key(api[key]) !=
+               config_key(old['api'].get(key))]
+    identity_changed = config_key(identity) != config_key(old['identity'])
+
+    fixed = [key for key in changed if key in _STARTUP_KEYS]
+    if fixed:
+        logging.warning(f"api config {fixed} changed, restart run.py to "
+                        f"apply it!")
+    for key in changed:
+        if key not in _STARTUP_KEYS:
+            _API_CONFIG[key] = api[key]
+
+    if identity_changed:
+        logging.info("identity config changed, reconnecting!")
+        backend = _IDENTITY_BACKEND
+        _IDENTITY_BACKEND = get_identity_backend(filename)
+        _close_backend(backend)
+    if identity_changed or 'token_ttl' in changed or \
+            'start_workers' in changed:
+        _TOKEN_CACHE = TokenCache(_IDENTITY_BACKEND,
+                                  _API_CONFIG['token_ttl'],
+                                  _API_CONFIG['start_workers'])
+
+    restart = [key for key in changed if key in _RESTART_KEYS]
+    if restart:
+        logging.info(f"api config {restart} changed, restarting inputs!")
+    return bool(restart)
+
+
+def sync_inputs():
+    """
+    Restart running inputs whose config changed in the identity DB
+    and stop those whose config is gone. Called by `_WATCHER`.
+
+    If the API url, token or host changed (see `reload_config()`),
+    every running input is restarted with it.
+
+    Returns
+    -------
+    result : dict
+        ``{"restarted": [names], "stopped": [names], "failed": [names]}``
+    """
+
+    result = {"restarted": [], "stopped": [], "failed": []}
+    restart_all = reload_config()
+    if not _RUNNING_CONFIG:
+        return result
+
+    old = {name: c[0] for name, c in _RUNNING_CONFIG.items()}
+    new = {input_config['data']['name'][0]: input_config
+           for input_config in _IDENTITY_BACKEND.get_config(
+               None, list(old))}
+    changed, removed = diff_configs(old, new)
+    if restart_all:
+        changed = [name for name in old if name in new]
+
+    if removed:
+        logging.info(f"Input config deleted, stopping: {removed}")
+        result["stopped"] = _stop_names(removed)["stopped"]
+
+    for name in changed:
+        logging.info(f"Input config changed, restarting: '{name}'")
+        _, runtime, n_loops = _RUNNING_CONFIG[name]
+        _stop_names([name])
+        started = start_input(None, [name], runtime, n_loops)
+        if name in started["started"]:
+            result["restarted"].append(name)
+        else:
+            result["failed"].append(name)
+
+    return result
+
+
+def start_watcher(interval, config_filename):
+    """Start `_WATCHER` once, syncing every `interval` seconds."""
+
+    global _WATCHER
+
+    if _WATCHER is not None or not interval:
+        return
+    if not os.path.exists(config_filename):  # as in `get_config()`
+        config_filename = os.path.join(os.path.dirname(__file__),
+                                       config_filename)
+    _WATCHER = ConfigWatcher(
+        lambda: _COMMAND_EXECUTOR.submit(sync_inputs).result(),
+        interval, config_filename)
+    _WATCHER.start()
 
 
 def parse_args(args):
     parser = argparse.ArgumentParser()
-    parser.add_argument(
-        'nonce')
     parser.add_argument(
         'command',
         default = 'start',
@@ -132,68 +507,240 @@ def parse_args(args):
         "--name",
         nargs="+",
         help="name of inputs to run")
+    parser.add_argument(
+        "-r",
+        "--runtime",
+        default="thread",
+        choices=["thread", "asyncio"],
+        help="run each input in a thread or as an asyncio coroutine")
+    parser.add_argument(
+        "--loops",
+        type=int,
+        default=1,
+        help="number of event loops for the asyncio runtime")
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus metrics on this local port")
+    parser.add_argument(
+        "--watch",
+        type=float,
+        metavar="SECONDS",
+        help="check input configs every SECONDS and restart changed "
+             "inputs")
 
     return parser.parse_args(args)
 
 
-def create_socket():
-    sock = socket.socket()
-    sock.bind(('', 0))
-    sock.settimeout(5)
-    sock.listen()
-    host, port = sock.getsockname()
+def input_status(thread):
+    """Live state of one running input, for the `status` command."""
+
+    state = {
+        "plugin": thread.plugin,
+        "alive": thread.is_alive(),
+        "fetched": thread._m_fetched.value,
+        "posted": thread._m_posted.value,
+        "post_errors": thread._m_errors['post'].value,
+        "fetch_errors": thread._m_errors['fetch'].value,
+        "backoff_seconds": thread._m_backoff.value,
+        "last_success": thread._m_last_success.value or None,
+        "queue_batches": thread._queue_batches(),
+    }
+    if thread.spool is not None:
+        state["spool_bytes"] = len(thread.spool)
+    if thread.dedup is not None:
+        state["dedup"] = thread.dedup.stats()
+    return state
+
+
+def status():
+    inputs = {}
+    for name, thread in list(_RUNNING.items()):
+        try:
+            inputs[name] = input_status(thread)
+        except Exception as e:
+            inputs[name] = {"error": repr(e)}
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "pid": os.getpid(),
+        "load": {
+            "inputs": len(inputs),
+            "cpu_seconds": usage.ru_utime + usage.ru_stime,
+            "max_rss_kb": usage.ru_maxrss,
+            "threads": threading.active_count(),
+        },
+        "inputs": inputs,
+        "stopping": sorted(name for name, thread in list(_STOPPING.items())
+                           if thread.is_alive()),
+        "pool": _SESSION.stats() if _SESSION is not None else {},
+        "api": _LIMITER.stats() if _LIMITER is not None else {},
+    }
+
+
+def run_command(args, server=None):
+    """
+    Run a start, stop or restart command.
+
+    Runs in `_COMMAND_EXECUTOR`, one command at a time, so commands
+    never change `_RUNNING` concurrently.
+    """
+
+    if _API_CONFIG is None:  # Only configure at startup
+        configure(args.config)
+    if _SUPERVISOR is not None:
+        pass  # workers serve metrics and watch configs
+    elif args.metrics_port is not None:
+        start_metrics_server(args.metrics_port)
+    if args.watch and _SUPERVISOR is None:
+        start_watcher(args.watch, args.config)
+
+    if args.plugin is None and args.name is None:
+        all_plugin = _IDENTITY_BACKEND.get_all_plugin()
+        all_plugin = list(set(all_plugin))
+        args.plugin = all_plugin
+
+    if _SUPERVISOR is not None and args.command != 'status':
+        result = _SUPERVISOR.command(args)
+        if args.command == 'stop' and not _SUPERVISOR and \
+                server is not None:
+            server.shutdown()  # `main()` closes the supervisor
+            result["exiting"] = True
+    elif args.command == 'start':
+        result = start_input(args.plugin, args.name, args.runtime,
+                             args.loops)
+    elif args.command == 'stop':
+        result = stop_input(args.plugin, args.name)
+        # Stuck inputs keep the process alive, keep serving until they
+        # exit so that `input.py start` does not start a second run.py
+        if not _RUNNING and not _STOPPING and server is not None:
+            if _ASYNC_RUNTIME is not None:
+                _ASYNC_RUNTIME.close()
+            if _WATCHER is not None:
+                _WATCHER.stop()
+            server.shutdown()
+            result["exiting"] = True
+    elif args.command == 'restart':
+        result = restart_input(args.plugin, args.name, args.runtime,
+                               args.loops)
+    elif args.command == 'status':
+        result = status()
+
+    return {"ok": True, "result": result}
+
+
+def supervise_command(args, server=None):
+    """`run_command()` of a supervisor, see `supervisor.Supervisor`."""
+
+    if _API_CONFIG is None:  # Only configure at startup
+        configure(args.config)
+    if args.command == 'status':
+        return {"ok": True, "result": _SUPERVISOR.status()}
+    return run_command(args, server)
+
+
+def handle_request(request, server=None):
+    """
+    Handle one request from `input.py`, see `control.ControlServer`.
+
+    ``status`` is answered right away from memory. Other commands are
+    queued to `_COMMAND_EXECUTOR` and answered when they finish.
+    """
+
+    try:
+        args = parse_args([str(a) for a in request.get("argv", [])])
+    except SystemExit:
+        return {"ok": False, "error": "Invalid arguments!"}
+
+    if _SUPERVISOR is not None:
+        if args.command == 'status':  # may wait on busy workers
+            return _STATUS_EXECUTOR.submit(supervise_command, args)
+        return _COMMAND_EXECUTOR.submit(supervise_command, args, server)
+    if args.command == 'status' and _API_CONFIG is not None:
+        return {"ok": True, "result": status()}
+    return _COMMAND_EXECUTOR.submit(run_command, args, server)
+
+
+def parse_startup_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--unix-socket",
+        help="listen on this Unix domain socket instead of TCP")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="run inputs in this many worker processes")
+    parser.add_argument(
+        "--ready-fd",
+        type=int,
+        help="write 'ready' to this file descriptor once listening")
+    parser.add_argument(
+        "--log-file",
+        default="input.log",
+        help="log to this file, default input.log in the working "
+             "directory")
+    return parser.parse_args(args)
+
+
+def create_socket(unix_path=None):
+    sock, host, port = control.create_server_socket(unix_path)
     nonce = secrets.token_hex(16)     
     with open("runningconfig", "w") as f:
         f.write(f"{host},{port},{nonce}\n")
-    
 
     return sock, nonce
         
-def main():
-    global _IDENTITY_BACKEND
-    
-    sock, nonce = create_socket()
-
-    while True:
+def signal_ready(fd):
+    """
+    Tell `input.py` that `runningconfig` is written and the control
+    socket is listening, by writing ``ready`` to the pipe `fd`.
+    """
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"ready\n")
+    except OSError:
+        logging.warning("Could not signal readiness!", exc_info=True)
+
+
+def get_input_names(plugin_lst=None, name_lst=None):
+    return [input_config['data']['name'][0] for input_config in
+            _IDENTITY_BACKEND.get_config(plugin_lst, name_lst)]
+
+
+def main(argv=None):
+    global _SUPERVISOR
+
+    startup_args = parse_startup_args(argv)
+    configure_logging(startup_args.log_file)
+    if startup_args.workers > 0:
+        from supervisor import Supervisor
+        _SUPERVISOR = Supervisor(startup_args.workers, get_input_names,
+                                 os.path.abspath(startup_args.log_file))
+        _SUPERVISOR.start(_COMMAND_EXECUTOR.submit)
+    sock, nonce = create_socket(startup_args.unix_socket)
+    if startup_args.ready_fd is not None:
+        signal_ready(startup_args.ready_fd)
+
+    server = control.ControlServer(
+        sock, nonce, lambda request: handle_request(request, server))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
+    finally:
+        if _SUPERVISOR is not None:
+            _SUPERVISOR.close()
+        _COMMAND_EXECUTOR.shutdown(wait=False)
         try:
-            res = sock.accept()[0] # vulnerability: if an attacker keeps sending wrong nonce continuously, we will be stuck here forever
-            res = res.recv(4096)
-            res = res.decode()
-            res = res.split()
-
-            args = parse_args(res)
-
-            if args.nonce != nonce:
-                continue
-
-            if _API_CONFIG is None:  # Only configure at startup
-                configure(args.config)
-
-            if args.plugin is None and args.name is None:
-                all_plugin = _IDENTITY_BACKEND.get_all_plugin()
-                all_plugin = list(set(all_plugin))
-                args.plugin = all_plugin
-
-            if args.command == 'start':
-                start_input(args.plugin, args.name)
-            elif args.command == 'stop':
-                stop_input(args.plugin, args.name)
-                if not _RUNNING:
-                    sock.close()
-                    os.remove('runningconfig')
-                    break
-            elif args.command == 'restart':
-                restart_input(args.plugin, args.name)
-            elif args.command == 'status':
-                print(_RUNNING)
-                
-
-        except (KeyboardInterrupt):
-            break
-        except socket.timeout:
-            continue
-        except:
-            logging.error("Unknown error!", exc_info=True)
+            os.remove('runningconfig')
+        except FileNotFoundError:
+            pass
+        if startup_args.unix_socket:
+            try:
+                os.remove(startup_args.unix_socket)
+            except FileNotFoundError:
+                pass
     
 
 if __name__ == "__main__": 
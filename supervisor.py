@@ -0,0 +1,373 @@
+"""
+Run inputs in several worker processes.
+
+With ``run.py --workers N`` the `run.py` process is a `Supervisor`. It
+spawns N worker processes, each running inputs like a plain `run.py`,
+so that parsing and encoding of events uses N cores instead of being
+held to one by the GIL.
+
+An input is owned by the worker chosen by rendezvous hashing of its
+name over the live workers, so an input always lands on the same
+worker and adding or losing a worker only moves the inputs of that
+worker. Commands from `input.py` are split by owner and forwarded.
+When a worker dies its inputs are restarted on the other workers and
+the worker is spawned again for new inputs.
+"""
+
+import concurrent.futures
+import copy
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.connection
+import threading
+import time
+
+
+def rendezvous(name, slots):
+    """Slot with the highest hash weight for `name`."""
+
+    return max(slots, key=lambda slot: hashlib.blake2b(
+        f"{slot}\0{name}".encode(), digest_size=8).digest())
+
+
+def _reply(future):
+    try:
+        return future.result()
+    except Exception as e:
+        logging.error("Worker command failed!", exc_info=True)
+        return {"ok": False, "error": repr(e)}
+
+
+def worker_main(conn, slot, log_file='input.log'):
+    """
+    Entry point of a worker process, logging to `log_file`.
+
+    Reads ``(request_id, argv)`` from `conn` and sends back
+    ``(request_id, reply)``. Commands are handled by `run.py` exactly
+    as if they came from `input.py`. Stops every input and exits when
+    the supervisor closes the pipe.
+    """
+
+    import run
+
+    run.configure_logging(log_file)
+    send_lock = threading.Lock()
+
+    def send(request_id, reply):
+        with send_lock:
+            try:
+                conn.send((request_id, reply))
+            except (OSError, ValueError):
+                pass  # supervisor is gone
+
+    while True:
+        try:
+            request_id, argv = conn.recv()
+        except (EOFError, OSError):
+            break
+        reply = run.handle_request({"argv": argv})
+        if isinstance(reply, concurrent.futures.Future):
+            reply.add_done_callback(
+                lambda f, request_id=request_id: send(request_id, _reply(f)))
+        else:
+            send(request_id, reply)
+
+    run._COMMAND_EXECUTOR.submit(run._stop_names, list(run._RUNNING)) \
+                         .result()
+
+
+class Worker:
+    """
+    One worker process and the pipe to it.
+
+    Requests are tagged with an id so that many can be in flight, a
+    reader thread hands replies to the waiting futures.
+    """
+
+    def __init__(self, slot, log_file='input.log'):
+        self.slot = slot
+        self.log_file = log_file
+        self.process = None
+        self.spawned = 0.0
+        self._conn = None
+        self._futures = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        pid = self.process.pid if self.process else None
+        return f"Worker(slot={self.slot}, pid={pid})"
+
+    def spawn(self):
+        ctx = multiprocessing.get_context("spawn")
+        self._conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main,
+                                   args=(child, self.slot, self.log_file),
+                                   name=f"input-worker-{self.slot}")
+        self.process.start()
+        child.close()
+        self.spawned = time.monotonic()
+        threading.Thread(target=self._read, args=(self._conn,),
+                         name=f"worker-reader-{self.slot}",
+                         daemon=True).start()
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def call(self, argv):
+        """
+        Send one command.
+
+        Returns
+        -------
+        reply : concurrent.futures.Future
+            Of the reply ``dict``, an error reply if the worker dies.
+        """
+
+        future = concurrent.futures.Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._futures[request_id] = future
+            try:
+                self._conn.send((request_id, argv))
+            except (OSError, ValueError):
+                self._futures.pop(request_id)
+                future.set_result({"ok": False, "error": "Worker died!"})
+        return future
+
+    def _read(self, conn):
+        while True:
+            try:
+                request_id, reply = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = self._futures.pop(request_id, None)
+            if future is not None:
+                future.set_result(reply)
+
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.set_result({"ok": False, "error": "Worker died!"})
+
+    def close(self):
+        """Close the pipe, which makes the worker stop its inputs."""
+
+        if self._conn is not None:
+            self._conn.close()
+
+    def join(self, timeout=None):
+        """Wait for the process to exit, terminate it after `timeout`."""
+
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+
+
+class Supervisor:
+    """
+    Owns the worker processes and which input runs where.
+
+    Parameters
+    ----------
+    n_workers : int
+    get_names : callable
+        ``get_names(plugin_lst, name_lst)`` returns names of the
+        matching inputs, as in ``IdentityBackend.get_config()``.
+    log_file : str, default='input.log'
+        Log file of the worker processes.
+    """
+
+    def __init__(self, n_workers, get_names, log_file='input.log'):
+        self.workers = [Worker(slot, log_file) for slot in range(n_workers)]
+        self.get_names = get_names
+        self.owner = {}  # input name: slot
+        self.started_with = {}  # input name: (runtime, n_loops)
+        self._args = None  # options of the last command, for recovery
+        self._closing = False
+
+    def __len__(self):
+        return len(self.owner)
+
+    def start(self, submit):
+        """
+        Spawn the workers and a monitor thread. Recovery of dead
+        workers is run through `submit`, the command queue of
+        `run.py`, so it never races a command.
+        """
+
+        for worker in self.workers:
+            worker.spawn()
+        self._submit = submit
+        threading.Thread(target=self._monitor, name="worker-monitor",
+                         daemon=True).start()
+
+    def alive_slots(self):
+        return [w.slot for w in self.workers if w.is_alive()]
+
+    def _worker_argv(self, command, args, slot, names):
+        argv = [command, "-c", args.config, "-r", args.runtime,
+                "--loops", str(args.loops)]
+        if args.metrics_port is not None:
+            argv += ["--metrics-port", str(args.metrics_port + slot)]
+        if args.watch:
+            argv += ["--watch", str(args.watch)]
+        return argv + ["-n"] + names
+
+    def _forward(self, command, args, by_slot):
+        """Send `command` for ``{slot: [names]}``, merge the replies."""
+
+        by_slot = {slot: names for slot, names in by_slot.items() if names}
+        futures = {slot: self.workers[slot].call(
+                       self._worker_argv(command, args, slot, names))
+                   for slot, names in by_slot.items()}
+
+        result = {}
+        for slot, names in by_slot.items():
+            reply = futures[slot].result()
+            if not reply.get("ok"):
+                logging.error(f"Worker {slot} failed '{command}': "
+                              f"{reply.get('error')}")
+                result.setdefault("failed", []).extend(names)
+                continue
+            for key, value in reply["result"].items():
+                if isinstance(value, list):
+                    result.setdefault(key, []).extend(value)
+        return result
+
+    def _group(self, names):
+        by_slot = {}
+        slots = self.alive_slots()
+        for name in names:
+            slot = self.owner.get(name)
+            if slot is None or slot not in slots:
+                slot = rendezvous(name, slots)
+            by_slot.setdefault(slot, []).append(name)
+        return by_slot
+
+    def _start(self, args, names):
+        if not self.alive_slots():
+            raise RuntimeError("No live workers!")
+        by_slot = self._group(names)
+        result = self._forward("start", args, by_slot)
+        started = set(result.get("started", []) + result.get("running", []))
+        for slot, slot_names in by_slot.items():
+            for name in slot_names:
+                if name in started:
+                    self.owner[name] = slot
+                    self.started_with[name] = (args.runtime, args.loops)
+        return result
+
+    def _stop(self, args, names):
+        by_slot, not_running = {}, []
+        for name in names:
+            if name in self.owner:
+                by_slot.setdefault(self.owner[name], []).append(name)
+            else:
+                not_running.append(name)
+        result = self._forward("stop", args, by_slot)
+        for name in result.get("stopped", []) + result.get("not_running", []):
+            self.owner.pop(name, None)
+            self.started_with.pop(name, None)
+        # A stuck input stays with its worker, which refuses to start
+        # it again until it has exited
+        for name in result.get("stuck", []):
+            self.started_with.pop(name, None)
+        result.setdefault("not_running", []).extend(not_running)
+        return result
+
+    def command(self, args):
+        """Run a start, stop or restart command from `input.py`."""
+
+        self._args = args
+        names = list(dict.fromkeys(
+            self.get_names(args.plugin, args.name) +
+            [n for n in (args.name or []) if n in self.owner]))
+
+        if args.command == "start":
+            return self._start(args, names)
+        if args.command == "stop":
+            return self._stop(args, names)
+        if args.command == "restart":
+            stopped = self._stop(args, names)
+            return dict(self._start(args, names), **stopped)
+        raise ValueError(f"Unknown command: '{args.command}'!")
+
+    def status(self):
+        """Status of every worker, with its load, and of every input."""
+
+        argv = ["status"]
+        if self._args is not None:
+            argv += ["-c", self._args.config]
+        futures = {w.slot: w.call(argv) for w in self.workers
+                   if w.is_alive()}
+        workers, inputs = [], {}
+        for w in self.workers:
+            state = {"slot": w.slot, "alive": w.is_alive(),
+                     "pid": w.process.pid if w.process else None,
+                     "inputs": sum(1 for s in self.owner.values()
+                                   if s == w.slot)}
+            reply = futures[w.slot].result() if w.slot in futures else {}
+            if reply.get("ok"):
+                result = reply["result"]
+                state["load"] = result.get("load")
+                for name, input_state in result.get("inputs", {}).items():
+                    inputs[name] = dict(input_state, worker=w.slot)
+            workers.append(state)
+        return {"workers": workers, "inputs": inputs}
+
+    def _monitor(self):
+        while not self._closing:
+            sentinels = [w.process.sentinel for w in self.workers
+                         if w.is_alive()]
+            multiprocessing.connection.wait(sentinels, timeout=1)
+            if self._closing:
+                break
+            for w in self.workers:
+                if not w.is_alive() and time.monotonic() - w.spawned > 1:
+                    w.spawned = time.monotonic()  # one recovery at a time
+                    self._submit(self._recover, w)
+
+    def _recover(self, worker):
+        """Move the inputs of a dead worker, then spawn it again."""
+
+        if self._closing or worker.is_alive():
+            return
+        names = [n for n, slot in self.owner.items() if slot == worker.slot]
+        logging.error(f"{worker} died (exit code "
+                      f"{worker.process.exitcode}), moving "
+                      f"{len(names)} inputs!")
+        for name in names:
+            self.owner.pop(name)
+
+        if not self.alive_slots():
+            worker.spawn()
+        groups = {}
+        for name in names:
+            started_with = self.started_with.pop(name, None)
+            if started_with is None:  # stopped, but was stuck
+                continue
+            groups.setdefault(started_with, []).append(name)
+        for (runtime, n_loops), group in groups.items():
+            args = copy.copy(self._args)
+            args.runtime, args.loops = runtime, n_loops
+            result = self._start(args, group)
+            if result.get("failed"):
+                logging.error(f"Failed to move inputs: {result['failed']}")
+
+        if not worker.is_alive():
+            worker.spawn()
+
+    def close(self, timeout=10):
+        """Stop every worker, waiting up to `timeout` seconds in all."""
+
+        self._closing = True
+        for worker in self.workers:
+            worker.close()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.join(max(0, deadline - time.monotonic()))
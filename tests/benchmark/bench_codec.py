@@ -0,0 +1,96 @@
+"""
+Micro-benchmark of the JSON codecs in plugin/codec.py.
+
+Times ``loads`` (as in ``InputPlugin.decode()``) and ``dumps`` (as in
+``InputPlugin.post()``) of every installed codec on events like those
+in ``tests/test_plugin/testdata.json``: the small flat events of that
+file, and larger nested threat-intel style events.
+
+Usage
+-----
+::
+
+    python tests/benchmark/bench_codec.py [-n EVENTS] [-r REPEAT]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+if __name__ != 'input.tests.benchmark.bench_codec':
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.codec import available, get_codec
+
+
+TESTDATA = os.path.join(os.path.dirname(__file__), '..', 'test_plugin',
+                        'testdata.json')
+
+
+def small_events(n):
+    """Flat events, cycling through ``testdata.json``."""
+
+    with open(TESTDATA) as f:
+        testdata = json.load(f)
+    return [testdata[i % len(testdata)] for i in range(n)]
+
+
+def large_events(n, seed=0):
+    """Nested events of about 1 KB with unicode and numbers."""
+
+    rnd = random.Random(seed)
+    return [{
+        "id": f"indicator--{rnd.getrandbits(64):016x}",
+        "type": "indicator",
+        "created": "2021-05-06T12:00:00.000Z",
+        "pattern": f"[ipv4-addr:value = '10.{i % 256}.{i // 256 % 256}.1']",
+        "confidence": rnd.randint(0, 100),
+        "score": rnd.random(),
+        "labels": ["malicious-activity", "botnet", "ボット"],
+        "observed": [{"ts": 1620302400 + j, "port": rnd.randint(1, 65535),
+                      "bytes": rnd.getrandbits(32)} for j in range(8)],
+        "description": "Lorem ipsum dolor sit amet, " * 8,
+        "external_references": [{"source_name": "feed",
+                                 "url": f"https://example.com/{i}"}],
+    } for i in range(n)]
+
+
+def timeit(fn, items, repeat):
+    """Best events per second of `repeat` runs."""
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return len(items) / best
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-n", "--events", type=int, default=20000)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args(args)
+
+    rows = []
+    for payload, events in (("small", small_events(args.events)),
+                            ("large", large_events(args.events // 10))):
+        encoded = [json.dumps(e).encode() for e in events]
+        for name in available():
+            _, dumps, loads = get_codec(name)
+            rows.append((payload, name,
+                         timeit(loads, encoded, args.repeat),
+                         timeit(dumps, events, args.repeat)))
+
+    print(f"{'payload':8} {'codec':8} {'loads/s':>12} {'dumps/s':>12}")
+    for payload, name, loads_rate, dumps_rate in rows:
+        print(f"{payload:8} {name:8} {loads_rate:12,.0f} {dumps_rate:12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
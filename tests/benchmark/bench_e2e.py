@@ -0,0 +1,409 @@
+"""
+End-to-end throughput and latency benchmark, fully offline.
+
+Runs `WebSocket` inputs against local stand-ins:
+
+- a WebSocket source (``tests/test_plugin/wssrv.py``) sending stamped
+  JSON messages at ``--rate`` messages per second per connection,
+- a fake CYBEX-P API serving ``POST /raw`` with falcon, which tracks
+  the source-to-API latency, loss and duplication of the events it
+  receives,
+- an in-memory identity backend (mongomock) holding the input and org
+  configs, resolved through `tokencache.TokenCache` like ``run.py``.
+
+The source, the API and the inputs each run in their own process, so
+the CPU and RSS reported are those of the inputs only, and measuring
+is not slowed down by busy inputs. Linux only (reads ``/proc``).
+
+For every input count (``1 100 1000`` by default) the inputs warm up,
+then events/sec, p50/p99 latency, loss, duplicates, CPU and RSS are
+measured for ``--duration`` seconds. Results are printed, and saved as
+JSON with ``--output`` to compare runs.
+
+Usage
+-----
+::
+
+    python tests/benchmark/bench_e2e.py [--inputs N [N ...]]
+        [--duration SECONDS] [--warmup SECONDS] [--rate RATE]
+        [--size SPEC] [--option KEY=VALUE ...] [--output FILE]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import socketserver
+import sys
+import threading
+import time
+import urllib.request
+import wsgiref.simple_server
+
+if __name__ != 'input.tests.benchmark.bench_e2e':
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+
+# Stand-ins, each run in a child process
+
+def run_source(ready, rate, size, counts):
+    """
+    WebSocket source, see ``tests/test_plugin/wssrv.py``. Answers
+    every message on the pipe `counts` with the number of messages
+    sent on each connection so far.
+    """
+
+    from tests.test_plugin import wssrv
+
+    args = wssrv.parse_args(["--host", "127.0.0.1", "--port", "0",
+                             "--rate", str(rate), "--size", size])
+    handler = wssrv.LoadGenerator(args)
+
+    def answer():
+        while True:
+            try:
+                counts.recv()
+            except EOFError:
+                return
+            counts.send(dict(handler.sent_by_conn))
+
+    threading.Thread(target=answer, daemon=True).start()
+    asyncio.run(wssrv.serve(args, lambda port: ready.put(("source", port)),
+                            handler))
+
+
+class ApiStats:
+    """Events received by the fake API, tracked by their stamps."""
+
+    def __init__(self):
+        from tests.test_plugin.wssrv import Tracker
+
+        self.lock = threading.Lock()
+        self.tracker = Tracker()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.tracker.reset()
+            self.start = time.time()
+
+    def add(self, payload):
+        now = time.time()
+        events = [json.loads(line) for line in payload.split(b"\n") if line]
+        with self.lock:
+            self.requests += 1
+            for event in events:
+                self.tracker.add(event, now)
+
+    def summary(self, sent=None, start=None):
+        with self.lock:
+            return dict(self.tracker.summary(sent, start),
+                        requests=self.requests,
+                        seconds=time.time() - self.start)
+
+
+def make_api(stats):
+    import falcon
+
+    class Raw:
+        def on_post(self, req, resp):
+            for part in req.get_media():
+                if part.name == "file":
+                    stats.add(part.get_data())
+            resp.status = falcon.HTTP_201
+            resp.media = {"message": "File posted"}
+
+    class Stats:
+        def on_get(self, req, resp):
+            resp.media = stats.summary()
+
+        def on_post(self, req, resp):
+            counts = {key: {int(conn): n for conn, n in value.items()}
+                      for key, value in req.get_media().items()}
+            resp.media = stats.summary(**counts)
+
+        def on_delete(self, req, resp):
+            stats.reset()
+            resp.media = {}
+
+    app = falcon.App()
+    app.add_route("/raw", Raw())
+    app.add_route("/stats", Stats())
+    return app
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn,
+                           wsgiref.simple_server.WSGIServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def run_api(ready):
+    """Entry point of the fake API process."""
+
+    httpd = wsgiref.simple_server.make_server(
+        "127.0.0.1", 0, make_api(ApiStats()),
+        server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    ready.put(("api", httpd.server_address[1]))
+    httpd.serve_forever()
+
+
+class MockIdentityBackend:
+    """
+    The part of ``tahoe.identity.IdentityBackend`` that ``run.py``
+    uses, on a mongomock collection.
+    """
+
+    def __init__(self):
+        import mongomock
+        self.coll = mongomock.MongoClient().identity_db.instance
+
+    def add_org(self, orgid, token):
+        self.coll.insert_one({"sub_type": "cybexp_org", "_hash": orgid,
+                              "token": token})
+
+    def add_input(self, data):
+        self.coll.insert_one({"sub_type": "cybexp_input_config",
+                              "data": {k: [v] for k, v in data.items()}})
+
+    def get_all_plugin(self):
+        return self.coll.distinct("data.plugin",
+                                  {"sub_type": "cybexp_input_config"})
+
+    def get_config(self, plugin_lst=None, name_lst=None):
+        query = []
+        if plugin_lst:
+            query.append({"data.plugin": {"$in": plugin_lst}})
+        if name_lst:
+            query.append({"data.name": {"$in": name_lst}})
+        if not query:
+            return []
+        return list(self.coll.find(
+            {"sub_type": "cybexp_input_config", "$or": query},
+            {"_id": 0, "data": 1}))
+
+    def find_org(self, _hash, parse=False):
+        doc = self.coll.find_one({"sub_type": "cybexp_org", "_hash": _hash})
+        if doc is None:
+            return None
+
+        class Org:
+            def get_admins(self):
+                return [type("Admin", (), {"token": doc["token"]})]
+
+        return Org()
+
+
+# Inputs, run in a child process per input count
+
+def run_inputs(n_inputs, source_port, api_port, options, ready, stop):
+    """
+    Start `n_inputs` WebSocket inputs, run them until `stop` is set,
+    then put the number of inputs that did not exit in time.
+    """
+
+    from plugin import PooledSession, WebSocket
+    from tokencache import TokenCache
+
+    backend = MockIdentityBackend()
+    n_orgs = max(1, min(10, n_inputs))
+    for i in range(n_orgs):
+        backend.add_org(f"org{i}", f"token{i}")
+    for i in range(n_inputs):
+        backend.add_input(dict({
+            "name": f"bench-{i}", "plugin": "websocket",
+            "orgid": f"org{i % n_orgs}", "typetag": "bench",
+            "timezone": "UTC", "url": f"ws://127.0.0.1:{source_port}/",
+        }, **options))
+
+    session = PooledSession(pool_connections=10,
+                            pool_maxsize=max(10, n_inputs))
+    configs = backend.get_config(["websocket"])
+    tokens = TokenCache(backend).resolve(
+        [c["data"]["orgid"][0] for c in configs])
+    api_url = f"http://127.0.0.1:{api_port}/raw"
+
+    inputs = [WebSocket(c, api_url, tokens[c["data"]["orgid"][0]],
+                        session=session) for c in configs]
+    for plugin in inputs:
+        plugin.start()
+    ready.put(threading.active_count())
+
+    stop.wait()
+    for plugin in inputs:
+        plugin.exit_graceful()
+    deadline = time.monotonic() + 30
+    for plugin in inputs:
+        plugin.join(max(0, deadline - time.monotonic()))
+    ready.put(sum(plugin.is_alive() for plugin in inputs))
+    ready.close()
+    ready.join_thread()
+    os._exit(0)  # don't wait for stuck inputs
+
+
+# Measurement, run in this process
+
+def proc_stats(pid):
+    """CPU seconds and RSS in MB of process `pid`, from /proc."""
+
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return cpu, int(line.split()[1]) / 1024
+    return cpu, None
+
+
+def api_call(api_port, method="GET", body=None):
+    data = None if body is None else json.dumps(body).encode()
+    req = urllib.request.Request(f"http://127.0.0.1:{api_port}/stats",
+                                 data=data, method=method,
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=30) as r:
+        return json.loads(r.read())
+
+
+def sent_counts(counts):
+    """Messages sent on each source connection, see `run_source`."""
+
+    counts.send(None)
+    return counts.recv()
+
+
+def run_one(ctx, n_inputs, source_port, api_port, counts, args):
+    ready, stop = ctx.Queue(), ctx.Event()
+    process = ctx.Process(target=run_inputs, args=(
+        n_inputs, source_port, api_port, args.option, ready, stop))
+    process.start()
+    threads = ready.get()
+
+    time.sleep(args.warmup)
+    api_call(api_port, "DELETE")
+    start = sent_counts(counts)
+    cpu_start, _ = proc_stats(process.pid)
+    wall_start = time.monotonic()
+    rss_samples = []
+    while time.monotonic() - wall_start < args.duration:
+        time.sleep(min(0.5, args.duration))
+        rss_samples.append(proc_stats(process.pid)[1])
+    stats = api_call(api_port)
+    sent = sent_counts(counts)
+    cpu = proc_stats(process.pid)[0] - cpu_start
+    wall = time.monotonic() - wall_start
+
+    stop.set()
+    try:
+        stuck = ready.get(timeout=60)
+    except queue.Empty:
+        stuck = n_inputs
+    process.join(5)
+    if process.is_alive():
+        process.kill()
+    # Messages sent in the window, counted once the inputs have posted
+    # what they buffered
+    loss = api_call(api_port, "POST", {"sent": sent, "start": start})
+
+    def ms(seconds):
+        return None if seconds is None else round(seconds * 1000, 2)
+
+    return {
+        "inputs": n_inputs,
+        "seconds": round(wall, 3),
+        "events": stats["received"],
+        "duplicates": loss["duplicates"],
+        "missing": loss["missing"],
+        "requests": stats["requests"],
+        "events_per_sec": round(stats["received"] / wall, 1),
+        "latency_p50_ms": ms(stats["latency_p50"]),
+        "latency_p99_ms": ms(stats["latency_p99"]),
+        "cpu_percent": round(cpu / wall * 100, 1),
+        "rss_mb": round(max(rss_samples), 1),
+        "threads": threads,
+        "stuck_on_exit": stuck,
+    }
+
+
+def parse_option(text):
+    key, _, value = text.partition("=")
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return key, value
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--inputs", type=int, nargs="+",
+                        default=[1, 100, 1000])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--rate", type=float, default=10,
+                        help="messages per second per input")
+    parser.add_argument("--size", default="fixed:250",
+                        help="message size distribution, see "
+                             "tests/test_plugin/wssrv.py")
+    parser.add_argument("--option", type=parse_option, action="append",
+                        default=[], metavar="KEY=VALUE",
+                        help="input config option, e.g. batch=true")
+    parser.add_argument("--output", help="save results to this JSON file")
+    args = parser.parse_args(args)
+    args.option = dict([("stream", True), ("batch", True),
+                        ("flush_max_linger", 1)] + args.option)
+
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Queue()
+    counts, source_counts = ctx.Pipe()
+    standins = [
+        ctx.Process(target=run_source,
+                    args=(ready, args.rate, args.size, source_counts),
+                    daemon=True),
+        ctx.Process(target=run_api, args=(ready,), daemon=True),
+    ]
+    for process in standins:
+        process.start()
+    ports = dict(ready.get(timeout=30) for _ in standins)
+    source_port, api_port = ports["source"], ports["api"]
+
+    from plugin.codec import get_codec
+
+    results = {
+        "benchmark": "e2e",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "json_codec": get_codec()[0],
+        "rate_per_input": args.rate,
+        "message_size": args.size,
+        "options": args.option,
+        "runs": [],
+    }
+    try:
+        for n in args.inputs:
+            run = run_one(ctx, n, source_port, api_port, counts, args)
+            results["runs"].append(run)
+            print(json.dumps(run), flush=True)
+    finally:
+        for process in standins:
+            process.terminate()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
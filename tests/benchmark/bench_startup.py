@@ -0,0 +1,132 @@
+"""
+Cold-start benchmark of ``input.py`` and ``run.py``.
+
+Measures, each in fresh interpreters and in a scratch directory:
+
+- ``import run``, the imports done before ``run.py`` listens,
+- spawning ``run.py --ready-fd`` until it says it is ready, which is
+  what ``input.py start`` waits for when ``run.py`` is not running,
+- ``input.py status`` against the running ``run.py``, the round trip
+  of one command including interpreter start-up (mostly ``site``).
+
+A cold ``input.py start`` takes about the ready time plus one round
+trip, plus starting the inputs. Starting inputs needs the identity DB,
+so it is not part of this benchmark. Needs ``tahoe`` importable, like
+``run.py`` itself.
+
+Usage
+-----
+::
+
+    python tests/benchmark/bench_startup.py [-r REPEAT] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import select
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+def time_import(module, cwd):
+    """Seconds to import `module` in a fresh interpreter."""
+
+    code = ("import time; t = time.perf_counter(); "
+            f"import {module}; print(time.perf_counter() - t)")
+    out = subprocess.run([sys.executable, "-c", code], cwd=cwd,
+                         env=dict(os.environ, PYTHONPATH=os.pathsep.join(
+                             [ROOT, os.environ.get("PYTHONPATH", "")])),
+                         check=True, capture_output=True, text=True)
+    return float(out.stdout)
+
+
+def start_run(cwd):
+    """
+    Spawn ``run.py`` and wait for its readiness pipe.
+
+    Returns
+    -------
+    proc : subprocess.Popen
+    seconds : float
+        From spawning to ready.
+    """
+
+    ready_r, ready_w = os.pipe()
+    t = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "run.py"),
+         "--ready-fd", str(ready_w)], cwd=cwd, pass_fds=(ready_w,))
+    os.close(ready_w)
+    with os.fdopen(ready_r, "rb") as ready:
+        if not select.select([ready], [], [], 30)[0] or \
+                ready.readline().strip() != b"ready":
+            proc.kill()
+            raise RuntimeError("run.py did not get ready!")
+    return proc, time.perf_counter() - t
+
+
+def time_status(cwd):
+    """Seconds for ``input.py status`` to run and exit."""
+
+    t = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(ROOT, "input.py"),
+                    "status"], cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - t
+
+
+def stop_run(proc):
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--output", help="save results to this JSON file")
+    args = parser.parse_args(args)
+
+    samples = {"import_run": [], "ready": [], "status": []}
+    with tempfile.TemporaryDirectory() as cwd:
+        for _ in range(args.repeat):
+            samples["import_run"].append(time_import("run", cwd))
+            proc, seconds = start_run(cwd)
+            try:
+                samples["ready"].append(seconds)
+                samples["status"].append(time_status(cwd))
+            finally:
+                stop_run(proc)
+
+    results = {
+        "benchmark": "startup",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+    }
+    for key, values in samples.items():
+        results[f"{key}_ms"] = round(statistics.median(values) * 1000, 1)
+        results[f"{key}_max_ms"] = round(max(values) * 1000, 1)
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
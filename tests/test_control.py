@@ -0,0 +1,100 @@
+"""unittests for control.py"""
+
+import concurrent.futures
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+if __name__ != 'input.tests.test_control':
+    import sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..')] + sys.path
+
+import control
+
+
+class ControlServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.slow = concurrent.futures.ThreadPoolExecutor(1)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.server.shutdown()
+        self.thread.join(5)
+        self.slow.shutdown()
+
+    def handler(self, request):
+        argv = request["argv"]
+        if argv[0] == "slow":
+            return self.slow.submit(
+                lambda: self.release.wait(5) and {"ok": True, "result": "slow"})
+        if argv[0] == "fail":
+            raise ValueError("boom")
+        return {"ok": True, "result": argv}
+
+    def serve(self, unix_path=None):
+        sock, host, port = control.create_server_socket(unix_path)
+        self.server = control.ControlServer(sock, "secret", self.handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return control.parse_address(host, port)
+
+    def call(self, address, obj):
+        with control.connect(*address, timeout=5) as sock:
+            return control.request(sock, obj)
+
+    def test_01_reply(self):
+        address = self.serve()
+        reply = self.call(address, {"nonce": "secret",
+                                    "argv": ["start", "-n", "a b"]})
+        self.assertEqual(reply, {"ok": True,
+                                 "result": ["start", "-n", "a b"]})
+
+    def test_02_bad_nonce(self):
+        address = self.serve()
+        reply = self.call(address, {"nonce": "wrong", "argv": ["start"]})
+        self.assertFalse(reply["ok"])
+
+    def test_03_handler_error(self):
+        address = self.serve()
+        reply = self.call(address, {"nonce": "secret", "argv": ["fail"]})
+        self.assertFalse(reply["ok"])
+        self.assertIn("boom", reply["error"])
+
+    def test_04_slow_command_does_not_block(self):
+        address = self.serve()
+        results = []
+        slow = threading.Thread(target=lambda: results.append(
+            self.call(address, {"nonce": "secret", "argv": ["slow"]})))
+        slow.start()
+        time.sleep(0.1)
+
+        # A silent client and a fast command are served meanwhile.
+        idle = control.connect(*address, timeout=5)
+        reply = self.call(address, {"nonce": "secret", "argv": ["status"]})
+        self.assertTrue(reply["ok"])
+        self.assertEqual(results, [])
+
+        self.release.set()
+        slow.join(5)
+        idle.close()
+        self.assertEqual(results, [{"ok": True, "result": "slow"}])
+
+    def test_05_unix_socket(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "control.sock")
+            address = self.serve(path)
+            self.assertEqual(address[0], socket.AF_UNIX)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            reply = self.call(address, {"nonce": "secret", "argv": ["x"]})
+            self.assertTrue(reply["ok"])
+
+
+if __name__ == '__main__':
+    unittest.main()
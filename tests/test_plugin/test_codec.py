@@ -0,0 +1,66 @@
+"""unittests for plugin/codec.py"""
+
+import json
+import math
+import unittest
+
+if __name__ != 'input.tests.test_plugin.test_codec':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.codec import available, get_codec
+
+
+EVENTS = [
+    {"a": 1},
+    {"url": "http://example.com/x", "tags": ["ü", "日本"], "n": None},
+    {"nested": {"f": 1.5, "t": True, "l": [1, [2, {"x": -3}]]}},
+    {"big": 2 ** 70},  # too big for orjson
+]
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_01_round_trip(self):
+        for name in available():
+            _, dumps, loads = get_codec(name)
+            for event in EVENTS:
+                with self.subTest(codec=name, event=event):
+                    encoded = dumps(event)
+                    self.assertIsInstance(encoded, bytes)
+                    self.assertEqual(json.loads(encoded), event)
+                    self.assertEqual(loads(encoded), event)
+                    self.assertEqual(loads(encoded.decode()), event)
+
+    def test_02_exact(self):
+        for name in available():
+            _, dumps, _ = get_codec(name, exact=True)
+            for event in EVENTS:
+                self.assertEqual(dumps(event), json.dumps(event).encode())
+
+    def test_03_stdlib_only_values(self):
+        for name in available():
+            _, _, loads = get_codec(name)
+            self.assertEqual(loads('{"v": NaN}').keys(), {"v"})
+            with self.assertRaises(ValueError):
+                loads("{not json")
+
+    def test_04_non_finite_floats(self):
+        for name in available():
+            _, dumps, _ = get_codec(name)
+            with self.subTest(codec=name):
+                decoded = json.loads(dumps({"v": math.nan, "w": None,
+                                            "l": [math.inf]}))
+                self.assertTrue(math.isnan(decoded["v"]))
+                self.assertIsNone(decoded["w"])
+                self.assertEqual(decoded["l"], [math.inf])
+
+    def test_05_auto_and_unknown(self):
+        self.assertEqual(get_codec()[0], available()[0])
+        with self.assertRaises(ValueError):
+            get_codec("simdjson")
+
+
+if __name__ == '__main__':
+    unittest.main()
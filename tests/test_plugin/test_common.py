@@ -0,0 +1,515 @@
+"""unittests for plugin/common.py"""
+
+import gzip
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+if __name__ != 'input.tests.test_plugin.test_common':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.aio import AsyncRuntime
+from plugin.common import InputPlugin
+from plugin.metrics import exposition
+from plugin.ratelimit import ApiLimiter, RetryAfter
+
+
+def make_config(**kwargs):
+    data = {"name": ["test input"], "plugin": ["test"],
+            "orgid": ["testorgid"], "typetag": ["test_typetag"],
+            "timezone": ["US/Pacific"],
+            "json_exact": [True]}  # same bytes with any JSON codec
+    for k, v in kwargs.items():
+        data[k] = [v]
+    return {"data": data}
+
+
+class PostTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('plugin.common.requests.post')
+        self.post_mock = patcher.start()
+        self.post_mock.return_value.__enter__.return_value.status_code = 201
+        self.addCleanup(patcher.stop)
+
+    def posted_files(self):
+        return [kwargs['files']['file']
+                for args, kwargs in self.post_mock.call_args_list]
+
+    def test_01_one_request_per_event(self):
+        plugin = InputPlugin(make_config(), "http://example.com/raw", "t")
+        plugin.post([{"a": 1}, "b", b"c"])
+        self.assertEqual(self.posted_files(), [b'{"a": 1}', b"b", b"c"])
+
+    def test_02_batch_max_events(self):
+        config = make_config(batch=True, batch_max_events=2)
+        plugin = InputPlugin(config, "http://example.com/raw", "t")
+        plugin.post([{"a": 1}, {"b": 2}, {"c": 3}])
+        self.assertEqual(self.posted_files(),
+                         [b'{"a": 1}\n{"b": 2}', b'{"c": 3}'])
+        data = self.post_mock.call_args[1]['data']
+        self.assertEqual(data['format'], 'ndjson')
+
+    def test_03_batch_max_bytes(self):
+        config = make_config(batch=True, batch_max_bytes=8)
+        plugin = InputPlugin(config, "http://example.com/raw", "t")
+        plugin.post(["aaa", "bbb", "ccc"])
+        self.assertEqual(self.posted_files(), [b"aaa\nbbb", b"ccc"])
+
+    def test_04_batch_event_with_newline(self):
+        config = make_config(batch=True)
+        plugin = InputPlugin(config, "http://example.com/raw", "t")
+        plugin.post(["a", "b\nc", "d"])
+        self.assertEqual(self.posted_files(), [b"b\nc", b"a\nd"])
+
+    def test_05_retry_resumes_after_failure(self):
+        ok = self.post_mock.return_value
+        failed = mock.MagicMock()
+        failed.__enter__.return_value.status_code = 500
+        self.post_mock.side_effect = [ok, failed, ok, ok]
+
+        plugin = InputPlugin(make_config(), "http://example.com/raw", "t")
+        delivery = plugin.prepare(["a", "b", "c"])
+        with self.assertRaises(Exception):
+            plugin.post(delivery)
+        self.assertEqual(delivery.cursor, 1)
+        plugin.post(delivery)
+
+        self.assertTrue(delivery.done)
+        self.assertEqual(self.posted_files(), [b"a", b"b", b"b", b"c"])
+
+    def test_06_idempotency_key(self):
+        plugin = InputPlugin(make_config(), "http://example.com/raw", "t")
+        plugin.post(["a", "a", "b"])
+        keys = [kwargs['headers']['Idempotency-Key']
+                for args, kwargs in self.post_mock.call_args_list]
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
+        data = self.post_mock.call_args[1]['data']
+        self.assertEqual(data['idempotency_key'], [keys[2]])
+
+    def test_07_dedup(self):
+        plugin = InputPlugin(make_config(dedup=True),
+                             "http://example.com/raw", "t")
+        plugin.post([{"a": 1}, {"a": 1}, {"b": 2}])
+        plugin.post([{"b": 2}])
+        self.assertEqual(self.posted_files(), [b'{"a": 1}', b'{"b": 2}'])
+        self.assertEqual(plugin.dedup.stats()["hits"], 2)
+
+        self.post_mock.return_value.__enter__.return_value.status_code = 500
+        with self.assertRaises(Exception):
+            plugin.post([{"c": 3}])
+        self.post_mock.return_value.__enter__.return_value.status_code = 201
+        plugin.post([{"c": 3}])  # fetched again after the failure
+        self.assertEqual(self.posted_files()[-2:],
+                         [b'{"c": 3}', b'{"c": 3}'])
+
+    def test_08_compression(self):
+        config = make_config(compression="gzip", compression_min_bytes=10)
+        plugin = InputPlugin(config, "http://example.com/raw", "t")
+        plugin.post(["small", "x" * 100])
+
+        small, large = self.post_mock.call_args_list
+        self.assertEqual(small[1]['files']['file'], b"small")
+        self.assertNotIn('content_encoding', small[1]['data'])
+        self.assertEqual(gzip.decompress(large[1]['files']['file']),
+                         b"x" * 100)
+        self.assertEqual(large[1]['data']['content_encoding'], "gzip")
+
+    def test_09_bad_type(self):
+        plugin = InputPlugin(make_config(), "http://example.com/raw", "t")
+        with self.assertRaises(TypeError):
+            plugin.post([1])
+
+    def test_10_retry_after(self):
+        ok = self.post_mock.return_value
+        busy = mock.MagicMock()
+        busy.__enter__.return_value.status_code = 429
+        busy.__enter__.return_value.headers = {"Retry-After": "0.05"}
+        self.post_mock.side_effect = [busy, ok]
+
+        limiter = ApiLimiter()
+        plugin = InputPlugin(make_config(), "http://example.com/raw", "t",
+                             limiter=limiter)
+        with self.assertRaises(RetryAfter) as cm:
+            plugin.post("a")
+        self.assertEqual(cm.exception.seconds, 0.05)
+        self.assertGreater(limiter.wait_time("testorgid"), 0)
+        self.assertTrue(plugin._post_retry("a"))
+        self.assertEqual(self.posted_files(), [b"a", b"a"])
+        self.assertEqual(limiter.concurrency.in_flight, 0)
+
+    def test_11_default_encoding_is_exact(self):
+        config = make_config()
+        del config["data"]["json_exact"]
+        plugin = InputPlugin(config, "http://example.com/raw", "t")
+        event = {"a": 1, "u": "ü", "f": [1.5]}
+        self.assertEqual(plugin._encode([event]), [json.dumps(event).encode()])
+
+
+class DecodeTest(unittest.TestCase):
+
+    def test_01_parsed(self):
+        plugin = InputPlugin(make_config(), "http://example.com/raw", "t")
+        self.assertEqual(plugin.decode('{"a": 1}'), {"a": 1})
+
+    def test_02_raw_passthrough(self):
+        plugin = InputPlugin(make_config(raw=True),
+                             "http://example.com/raw", "t")
+        self.assertEqual(plugin.decode('{"a":1}'), '{"a":1}')
+        self.assertEqual(plugin.decode(b'{"a":1}'), b'{"a":1}')
+
+    def test_03_raw_validate(self):
+        plugin = InputPlugin(make_config(raw=True, raw_validate="prefix"),
+                             "http://example.com/raw", "t")
+        self.assertEqual(plugin.decode(' {"a"'), ' {"a"')
+        self.assertIsNone(plugin.decode("hello"))
+
+        plugin = InputPlugin(make_config(raw=True, raw_validate="json"),
+                             "http://example.com/raw", "t")
+        self.assertIsNone(plugin.decode('{"a"'))
+
+    def test_04_decode_or_skip_counts_invalid(self):
+        plugin = InputPlugin(make_config(), "http://example.com/raw", "t")
+        self.assertEqual(plugin.decode_or_skip('{"a": 1}'), {"a": 1})
+        self.assertIsNone(plugin.decode_or_skip('{"a"'))
+
+        raw = InputPlugin(make_config(raw=True, raw_validate="prefix"),
+                          "http://example.com/raw", "t")
+        self.assertIsNone(raw.decode_or_skip("hello"))
+
+        for p in (plugin, raw):
+            self.assertEqual(p.invalid, 1)
+            self.assertIn('cybexp_input_invalid_total{input="test input",'
+                          'plugin="test"} 1', exposition([p.metrics]))
+
+
+class CountingInput(InputPlugin):
+    def fetch(self):
+        return [{"n": 1}]
+
+
+class BlockingInput(InputPlugin):
+    """Blocks in ``fetch()`` on a socket no one writes to."""
+
+    def __init__(self, *args, **kwargs):
+        self.sock, self.peer = socket.socketpair()
+        super().__init__(*args, **kwargs)
+
+    def fetch(self):
+        if not self.sock.recv(1):
+            return None
+        return {"n": 1}
+
+    def interrupt(self):
+        self.sock.shutdown(socket.SHUT_RDWR)
+
+
+class InterruptTest(unittest.TestCase):
+
+    def test_01_exit_now_interrupts_fetch(self):
+        plugin = BlockingInput(make_config(), "http://example.com/raw", "t")
+        self.addCleanup(plugin.peer.close)
+        self.addCleanup(plugin.sock.close)
+        plugin.start()
+        plugin.exit_graceful()
+        plugin.join(0.2)
+        self.assertTrue(plugin.is_alive())  # still blocked in recv()
+
+        plugin.exit_now()
+        plugin.join(5)
+        self.assertFalse(plugin.is_alive())
+
+
+class DaemonTest(unittest.TestCase):
+
+    def test_01_not_daemon_when_made_in_daemon_thread(self):
+        plugins = []
+        maker = threading.Thread(target=lambda: plugins.append(
+            CountingInput(make_config(), "http://example.com/raw", "t")),
+            daemon=True)
+        maker.start()
+        maker.join()
+        self.assertFalse(plugins[0].daemon)
+
+
+class BufferedInput(InputPlugin):
+    """Has one event left in a buffer when it exits."""
+
+    def fetch(self):
+        self.exit_graceful_event.wait(5)
+        return []
+
+    def drain(self):
+        return [{"rest": 1}]
+
+
+class DrainTest(unittest.TestCase):
+
+    @mock.patch('plugin.common.requests.post')
+    def test_01_rest_posted_on_graceful_exit(self, post_mock):
+        post_mock.return_value.__enter__.return_value.status_code = 201
+        for config in (make_config(), make_config(pipeline_depth=2)):
+            post_mock.reset_mock()
+            plugin = BufferedInput(config, "http://example.com/raw", "t")
+            plugin.start()
+            plugin.exit_graceful()
+            plugin.join(3.0)
+            self.assertFalse(plugin.is_alive())
+            self.assertEqual(post_mock.call_args[1]['files']['file'],
+                             b'{"rest": 1}')
+
+    @mock.patch('plugin.common.requests.post')
+    def test_02_not_after_exit_now(self, post_mock):
+        plugin = BufferedInput(make_config(), "http://example.com/raw", "t")
+        plugin.start()
+        plugin.exit_now()
+        plugin.join(3.0)
+        self.assertEqual(post_mock.call_count, 0)
+
+
+class PipelineTest(unittest.TestCase):
+
+    @mock.patch('plugin.common.requests.post')
+    def test_01_fetch_and_post_overlap(self, post_mock):
+        def slow_post(*args, **kwargs):
+            time.sleep(0.05)
+            return mock.DEFAULT
+        post_mock.side_effect = slow_post
+        post_mock.return_value.__enter__.return_value.status_code = 201
+
+        plugin = CountingInput(make_config(pipeline_depth=2),
+                               "http://example.com/raw", "t")
+        plugin.start()
+        time.sleep(0.5)
+        self.assertLessEqual(plugin.pipeline_queue.qsize(), 2)
+        plugin.exit_graceful()
+        plugin.join(3.0)
+
+        self.assertFalse(plugin.is_alive())
+        self.assertGreater(plugin.timing['post'].count, 1)
+        self.assertGreaterEqual(plugin.timing['fetch'].count,
+                                plugin.timing['post'].count)
+
+
+class SpoolRunTest(unittest.TestCase):
+
+    @mock.patch('plugin.common.requests.post')
+    def test_01_post_from_spool(self, post_mock):
+        post_mock.return_value.__enter__.return_value.status_code = 201
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+
+        plugin = CountingInput(make_config(spool_dir=spool_dir, period=0.05),
+                               "http://example.com/raw", "t")
+        plugin.start()
+        time.sleep(0.3)
+        plugin.exit_graceful()
+        plugin.join(3.0)
+
+        self.assertFalse(plugin.is_alive())
+        self.assertGreater(post_mock.call_count, 0)
+        self.assertEqual(post_mock.call_args[1]['files']['file'],
+                         b'{"n": 1}')
+
+    @mock.patch('plugin.common.requests.post')
+    def test_02_interrupted_post_keeps_records(self, post_mock):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        plugin = CountingInput(make_config(spool_dir=spool_dir),
+                               "http://example.com/raw", "t")
+
+        def exit_now(*args, **kwargs):
+            plugin.exit_now()  # during the first request
+            return mock.DEFAULT
+        post_mock.side_effect = exit_now
+        post_mock.return_value.__enter__.return_value.status_code = 201
+
+        plugin.spool.append([b'{"n": 1}', b'{"n": 2}', b'{"n": 3}'])
+        plugin._drain_spool()
+        plugin.spool.close()
+        self.assertEqual(post_mock.call_count, 1)
+
+        plugin = CountingInput(make_config(spool_dir=spool_dir),
+                               "http://example.com/raw", "t")
+        self.addCleanup(plugin.spool.close)
+        records, _ = plugin.spool.read(10, timeout=0)
+        self.assertEqual(records, [b'{"n": 1}', b'{"n": 2}', b'{"n": 3}'])
+
+
+    def test_03_spool_metrics_in_bytes(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        plugin = CountingInput(make_config(spool_dir=spool_dir),
+                               "http://example.com/raw", "t")
+        self.addCleanup(plugin.spool.close)
+        plugin.spool.append([b'{"n": 1}'])
+
+        text = exposition([plugin.metrics])
+        self.assertIn('cybexp_input_queue_batches{input="test input",'
+                      'plugin="test"} 0', text)
+        self.assertRegex(text, r'cybexp_input_spool_bytes\{.*\} [1-9]')
+
+
+class CursorInput(InputPlugin):
+    """Fetches ``{"n": k}`` with k counting up from its saved cursor."""
+
+    def fetch(self):
+        self.n = getattr(self, 'n', self.saved_state.get('n', 0)) + 1
+        return [{"n": self.n}]
+
+    def checkpoint(self):
+        return {"n": self.n}
+
+
+class PairInput(CursorInput):
+    """Two events, two requests, per fetch."""
+
+    def fetch(self):
+        return super().fetch() + [{"n": self.n, "second": True}]
+
+
+class CheckpointTest(unittest.TestCase):
+
+    @mock.patch('plugin.common.requests.post')
+    def test_01_commit_after_post(self, post_mock):
+        ok = mock.MagicMock()
+        ok.__enter__.return_value.status_code = 201
+        failed = mock.MagicMock()
+        failed.__enter__.return_value.status_code = 500
+        post_mock.side_effect = [ok, ok, failed]
+        checkpoint_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, checkpoint_dir)
+        config = make_config(checkpoint_dir=checkpoint_dir, period=0.01)
+
+        plugin = CursorInput(config, "http://example.com/raw", "t")
+        plugin.start()
+        while post_mock.call_count < 3:
+            time.sleep(0.01)
+        plugin.exit_now()
+        plugin.join(3.0)
+        self.assertEqual(plugin.saved_state, {"n": 2})  # 3 not posted
+
+        plugin = CursorInput(config, "http://example.com/raw", "t")
+        self.assertEqual(plugin.saved_state, {"n": 2})
+        self.assertEqual(plugin.fetch(), [{"n": 3}])
+
+    @mock.patch('plugin.common.requests.post')
+    def test_02_no_commit_after_interrupted_post(self, post_mock):
+        post_mock.return_value.__enter__.return_value.status_code = 201
+
+        for runtime in ("thread", "asyncio"):
+            checkpoint_dir = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, checkpoint_dir)
+            config = make_config(checkpoint_dir=checkpoint_dir, period=0.01)
+            plugin = PairInput(config, "http://example.com/raw", "t")
+
+            def exit_now(*args, **kwargs):
+                if post_mock.call_count == 3:  # first of the second fetch
+                    plugin.exit_now()
+                return mock.DEFAULT
+            post_mock.reset_mock()
+            post_mock.side_effect = exit_now
+
+            if runtime == "thread":
+                plugin.start()
+                plugin.join(3.0)
+            else:
+                aio = AsyncRuntime(n_loops=1)
+                self.addCleanup(aio.close)
+                aio.start(plugin).join(3.0)
+            self.assertEqual(post_mock.call_count, 3)
+            self.assertEqual(plugin.saved_state, {"n": 1}, runtime)
+
+
+class DrainBackoffTest(unittest.TestCase):
+    """A failing API must not be retried without delay after
+    ``exit_graceful()``."""
+
+    def check(self, post_mock, start, **kwargs):
+        post_mock.return_value.__enter__.return_value.status_code = 500
+        plugin = CountingInput(make_config(**kwargs),
+                               "http://example.com/raw", "t")
+        handle = start(plugin)
+        deadline = time.monotonic() + 3
+        while post_mock.call_count < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        handle.exit_graceful()
+        time.sleep(0.5)
+        self.assertLessEqual(post_mock.call_count, 2)
+        self.assertTrue(handle.is_alive())  # still backing off
+
+        handle.exit_now()
+        handle.join(3.0)
+        self.assertFalse(handle.is_alive())
+
+    def start_thread(self, plugin):
+        plugin.start()
+        return plugin
+
+    @mock.patch('plugin.common.requests.post')
+    def test_01_thread(self, post_mock):
+        self.check(post_mock, self.start_thread)
+
+    @mock.patch('plugin.common.requests.post')
+    def test_02_pipeline(self, post_mock):
+        self.check(post_mock, self.start_thread, pipeline_depth=2)
+
+    @mock.patch('plugin.common.requests.post')
+    def test_03_asyncio(self, post_mock):
+        runtime = AsyncRuntime(n_loops=1)
+        self.addCleanup(runtime.close)
+        self.check(post_mock, runtime.start)
+
+
+class AsyncRuntimeTest(unittest.TestCase):
+
+    @mock.patch('plugin.common.requests.post')
+    def test_01_sync_fetch_on_event_loop(self, post_mock):
+        post_mock.return_value.__enter__.return_value.status_code = 201
+        runtime = AsyncRuntime(n_loops=2)
+        self.addCleanup(runtime.close)
+
+        plugin = CountingInput(make_config(period=30),
+                               "http://example.com/raw", "t")
+        handle = runtime.start(plugin)
+        self.assertTrue(handle.is_alive())
+        self.assertEqual(handle.name_, "test input")
+
+        time.sleep(0.2)
+        handle.exit_graceful()
+        handle.join(2.0)
+        self.assertFalse(handle.is_alive())
+        self.assertEqual(post_mock.call_count, 1)
+
+    @mock.patch('plugin.common.requests.post')
+    def test_02_pipeline_input_does_not_hold_executor(self, post_mock):
+        post_mock.return_value.__enter__.return_value.status_code = 201
+        runtime = AsyncRuntime(n_loops=1, max_workers=1)
+        self.addCleanup(runtime.close)
+
+        config = make_config(pipeline_depth=1, period=30)
+        pipeline = runtime.start(CountingInput(config,
+                                               "http://example.com/raw", "t"))
+        plain = runtime.start(CountingInput(make_config(period=30),
+                                            "http://example.com/raw", "t"))
+        deadline = time.monotonic() + 3
+        while post_mock.call_count < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(post_mock.call_count, 2)  # both posted
+
+        for handle in (pipeline, plain):
+            handle.exit_graceful()
+            handle.join(3.0)
+            self.assertFalse(handle.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
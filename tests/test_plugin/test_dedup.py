@@ -0,0 +1,75 @@
+"""unittests for plugin/dedup.py"""
+
+import time
+import unittest
+from unittest import mock
+
+if __name__ != 'input.tests.test_plugin.test_dedup':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.dedup import BloomFilter, DedupCache, digest
+
+
+class DedupCacheTest(unittest.TestCase):
+
+    def test_01_repeat_within_window(self):
+        cache = DedupCache(window=60)
+        a, b = digest(b'{"a": 1}'), digest(b'{"a": 2}')
+        self.assertFalse(cache.seen(a))
+        self.assertFalse(cache.seen(a))  # not added yet
+        cache.add(a)
+        self.assertTrue(cache.seen(a))
+        self.assertFalse(cache.seen(b))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 3)
+
+    def test_02_expires_after_window(self):
+        cache = DedupCache(window=10)
+        with mock.patch('plugin.dedup.time.monotonic') as now:
+            now.return_value = 100
+            cache.add(b"x")
+            now.return_value = 111
+            self.assertFalse(cache.seen(b"x"))
+
+    def test_03_expiry_from_first_add(self):
+        cache = DedupCache(window=10)
+        with mock.patch('plugin.dedup.time.monotonic') as now:
+            for t in (100, 105, 109):
+                now.return_value = t
+                cache.seen(b"x")
+                cache.add(b"x")
+            now.return_value = 111
+            self.assertFalse(cache.seen(b"x"))
+
+    def test_04_max_entries(self):
+        cache = DedupCache(max_entries=2)
+        for e in (b"a", b"b", b"c"):
+            cache.add(e)
+        self.assertFalse(cache.seen(b"a"))  # evicted
+        self.assertTrue(cache.seen(b"c"))
+
+    def test_05_bloom(self):
+        cache = DedupCache(window=60, bloom_capacity=1000)
+        self.assertFalse(cache.seen(digest(b"x")))
+        cache.add(digest(b"x"))
+        self.assertTrue(cache.seen(digest(b"x")))
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def test_01_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        keys = [digest(b"%d" % i) for i in range(1000)]
+        for k in keys:
+            bloom.add(k)
+        self.assertTrue(all(k in bloom for k in keys))
+
+        false_positives = sum(digest(b"x%d" % i) in bloom
+                              for i in range(10000))
+        self.assertLess(false_positives, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
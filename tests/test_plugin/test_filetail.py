@@ -0,0 +1,130 @@
+"""unittests for plugin/filetail.py"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+if __name__ != 'input.tests.test_plugin.test_filetail':
+    import sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.filetail import FileTail
+
+
+class FileTailTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.log = os.path.join(self.dir, "logs", "cowrie.json")
+        os.makedirs(os.path.dirname(self.log))
+
+    def tail(self, path=None, **kwargs):
+        data = {"name": ["test tail"], "plugin": ["filetail"],
+                "orgid": ["testorgid"], "typetag": ["test_typetag"],
+                "timezone": ["US/Pacific"], "path": [path or self.log],
+                "checkpoint_dir": [os.path.join(self.dir, "checkpoints")],
+                "start_at": ["beginning"], "flush_max_linger": [0.2],
+                "poll": [0.05]}
+        for k, v in kwargs.items():
+            data[k] = [v]
+        plugin = FileTail({"data": data}, "http://example.com/raw", "t")
+        self.addCleanup(plugin._stop)
+        return plugin
+
+    def write(self, *lines, path=None, mode="a"):
+        with open(path or self.log, mode) as f:
+            f.writelines(line + "\n" for line in lines)
+
+    def poll(self, plugin):
+        """One fetch() and commit(), like `run()` after posting."""
+
+        events = plugin.fetch()
+        state = plugin.checkpoint()
+        if state is not None:
+            plugin.commit(state)
+        return events
+
+    def test_01_new_lines_and_partial_line(self):
+        self.write('{"n": 1}', '{"n": 2}')
+        plugin = self.tail()
+        self.assertEqual(self.poll(plugin), [{"n": 1}, {"n": 2}])
+
+        with open(self.log, "a") as f:
+            f.write('{"n": 3}\n{"n": ')
+        self.assertEqual(self.poll(plugin), [{"n": 3}])
+        self.write('4}')
+        self.assertEqual(self.poll(plugin), [{"n": 4}])
+
+    def test_02_resume_from_checkpoint(self):
+        self.write('{"n": 1}', '{"n": 2}')
+        self.poll(self.tail())
+        self.write('{"n": 3}')
+
+        plugin = self.tail(start_at="end")
+        self.assertEqual(self.poll(plugin), [{"n": 3}])
+
+    def test_03_rotation_by_rename(self):
+        self.write('{"n": 1}')
+        plugin = self.tail()
+        self.poll(plugin)
+
+        self.write('{"n": 2}')
+        os.rename(self.log, self.log + ".1")
+        self.write('{"n": 3}')
+        self.assertEqual(self.poll(plugin) + self.poll(plugin),
+                         [{"n": 2}, {"n": 3}])
+        self.poll(plugin)
+        self.assertEqual(len(plugin._files), 1)
+
+    def test_04_rotated_while_stopped(self):
+        self.write('{"n": 1}')
+        self.poll(self.tail())
+
+        self.write('{"n": 2}')
+        os.rename(self.log, self.log + ".1")
+        self.write('{"n": 3}')
+        plugin = self.tail(start_at="end")
+        events = self.poll(plugin) + self.poll(plugin)
+        self.assertEqual(sorted(e["n"] for e in events), [2, 3])
+
+    def test_05_truncation(self):
+        self.write('{"n": 1}', '{"n": 2}')
+        plugin = self.tail()
+        self.poll(plugin)
+        self.write('{"n": 3}', mode="w")
+        self.assertEqual(self.poll(plugin), [{"n": 3}])
+
+    def test_06_truncation_drops_buffered_lines(self):
+        self.write(*(f'{{"n": {i}}}' for i in range(5)))
+        plugin = self.tail(flush_max_events=2)
+        self.assertEqual(self.poll(plugin), [{"n": 0}, {"n": 1}])
+        self.assertEqual(len(plugin._lines), 3)  # still buffered
+
+        self.write('{"n": 9}', mode="w")
+        self.assertEqual(self.poll(plugin), [{"n": 9}])
+        [state] = plugin.saved_state["files"].values()
+        self.assertEqual(state["offset"], len('{"n": 9}\n'))
+
+    def test_07_invalid_json_skipped(self):
+        self.write('{"a":1}', '{"a":2}', 'not json', '{"a":3}')
+        plugin = self.tail()
+        self.assertEqual(self.poll(plugin), [{"a": 1}, {"a": 2}, {"a": 3}])
+        self.assertEqual(plugin.invalid, 1)
+        self.write('{"a":4}')
+        self.assertEqual(self.poll(plugin), [{"a": 4}])
+
+    def test_08_glob_text_and_long_lines(self):
+        path = os.path.join(self.dir, "logs", "*.log")
+        self.write("a", "x" * 100, "b",
+                   path=os.path.join(self.dir, "logs", "syslog.log"))
+        plugin = self.tail(path, format="text", max_line_bytes=50,
+                           read_bytes=16)
+        self.assertEqual(self.poll(plugin),
+                         [{"message": "a"}, {"message": "b"}])
+
+
+if __name__ == '__main__':
+    unittest.main()
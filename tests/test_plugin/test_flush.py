@@ -0,0 +1,58 @@
+"""unittests for plugin/flush.py"""
+
+import unittest
+from unittest import mock
+
+if __name__ != 'input.tests.test_plugin.test_flush':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.flush import FlushPolicy
+
+
+class FlushPolicyTest(unittest.TestCase):
+
+    def test_01_max_events(self):
+        batch = FlushPolicy(max_events=2).batch()
+        batch.add({"a": 1})
+        self.assertFalse(batch.ready())
+        batch.add({"a": 2})
+        self.assertTrue(batch.ready())
+        self.assertEqual(batch.close(), [{"a": 1}, {"a": 2}])
+
+    def test_02_max_bytes(self):
+        batch = FlushPolicy(max_events=100, max_bytes=10).batch()
+        batch.add("12345")
+        self.assertFalse(batch.ready())
+        batch.add({"a": 1}, nbytes=5)
+        self.assertTrue(batch.ready())
+
+    @mock.patch('plugin.flush.time.monotonic')
+    def test_03_max_linger(self, now):
+        now.return_value = 100
+        batch = FlushPolicy(max_linger=5).batch()
+        now.return_value = 103
+        self.assertEqual(batch.remaining(), 2)
+        self.assertFalse(batch.ready())
+        now.return_value = 105
+        self.assertTrue(batch.ready())
+
+    def test_04_adaptive(self):
+        policy = FlushPolicy(max_events=4, max_linger=60, adaptive=True,
+                             adaptive_max_events=16)
+        for n in (4, 8, 16, 16):
+            batch = policy.batch()
+            self.assertEqual(batch.max_events, n)
+            for i in range(n):
+                batch.add(i)
+            batch.close()
+
+        batch = policy.batch()  # low rate, shrink back
+        batch.add(1)
+        batch.close()
+        self.assertEqual(policy.current_max_events, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
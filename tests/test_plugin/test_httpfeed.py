@@ -0,0 +1,157 @@
+"""unittests for plugin/httpfeed.py"""
+
+import http.server
+import json
+import tempfile
+import threading
+import unittest
+
+if __name__ != 'input.tests.test_plugin.test_httpfeed':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.httpfeed import HttpFeed, cursor_key, iter_records
+
+
+def make_config(url, **kwargs):
+    data = {"name": ["test feed"], "plugin": ["httpfeed"],
+            "orgid": ["testorgid"], "typetag": ["test_typetag"],
+            "timezone": ["US/Pacific"], "url": [url], "period": [0]}
+    for k, v in kwargs.items():
+        data[k] = [v]
+    return {"data": data}
+
+
+class IterRecordsTest(unittest.TestCase):
+
+    def split(self, text, n):
+        return [text[i:i + n] for i in range(0, len(text), n)]
+
+    def test_01_array_any_chunking(self):
+        text = '[{"id": 1, "s": "a,]"}, 22 , [3], "x"]'
+        for n in (1, 2, 5, len(text)):
+            records = list(iter_records(self.split(text, n)))
+            self.assertEqual([r for r, _ in records],
+                             [{"id": 1, "s": "a,]"}, 22, [3], "x"])
+        self.assertEqual(records[0][1], '{"id": 1, "s": "a,]"}')
+
+    def test_02_ndjson(self):
+        text = '{"a": 1}\n{"b": 2}\n\n123\n'
+        records = list(iter_records(self.split(text, 3)))
+        self.assertEqual([r for r, _ in records], [{"a": 1}, {"b": 2}, 123])
+
+    def test_03_invalid(self):
+        with self.assertRaises(ValueError):
+            list(iter_records(['[{"a": 1}, {"b"']))
+        with self.assertRaises(ValueError):
+            list(iter_records(['{"a": ', 'x' * 100], max_record_bytes=50))
+
+
+class Feed(http.server.BaseHTTPRequestHandler):
+    """Serves `records` as a JSON array, with an ETag."""
+
+    records = []
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("If-None-Match")))
+        etag = f'"v{len(self.records)}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps(self.records).encode()
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpFeedTest(unittest.TestCase):
+
+    def setUp(self):
+        Feed.records, Feed.requests = [], []
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Feed)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/feed"
+        self.dir = tempfile.mkdtemp()
+
+    def feed(self, **kwargs):
+        return HttpFeed(make_config(self.url, checkpoint_dir=self.dir,
+                                    **kwargs), "http://example.com/raw", "t")
+
+    def poll(self, feed):
+        """One fetch() and commit(), like `run()` after posting."""
+
+        events = feed.fetch()
+        state = feed.checkpoint()
+        if state is not None:
+            feed.commit(state)
+        return events
+
+    def test_01_conditional_get(self):
+        Feed.records = [{"id": 1}, {"id": 2}]
+        feed = self.feed()
+        self.assertEqual(self.poll(feed), [{"id": 1}, {"id": 2}])
+        self.assertEqual(self.poll(feed), [])
+        self.assertEqual(Feed.requests[-1][1], '"v2"')
+
+    def test_02_cursor_survives_restart(self):
+        Feed.records = [{"id": 1}, {"id": 2}]
+        self.poll(self.feed(cursor_field="id", cursor_param="since"))
+
+        Feed.records = [{"id": 1}, {"id": 2}, {"id": 3}]
+        feed = self.feed(cursor_field="id", cursor_param="since")
+        self.assertEqual(feed.saved_state["cursor"], 2)
+        self.assertEqual(self.poll(feed), [{"id": 3}])
+        self.assertEqual(Feed.requests[-1][0], "/feed?since=2")
+
+    def test_03_batches_commit_at_end(self):
+        Feed.records = [{"id": i} for i in range(5)]
+        feed = self.feed(cursor_field="id", flush_max_events=2)
+        batches = []
+        while True:
+            batches.append(feed.fetch())
+            state = feed.checkpoint()
+            if state is not None:
+                break
+            self.assertEqual(feed.saved_state, {})
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+        self.assertEqual(state["cursor"], 4)
+        self.assertEqual(len(Feed.requests), 1)
+
+    def test_04_mixed_cursor_types(self):
+        Feed.records = [{"id": 1}, {"id": "2"}, {"id": [3]}, {"id": 10}]
+        feed = self.feed(cursor_field="id")
+        with self.assertLogs(level="WARNING"):
+            events = self.poll(feed)
+        self.assertEqual(events, [{"id": 1}, {"id": "2"}, {"id": 10}])
+        self.assertEqual(feed.saved_state["cursor"], 10)
+
+        Feed.records.append({"id": "11"})
+        feed = self.feed(cursor_field="id")
+        feed._state["cursor"] = "10"  # saved as a string
+        self.assertEqual(self.poll(feed), [{"id": "11"}])
+
+
+class CursorKeyTest(unittest.TestCase):
+
+    def test_01_order(self):
+        values = ["b", 10, "9", 2.5, "2024-01-01T00:00:00Z", "a"]
+        self.assertEqual(sorted(values, key=cursor_key),
+                         [2.5, "9", 10, "2024-01-01T00:00:00Z", "a", "b"])
+
+    def test_02_not_comparable(self):
+        for value in (True, [1], {"a": 1}, float("nan")):
+            self.assertIsNone(cursor_key(value))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""unittests for plugin/__init__.py"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+if __name__ != 'input.tests.test_plugin.test_init':
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+
+class LazyImportTest(unittest.TestCase):
+
+    def run_python(self, code):
+        return subprocess.run([sys.executable, "-c", code], cwd=ROOT,
+                              capture_output=True, text=True, check=True
+                              ).stdout.split()
+
+    def test_01_import_plugin_is_light(self):
+        out = self.run_python(
+            "import sys, plugin, plugin.metrics; "
+            "print('requests' in sys.modules, 'lomond' in sys.modules)")
+        self.assertEqual(out, ["False", "False"])
+
+    def test_02_names_load_on_first_use(self):
+        out = self.run_python(
+            "import plugin; from plugin import WebSocket; "
+            "print(WebSocket.__module__, 'WebSocket' in dir(plugin))")
+        self.assertEqual(out, ["plugin.websocket", "True"])
+
+    def test_03_unknown_name(self):
+        import plugin
+        with self.assertRaises(AttributeError):
+            plugin.NoSuchPlugin
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+"""unittests for plugin/listener.py"""
+
+import os
+import socket
+import threading
+import time
+import unittest
+
+if __name__ != 'input.tests.test_plugin.test_listener':
+    import sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.listener import (Listener, SO_RXQ_OVFL, parse_syslog,
+                             split_frames)
+
+
+class SplitFramesTest(unittest.TestCase):
+
+    def test_01_newline(self):
+        messages, rest = split_frames(b"<13>a\r\n<13>b\n<13>c", 'newline')
+        self.assertEqual(messages, [b"<13>a", b"<13>b"])
+        self.assertEqual(rest, b"<13>c")
+
+    def test_02_octet(self):
+        messages, rest = split_frames(b"5 <13>a6 <13>bc\n3 <1", 'octet')
+        self.assertEqual(messages, [b"<13>a", b"<13>bc"])
+        self.assertEqual(rest, b"3 <1")
+
+    def test_03_auto(self):
+        messages, rest = split_frames(b"5 <13>a<13>b\n5 <13>c")
+        self.assertEqual(messages, [b"<13>a", b"<13>b", b"<13>c"])
+        self.assertEqual(rest, b"")
+
+    def test_04_invalid(self):
+        self.assertEqual(split_frames(b"5 <13>a12x <13>a", 'octet'),
+                         ([b"<13>a"], None))
+        self.assertEqual(split_frames(b"<13>a", 'octet'), ([], None))
+        self.assertEqual(
+            split_frames(b"99 <13>a", 'octet', max_message_bytes=10),
+            ([], None))
+        self.assertEqual(
+            split_frames(b"<13>" + b"a" * 20, 'newline',
+                         max_message_bytes=10),
+            ([], None))
+
+
+class ParseSyslogTest(unittest.TestCase):
+
+    def test_01_rfc3164(self):
+        self.assertEqual(
+            parse_syslog(b"<34>Oct 11 22:14:15 mymachine su: failed"),
+            {"facility": 4, "severity": 2,
+             "message": "Oct 11 22:14:15 mymachine su: failed"})
+
+    def test_02_rfc5424(self):
+        event = parse_syslog(b"<165>1 2003-10-11T22:14:15.003Z host evntslog"
+                             b" - ID47 [ex@32473 iut=\"3\"] hello")
+        self.assertEqual(event, {
+            "facility": 20, "severity": 5,
+            "timestamp": "2003-10-11T22:14:15.003Z", "hostname": "host",
+            "app_name": "evntslog", "procid": None, "msgid": "ID47",
+            "message": "[ex@32473 iut=\"3\"] hello"})
+
+    def test_03_no_priority(self):
+        self.assertEqual(parse_syslog(b"<x>hello"), {"message": "<x>hello"})
+
+
+class ListenerTest(unittest.TestCase):
+
+    def listener(self, **kwargs):
+        data = {"name": ["test listener"], "plugin": ["listener"],
+                "orgid": ["testorgid"], "typetag": ["test_typetag"],
+                "timezone": ["US/Pacific"], "host": ["127.0.0.1"],
+                "port": [0], "flush_max_linger": [0.2],
+                "flush_max_events": [100]}
+        for k, v in kwargs.items():
+            data[k] = [v]
+        plugin = Listener({"data": data}, "http://example.com/raw", "t")
+        plugin._start()
+        self.addCleanup(plugin._stop)
+        return plugin
+
+    def test_01_udp(self):
+        plugin = self.listener()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.sendto(b"<13>hello\n", plugin.address)
+            s.sendto(b"<14>world", plugin.address)
+        events = plugin.fetch()
+        self.assertEqual([e["message"] for e in events], ["hello", "world"])
+        self.assertEqual(events[0]["source"], "127.0.0.1")
+        self.assertEqual(plugin.received, 2)
+
+    def test_02_tcp_json(self):
+        plugin = self.listener(protocol="tcp", format="json")
+        with socket.create_connection(plugin.address) as s:
+            s.sendall(b'{"n": 1}\n{"n": 2}\nnot json\n')
+            s.sendall(b'{"n": 3}\n{"n": 4}')  # last line without newline
+        self.assertEqual(plugin.fetch(), [{"n": i} for i in range(1, 5)])
+        self.assertEqual(plugin.invalid, 1)
+        self.assertEqual(len(plugin._conns), 0)
+
+    def test_03_tcp_bad_frame_disconnects(self):
+        plugin = self.listener(protocol="tcp", framing="octet")
+        with socket.create_connection(plugin.address) as s:
+            s.sendall(b"7 <13>one<13>two\n")
+            self.assertEqual([e["message"] for e in plugin.fetch()],
+                             ["one"])
+            self.assertEqual(s.recv(10), b"")
+        self.assertEqual(plugin.invalid, 1)
+
+    def test_04_interrupt(self):
+        plugin = self.listener(flush_max_linger=30)
+        threading.Timer(0.2, plugin.exit_now).start()
+        start = time.monotonic()
+        self.assertEqual(plugin.fetch(), [])
+        self.assertLess(time.monotonic() - start, 0.9)
+
+    @unittest.skipIf(SO_RXQ_OVFL is None, "SO_RXQ_OVFL is Linux only")
+    def test_05_kernel_drops(self):
+        plugin = self.listener(rcvbuf=4096, flush_max_events=10000)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            for i in range(1000):
+                s.sendto(b"<13>" + b"x" * 200, plugin.address)
+            n = len(plugin.fetch())
+            # the count comes with the next datagram queued after drops
+            s.sendto(b"<13>last", plugin.address)
+        n += len(plugin.fetch())
+        self.assertGreater(plugin.dropped, 0)
+        self.assertEqual(n + plugin.dropped, 1001)
+
+    def test_06_tcp_text_starts_with_digit(self):
+        plugin = self.listener(protocol="tcp", format="text")
+        with socket.create_connection(plugin.address) as s:
+            s.sendall(b"1697040000 login ok\n10.0.0.1 port up\n")
+            self.assertEqual([e["message"] for e in plugin.fetch()],
+                             ["1697040000 login ok", "10.0.0.1 port up"])
+        self.assertEqual(plugin.invalid, 0)
+
+    def test_07_tcp_syslog_auto(self):
+        plugin = self.listener(protocol="tcp")
+        with socket.create_connection(plugin.address) as s:
+            s.sendall(b"7 <13>one<13>two\n")
+            self.assertEqual([e["message"] for e in plugin.fetch()],
+                             ["one", "two"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""unittests for plugin/metrics.py"""
+
+import unittest
+import urllib.request
+
+if __name__ != 'input.tests.test_plugin.test_metrics':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.metrics import MetricsServer, Registry, exposition
+
+
+class ExpositionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.a = Registry({"input": "a"})
+        self.b = Registry({"input": 'b "quoted"'})
+        for r in (self.a, self.b):
+            r.counter("events_total", "Events.").inc(3)
+            r.histogram("post_seconds", "Post.", (0.1, 1)).observe(0.5)
+        self.a.gauge("depth", "Depth.", lambda: 7)
+
+    def test_01_text_format(self):
+        text = exposition([self.a, self.b])
+        lines = text.splitlines()
+
+        self.assertEqual(lines.count("# TYPE events_total counter"), 1)
+        self.assertIn('events_total{input="a"} 3', lines)
+        self.assertIn('events_total{input="b \\"quoted\\""} 3', lines)
+        self.assertIn('post_seconds_bucket{input="a",le="0.1"} 0', lines)
+        self.assertIn('post_seconds_bucket{input="a",le="1.0"} 1', lines)
+        self.assertIn('post_seconds_bucket{input="a",le="+Inf"} 1', lines)
+        self.assertIn('post_seconds_count{input="a"} 1', lines)
+        self.assertIn('depth{input="a"} 7', lines)
+
+    def test_02_server(self):
+        server = MetricsServer(lambda: [self.a], 0)
+        server.start()
+        self.addCleanup(server.stop)
+
+        url = f"http://127.0.0.1:{server.port}/metrics"
+        with urllib.request.urlopen(url) as r:
+            body = r.read().decode()
+        self.assertIn('events_total{input="a"} 3', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
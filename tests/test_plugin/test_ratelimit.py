@@ -0,0 +1,110 @@
+"""unittests for plugin/ratelimit.py"""
+
+import email.utils
+import threading
+import time
+import unittest
+
+if __name__ != 'input.tests.test_plugin.test_ratelimit':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.ratelimit import (AdaptiveConcurrency, ApiLimiter, Cancelled,
+                              RetryAfter, TokenBucket, parse_retry_after)
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+
+    def test_01_seconds(self):
+        self.assertEqual(parse_retry_after("7"), 7)
+        self.assertEqual(parse_retry_after("9999", maximum=60), 60)
+
+    def test_02_http_date(self):
+        value = email.utils.formatdate(time.time() + 30, usegmt=True)
+        self.assertAlmostEqual(parse_retry_after(value), 30, delta=2)
+
+    def test_03_missing_or_invalid(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertEqual(parse_retry_after("soon", default=1), 1)
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_01_burst_then_rate(self):
+        bucket = TokenBucket(10, burst=3)
+        waits = [bucket.reserve() for _ in range(5)]
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertAlmostEqual(waits[3], 0.1, delta=0.01)
+        self.assertAlmostEqual(waits[4], 0.2, delta=0.01)
+
+
+class AdaptiveConcurrencyTest(unittest.TestCase):
+
+    def test_01_decrease_and_increase(self):
+        c = AdaptiveConcurrency(min_limit=1, max_limit=8, cooldown=0)
+        c.acquire()
+        c.release(None)
+        self.assertEqual(c.limit, 4)
+        for _ in range(8):
+            c.acquire()
+            c.release(0.01)
+        self.assertGreater(c.limit, 5)
+        self.assertLessEqual(c.limit, 8)
+
+    def test_02_cooldown(self):
+        c = AdaptiveConcurrency(max_limit=8, cooldown=60)
+        for _ in range(3):
+            c.acquire()
+            c.release(0.01, overloaded=True)
+        self.assertEqual(c.limit, 4)
+
+    def test_03_acquire_cancelled(self):
+        c = AdaptiveConcurrency(max_limit=1)
+        c.acquire()
+        cancel = threading.Event()
+        cancel.set()
+        with self.assertRaises(Cancelled):
+            c.acquire(cancel)
+
+
+class ApiLimiterTest(unittest.TestCase):
+
+    def test_01_retry_after_pauses_org(self):
+        limiter = ApiLimiter()
+        with self.assertRaises(RetryAfter):
+            with limiter.request("org1") as req:
+                req.status_code = 429
+                raise RetryAfter(30, 429)
+        self.assertGreater(limiter.wait_time("org1"), 29)
+        self.assertEqual(limiter.wait_time("org2"), 0)
+        self.assertEqual(limiter.concurrency.limit, 32)
+
+    def test_02_503_pauses_all(self):
+        limiter = ApiLimiter(max_retry_after=5)
+        with self.assertRaises(RetryAfter):
+            with limiter.request("org1") as req:
+                req.status_code = 503
+                raise RetryAfter(30, 503)
+        self.assertAlmostEqual(limiter.wait_time("org2"), 5, delta=0.5)
+
+        cancel = threading.Event()
+        cancel.set()
+        with self.assertRaises(Cancelled):
+            with limiter.request("org2", cancel):
+                pass
+        self.assertEqual(limiter.concurrency.in_flight, 0)
+
+    def test_03_org_rate(self):
+        limiter = ApiLimiter(org_rate=20, org_burst=1)
+        t = time.monotonic()
+        for _ in range(3):
+            with limiter.request("org1") as req:
+                req.status_code = 201
+        self.assertGreaterEqual(time.monotonic() - t, 0.09)
+        with limiter.request("org2") as req:  # own bucket, not delayed
+            req.status_code = 201
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""unittests for plugin/spool.py"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+if __name__ != 'input.tests.test_plugin.test_spool':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.spool import Spool
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_01_append_read_commit(self):
+        spool = Spool(self.dir)
+        spool.append([b"a", b"b", b"c"])
+        records, pos = spool.read(2)
+        self.assertEqual(records, [b"a", b"b"])
+
+        records, _ = spool.read(2)
+        self.assertEqual(records, [b"a", b"b"])  # not committed yet
+
+        spool.commit(pos)
+        records, pos = spool.read(2)
+        self.assertEqual(records, [b"c"])
+        spool.commit(pos)
+        self.assertEqual(len(spool), 0)
+        spool.close()
+
+    def test_02_reopen_resumes_at_cursor(self):
+        spool = Spool(self.dir, segment_bytes=20)
+        spool.append([b"event %d" % i for i in range(5)])
+        records, pos = spool.read(3)
+        spool.commit(pos)
+        spool.close()
+
+        spool = Spool(self.dir, segment_bytes=20)
+        records, pos = spool.read(10)
+        self.assertEqual(records, [b"event 3", b"event 4"])
+        spool.close()
+
+    def test_03_recover_partial_record(self):
+        spool = Spool(self.dir)
+        spool.append([b"complete"])
+        spool.close()
+
+        segment = os.path.join(self.dir, sorted(
+            f for f in os.listdir(self.dir) if f.endswith(".seg"))[-1])
+        with open(segment, "ab") as f:
+            f.write(b"\x00\x00\x00\x10\x00\x00")  # torn header
+
+        spool = Spool(self.dir)
+        spool.append([b"after crash"])
+        records, _ = spool.read(10)
+        self.assertEqual(records, [b"complete", b"after crash"])
+        spool.close()
+
+    def test_04_max_bytes_drops_oldest(self):
+        spool = Spool(self.dir, segment_bytes=10, max_bytes=30)
+        spool.append([b"%08d" % i for i in range(6)])
+        self.assertGreater(spool.dropped, 0)
+        records, _ = spool.read(10)
+        self.assertEqual(len(records) + spool.dropped, 6)
+        self.assertEqual(records[-1], b"00000005")
+        spool.close()
+
+    def test_05_bad_fsync_policy(self):
+        with self.assertRaises(ValueError):
+            Spool(self.dir, fsync="sometimes")
+
+
+if __name__ == '__main__':
+    unittest.main()
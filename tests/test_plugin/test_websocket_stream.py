@@ -0,0 +1,120 @@
+"""unittests of the streaming mode of plugin/websocket.py"""
+
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+import websockets
+
+if __name__ != 'input.tests.test_plugin.test_websocket_stream':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..', '..')] + sys.path
+
+from plugin.websocket import WebSocket
+
+
+class Server:
+    """
+    Local WebSocket server that sends ``scripts[i]`` on its i-th
+    connection and closes it, the last connection is kept open.
+    """
+
+    def __init__(self, scripts):
+        self.scripts = scripts
+        self.connections = 0
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._serve, args=(ready,),
+                                       daemon=True)
+        self.thread.start()
+        ready.wait(5)
+
+    def _serve(self, ready):
+        async def main():
+            async with websockets.serve(self._handler, "127.0.0.1", 0) \
+                    as server:
+                self.port = next(iter(server.sockets)).getsockname()[1]
+                self.stop = asyncio.Event()
+                ready.set()
+                await self.stop.wait()
+        self.loop.run_until_complete(main())
+
+    async def _handler(self, ws, path=None):
+        n = self.connections
+        self.connections += 1
+        for message in self.scripts[min(n, len(self.scripts) - 1)]:
+            await ws.send(message)
+        if n >= len(self.scripts) - 1:
+            await ws.wait_closed()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.stop.set)
+        self.thread.join(5)
+
+
+class StreamTest(unittest.TestCase):
+
+    def websocket(self, scripts, **kwargs):
+        server = Server(scripts)
+        self.addCleanup(server.close)
+        data = {"name": ["test stream"], "plugin": ["websocket"],
+                "orgid": ["testorgid"], "typetag": ["test_typetag"],
+                "timezone": ["US/Pacific"],
+                "url": [f"ws://127.0.0.1:{server.port}/"],
+                "stream": [True], "flush_max_linger": [0.2],
+                "reconnect_min_wait": [0.05], "reconnect_max_wait": [0.1]}
+        for k, v in kwargs.items():
+            data[k] = [v]
+        plugin = WebSocket({"data": data}, "http://example.com/raw", "t")
+        self.addCleanup(plugin.exit_now)
+        return server, plugin
+
+    def fetch_until(self, plugin, n, timeout=10):
+        events = []
+        deadline = time.monotonic() + timeout
+        while len(events) < n and time.monotonic() < deadline:
+            events += plugin.fetch()
+        return events
+
+    def test_01_bad_frame_skipped_and_reconnect(self):
+        server, plugin = self.websocket(
+            [['{"a": 1}', 'not json', '{"a": 2}'], ['{"a": 3}']])
+        self.assertEqual(self.fetch_until(plugin, 3),
+                         [{"a": 1}, {"a": 2}, {"a": 3}])
+        self.assertEqual(plugin.invalid, 1)
+        self.assertEqual(server.connections, 2)
+        self.assertTrue(plugin._reader.is_alive())
+
+    def test_02_failed_reader_raises_and_restarts(self):
+        server, plugin = self.websocket([['{"a": 1}'], ['{"a": 2}']])
+        with mock.patch.object(plugin, '_decode_event',
+                               side_effect=RuntimeError("boom")):
+            plugin.fetch()
+            plugin._reader.join(5)
+        with self.assertRaises(RuntimeError):
+            plugin.fetch()
+        self.assertTrue(self.fetch_until(plugin, 1))  # a new reader
+        self.assertTrue(plugin._reader.is_alive())
+
+    def test_03_size_in_bytes(self):
+        event = mock.Mock(text="é", data=None)
+        event.name = "text"
+        self.assertEqual(WebSocket._size(event), 2)
+
+    def test_04_drain_on_graceful_exit(self):
+        server, plugin = self.websocket([['{"a": 1}', '{"a": 2}']],
+                                        flush_max_events=1)
+        self.assertEqual(self.fetch_until(plugin, 1), [{"a": 1}])
+        deadline = time.monotonic() + 5
+        while plugin._stream_queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        plugin.exit_graceful()
+        self.assertEqual(plugin.drain(), [{"a": 2}])
+        self.assertFalse(plugin._reader.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
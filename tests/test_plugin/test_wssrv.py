@@ -0,0 +1,74 @@
+"""unittests for tests/test_plugin/wssrv.py"""
+
+import asyncio
+import random
+import unittest
+
+if __name__ != 'input.tests.test_plugin.test_wssrv':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__))] + sys.path
+
+from wssrv import LoadGenerator, Tracker, parse_args
+
+
+class LoadGeneratorTest(unittest.TestCase):
+
+    def test_01_default_replays_testdata_once(self):
+        args = parse_args([])
+        self.assertEqual(args.count, 3)
+        self.assertFalse(args.stamp)
+        gen = LoadGenerator(args)
+        self.assertEqual(gen.message(0, 1, None), '{"b": 2}')
+
+    def test_02_sized_stamped_messages(self):
+        args = parse_args(["--size", "uniform:200:400"])
+        self.assertTrue(args.stamp)
+        self.assertIsNone(args.count)
+        gen, rnd = LoadGenerator(args), random.Random(0)
+        for seq in range(50):
+            msg = gen.message(7, seq, rnd)
+            self.assertGreaterEqual(len(msg), 200)
+            self.assertLessEqual(len(msg), 400)
+
+    def test_03_burst_rate(self):
+        gen = LoadGenerator(parse_args(["--rate", "10",
+                                        "--burst", "1000:60:60"]))
+        self.assertEqual(gen.rate(), 1000)
+
+    def test_04_sent_by_conn(self):
+        class FakeWebSocket:
+            async def send(self, message):
+                pass
+
+        gen = LoadGenerator(parse_args([]))
+        asyncio.run(gen(FakeWebSocket()))
+        asyncio.run(gen(FakeWebSocket()))
+        self.assertEqual(gen.sent_by_conn, {0: 3, 1: 3})
+
+
+class TrackerTest(unittest.TestCase):
+
+    def test_01_loss_and_duplicates(self):
+        tracker = Tracker()
+        for conn, seq in [(0, 5), (0, 6), (0, 6), (0, 9), (1, 0), (1, 1)]:
+            tracker.add({"conn": conn, "seq": seq, "ts": 100.0}, now=100.5)
+        summary = tracker.summary()
+        self.assertEqual(summary["received"], 5)
+        self.assertEqual(summary["duplicates"], 1)
+        # 0 to 4, 7 and 8 of conn 0, lost before the first seq seen too
+        self.assertEqual(summary["missing"], 7)
+        self.assertEqual(summary["latency_p50"], 0.5)
+
+    def test_02_loss_against_sent(self):
+        tracker = Tracker()
+        for conn, seq in [(0, 4), (0, 5), (0, 6), (0, 9), (1, 0), (1, 1)]:
+            tracker.add({"conn": conn, "seq": seq, "ts": 100.0}, now=100.5)
+        summary = tracker.summary(sent={0: 12, 1: 3, 2: 2}, start={0: 5})
+        # 7, 8, 10, 11 of conn 0, 2 of conn 1 and all of conn 2
+        self.assertEqual(summary["missing"], 7)
+        self.assertEqual(summary["received"], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
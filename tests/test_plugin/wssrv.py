@@ -1,24 +1,310 @@
+"""
+WebSocket test source and load generator for the `WebSocket` plugin.
+
+Without arguments it sends the records of ``testdata.json`` once per
+connection, then closes the connection. With options it becomes a
+load generator::
+
+    python wssrv.py --rate 1000 --size lognormal:500:1 \\
+        --burst 10000:2:8 --disconnect-after 30 --connections 100
+
+With ``--stamp`` (implied by ``--size``) every message carries
+``conn`` (connection number), ``seq`` (message number on that
+connection) and ``ts`` (send time, ``time.time()``). Feed the events
+that come out at the API side to `Tracker`, with the number of
+messages sent on each connection (`LoadGenerator.sent_by_conn`), to
+measure loss, duplication and latency through the input module
+exactly.
+
+Usage
+-----
+::
+
+    usage: wssrv.py [-h] [--host HOST] [--port PORT] [--data DATA]
+                    [--rate RATE] [--count COUNT] [--size SIZE]
+                    [--stamp] [--burst RATE:ON:OFF]
+                    [--connections CONNECTIONS]
+                    [--disconnect-every N] [--disconnect-after SECONDS]
+"""
+
+import argparse
 import asyncio
+import itertools
 import json
+import math
+import os
+import random
 import time
+
 import websockets
 
-with open("testdata.json") as f:
-    data = json.load(f)
 
-async def send_data(websocket, path):
-    total = len(data)
-    this = 0
-    while True:
-        await websocket.send(json.dumps(data[this]))
-        this += 1
-        if this == total:
-            this = 0
-            break
-      
-start_server = websockets.serve(send_data,'localhost', 4042)
-asyncio.get_event_loop().run_until_complete(start_server)
-asyncio.get_event_loop().run_forever()
+TESTDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "testdata.json")
+
+
+def size_distribution(spec):
+    """
+    Function returning message sizes in bytes, from `spec`:
+
+    - ``fixed:N`` (or just ``N``)
+    - ``uniform:MIN:MAX``
+    - ``lognormal:MEDIAN:SIGMA``
+    - ``choice:A,B,C``
+    """
+
+    kind, _, params = spec.partition(":")
+    if not params:
+        kind, params = "fixed", spec
+    if kind == "fixed":
+        n = int(params)
+        return lambda rnd: n
+    if kind == "uniform":
+        low, high = map(int, params.split(":"))
+        return lambda rnd: rnd.randint(low, high)
+    if kind == "lognormal":
+        median, sigma = map(float, params.split(":"))
+        return lambda rnd: max(1, int(rnd.lognormvariate(math.log(median),
+                                                         sigma)))
+    if kind == "choice":
+        sizes = [int(n) for n in params.split(",")]
+        return lambda rnd: rnd.choice(sizes)
+    raise argparse.ArgumentTypeError(f"Bad size distribution: '{spec}'!")
+
+
+def burst_pattern(spec):
+    """``RATE:ON:OFF``, `RATE` msg/s for `ON` s every `ON + OFF` s."""
+
+    try:
+        rate, on, off = map(float, spec.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Bad burst pattern: '{spec}'!")
+    return rate, on, off
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description="WebSocket test source and load generator.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=4042,
+                        help="0 for a random port")
+    parser.add_argument("--data", default=TESTDATA,
+                        help="JSON list of records to send, in a loop")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="messages/s per connection, 0 for as fast "
+                             "as possible")
+    parser.add_argument("--count", type=int,
+                        help="messages per connection, default one pass "
+                             "over DATA without load options, else "
+                             "unlimited")
+    parser.add_argument("--size", type=size_distribution,
+                        help="send generated messages of this size "
+                             "distribution instead of DATA, e.g. "
+                             "fixed:200, uniform:100:1000, "
+                             "lognormal:500:1, choice:100,10000")
+    parser.add_argument("--stamp", action="store_true",
+                        help="add conn, seq and ts to every message")
+    parser.add_argument("--burst", type=burst_pattern,
+                        metavar="RATE:ON:OFF",
+                        help="send at RATE for ON seconds every ON+OFF "
+                             "seconds")
+    parser.add_argument("--connections", type=int,
+                        help="reject connections beyond this many")
+    parser.add_argument("--disconnect-every", type=int, metavar="N",
+                        help="close each connection after N messages")
+    parser.add_argument("--disconnect-after", type=float,
+                        metavar="SECONDS",
+                        help="close each connection after SECONDS")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    load = any(v is not None for v in (
+        args.size, args.burst, args.disconnect_every,
+        args.disconnect_after)) or args.rate > 0
+    if args.size is not None:
+        args.stamp = True
+    if args.count is None and not load:
+        with open(args.data) as f:
+            args.count = len(json.load(f))
+    return args
+
+
+class LoadGenerator:
+    """
+    WebSocket connection handler sending messages as per `args`, see
+    `parse_args()`.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.records = None
+        if args.size is None:
+            with open(args.data) as f:
+                self.records = json.load(f)
+        self.conn_ids = itertools.count()
+        self.active = 0
+        self.sent = 0
+        self.sent_by_conn = {}  # conn: messages sent on it
+        self.start = time.monotonic()
+
+    def rate(self):
+        """Current messages/s per connection, 0 for unlimited."""
+
+        if self.args.burst is not None:
+            burst_rate, on, off = self.args.burst
+            if (time.monotonic() - self.start) % (on + off) < on:
+                return burst_rate
+        return self.args.rate
+
+    def message(self, conn, seq, rnd):
+        if self.records is not None:
+            record = self.records[seq % len(self.records)]
+            if not self.args.stamp:
+                return json.dumps(record)
+            record = dict(record)
+        else:
+            record = {"pad": ""}
+        record.update(conn=conn, seq=seq, ts=time.time())
+        if self.records is None:
+            size = self.args.size(rnd)
+            record["pad"] = "x" * max(0, size - len(json.dumps(record)))
+        return json.dumps(record)
+
+    async def __call__(self, websocket, path=None):
+        args = self.args
+        if args.connections is not None and self.active >= args.connections:
+            await websocket.close(1013, "too many connections")
+            return
+
+        conn = next(self.conn_ids)
+        rnd = random.Random(args.seed * 1000003 + conn)
+        limit = args.count
+        if args.disconnect_every is not None:
+            limit = args.disconnect_every if limit is None else \
+                min(limit, args.disconnect_every)
+        deadline = None if args.disconnect_after is None else \
+            time.monotonic() + args.disconnect_after
+
+        self.active += 1
+        self.sent_by_conn[conn] = 0
+        try:
+            seq = 0
+            next_send = time.monotonic()
+            while limit is None or seq < limit:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                await websocket.send(self.message(conn, seq, rnd))
+                seq += 1
+                self.sent += 1
+                self.sent_by_conn[conn] = seq
+
+                rate = self.rate()
+                if rate <= 0:
+                    if seq % 100 == 0:
+                        await asyncio.sleep(0)  # let others send
+                    continue
+                next_send = max(next_send + 1 / rate,
+                                time.monotonic() - 1)  # no catch-up storm
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif seq % 100 == 0:
+                    await asyncio.sleep(0)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.active -= 1
+
+
+async def serve(args, ready=None, handler=None):
+    """
+    Serve until cancelled. `ready` is called with the port once
+    listening. `handler` is a `LoadGenerator` of `args` by default.
+    """
+
+    if handler is None:
+        handler = LoadGenerator(args)
+    async with websockets.serve(handler, args.host, args.port,
+                                max_queue=None) as server:
+        if ready is not None:
+            ready(next(iter(server.sockets)).getsockname()[1])
+        await asyncio.Future()
+
+
+class Tracker:
+    """
+    Loss, duplication and latency of stamped messages (``--stamp``)
+    as they come out of the input module.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seen = set()
+        self.last_seq = {}  # conn: highest seq seen
+        self.duplicates = 0
+        self.latencies = []
+
+    def add(self, event, now=None):
+        now = time.time() if now is None else now
+        conn, seq = event["conn"], event["seq"]
+        if (conn, seq) in self.seen:
+            self.duplicates += 1
+            return
+        self.seen.add((conn, seq))
+        self.latencies.append(now - event["ts"])
+        self.last_seq[conn] = max(seq, self.last_seq.get(conn, seq))
+
+    def summary(self, sent=None, start=None):
+        """
+        Parameters
+        ----------
+        sent : dict, optional
+            ``{conn: n}``, messages sent on each connection, seq ``0``
+            to ``n - 1``, see `LoadGenerator.sent_by_conn`. Without it
+            the highest seq seen on each connection is taken as the
+            last one sent, which misses the loss at its end.
+        start : dict, optional
+            ``{conn: n}``, seqs below `n` are not expected, they were
+            sent before measuring started.
+
+        Returns
+        -------
+        summary : dict
+            ``received`` unique messages, ``duplicates``, ``missing``
+            (expected seqs not received) and ``latency_p50`` /
+            ``latency_p99`` in seconds.
+        """
+
+        if sent is None:
+            sent = {c: seq + 1 for c, seq in self.last_seq.items()}
+        start = start or {}
+        expected = sum(max(0, n - start.get(c, 0)) for c, n in sent.items())
+        received = sum(1 for c, seq in self.seen
+                       if start.get(c, 0) <= seq < sent.get(c, 0))
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1,
+                                 int(p / 100 * len(latencies)))]
+
+        return {"received": len(self.seen),
+                "duplicates": self.duplicates,
+                "missing": expected - received,
+                "latency_p50": percentile(50),
+                "latency_p99": percentile(99)}
+
 
+def main(args=None):
+    args = parse_args(args)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""unittests for run.py"""
+
+import unittest
+from unittest import mock
+
+if __name__ != 'input.tests.test_run':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..')] + sys.path
+
+import run
+
+
+class FakeInput:
+    """Thread-like input that exits only once `alive` is cleared."""
+
+    def __init__(self):
+        self.alive = True
+        self.exit_now_called = False
+
+    def exit_graceful(self):
+        pass
+
+    def exit_now(self):
+        self.exit_now_called = True
+
+    def join(self, timeout=None):
+        pass
+
+    def is_alive(self):
+        return self.alive
+
+
+class FakeBackend:
+
+    def get_config(self, plugin_lst=None, name_lst=None):
+        return [{"data": {"name": [name], "orgid": ["testorgid"]}}
+                for name in name_lst]
+
+
+class StopTest(unittest.TestCase):
+
+    def setUp(self):
+        for name, value in [("_RUNNING", {}), ("_RUNNING_CONFIG", {}),
+                            ("_STOPPING", {}),
+                            ("_API_CONFIG", {"url": "http://example.com",
+                                             "stop_timeout": 0.1}),
+                            ("_IDENTITY_BACKEND", FakeBackend()),
+                            ("_STOP_NOW_TIMEOUT", 0.1)]:
+            patcher = mock.patch.object(run, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_01_stuck_input_is_not_started_twice(self):
+        stuck = FakeInput()
+        run._RUNNING["a"] = stuck
+
+        result = run._stop_names(["a"])
+        self.assertEqual(result["stuck"], ["a"])
+        self.assertTrue(stuck.exit_now_called)
+        self.assertNotIn("a", run._RUNNING)
+        self.assertEqual(run.status()["stopping"], ["a"])
+
+        result = run.start_input(None, ["a"])
+        self.assertEqual(result["stopping"], ["a"])
+        self.assertEqual(result["started"], [])
+
+        result = run._stop_names(["a"])  # stopping it again waits again
+        self.assertEqual(result["stuck"], ["a"])
+        stuck.alive = False
+        result = run._stop_names(["a"])
+        self.assertEqual(result["not_running"], ["a"])
+        self.assertEqual(run._STOPPING, {})
+
+    def test_02_stop_command_waits_for_stuck_input(self):
+        stuck = FakeInput()
+        run._RUNNING["a"] = stuck
+        server = mock.Mock()
+        args = run.parse_args(["stop", "-n", "a"])
+
+        reply = run.run_command(args, server)
+        self.assertEqual(reply["result"]["stuck"], ["a"])
+        self.assertNotIn("exiting", reply["result"])
+        server.shutdown.assert_not_called()
+
+        stuck.alive = False
+        reply = run.run_command(args, server)
+        self.assertTrue(reply["result"]["exiting"])
+        server.shutdown.assert_called_once()
+
+    def test_03_exited_input_is_forgotten(self):
+        stuck = FakeInput()
+        run._RUNNING["a"] = stuck
+        run._stop_names(["a"])
+        stuck.alive = False
+        self.assertEqual(run.status()["stopping"], [])
+        run._reap_stopping()
+        self.assertEqual(run._STOPPING, {})
+
+
+class ReloadTest(unittest.TestCase):
+
+    API = {"url": "http://example.com", "stop_timeout": 0.1,
+           "token_ttl": 300, "start_workers": 8, "pool_maxsize": 10,
+           "async_workers": 128}
+    IDENTITY = {"mongo_url": "mongodb://localhost:27017"}
+
+    def setUp(self):
+        input_config = FakeBackend().get_config(None, ["a"])[0]
+        self.backend = FakeBackend()
+        self.backend.database = mock.Mock()  # of a pymongo Collection
+        for name, value in [("_RUNNING_CONFIG",
+                             {"a": (input_config, "thread", 1)}),
+                            ("_API_CONFIG", dict(self.API)),
+                            ("_FILE_CONFIG",
+                             {"api": dict(self.API),
+                              "identity": dict(self.IDENTITY)}),
+                            ("_IDENTITY_BACKEND", self.backend),
+                            ("_TOKEN_CACHE", None),
+                            ("_CONFIG_FILENAME", __file__),
+                            ("_ASYNC_RUNTIME", None)]:
+            patcher = mock.patch.object(run, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name in ("_stop_names", "start_input", "get_config",
+                     "get_identity_backend", "TokenCache"):
+            patcher = mock.patch.object(run, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.start_input.return_value = {"started": ["a"]}
+        self.get_identity_backend.return_value = FakeBackend()
+
+    def config_file(self, api=None, identity=None):
+        sections = {"api": dict(self.API, **(api or {})),
+                    "identity": dict(self.IDENTITY, **(identity or {}))}
+        self.get_config.side_effect = lambda filename, db: sections[db]
+
+    def test_01_url_change_restarts_inputs(self):
+        self.config_file(api={"url": "http://example.org"})
+        result = run.sync_inputs()
+        self.assertEqual(result["restarted"], ["a"])
+        self.assertEqual(run._API_CONFIG["url"], "http://example.org")
+
+    def test_02_stop_timeout_change_applies_without_restart(self):
+        self.config_file(api={"stop_timeout": 2})
+        result = run.sync_inputs()
+        self.assertEqual(result["restarted"], [])
+        self.assertEqual(run._API_CONFIG["stop_timeout"], 2)
+        self.start_input.assert_not_called()
+
+    def test_03_unchanged(self):
+        self.config_file()
+        result = run.sync_inputs()
+        self.assertEqual(result["restarted"], [])
+        self.get_identity_backend.assert_not_called()
+        self.TokenCache.assert_not_called()
+
+    def test_04_identity_change_replaces_and_closes_backend(self):
+        self.config_file(identity={"mongo_url": "mongodb://other:27017"})
+        result = run.sync_inputs()
+        self.assertEqual(result["restarted"], [])
+        self.assertIs(run._IDENTITY_BACKEND,
+                      self.get_identity_backend.return_value)
+        self.backend.database.client.close.assert_called_once_with()
+        self.TokenCache.assert_called_once()
+
+    def test_05_pool_change_needs_restart_of_run_py(self):
+        self.config_file(api={"pool_maxsize": 100})
+        with self.assertLogs(level="WARNING"):
+            result = run.sync_inputs()
+        self.assertEqual(result["restarted"], [])
+        self.assertEqual(run._API_CONFIG["pool_maxsize"], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
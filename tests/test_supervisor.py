@@ -0,0 +1,100 @@
+"""unittests for supervisor.py"""
+
+import argparse
+import collections
+import concurrent.futures
+import unittest
+
+if __name__ != 'input.tests.test_supervisor':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..')] + sys.path
+
+from supervisor import Supervisor, rendezvous
+
+
+class RendezvousTest(unittest.TestCase):
+
+    names = [f"input-{i}" for i in range(1000)]
+
+    def test_01_stable(self):
+        first = [rendezvous(n, [0, 1, 2, 3]) for n in self.names]
+        again = [rendezvous(n, [3, 2, 1, 0]) for n in self.names]
+        self.assertEqual(first, again)
+
+    def test_02_balanced(self):
+        counts = collections.Counter(rendezvous(n, range(4))
+                                     for n in self.names)
+        self.assertEqual(set(counts), {0, 1, 2, 3})
+        self.assertGreater(min(counts.values()), 180)
+
+    def test_03_only_dead_slot_moves(self):
+        before = {n: rendezvous(n, [0, 1, 2, 3]) for n in self.names}
+        after = {n: rendezvous(n, [0, 1, 3]) for n in self.names}
+        for n in self.names:
+            if before[n] != 2:
+                self.assertEqual(before[n], after[n])
+            else:
+                self.assertNotEqual(after[n], 2)
+
+
+class FakeProcess:
+    exitcode = -9
+
+
+class FakeWorker:
+    """Answers ``start`` with every name and ``stop`` with `stop`."""
+
+    def __init__(self, slot, stop=None):
+        self.slot = slot
+        self.alive = True
+        self.process = FakeProcess()
+        self.stop = stop or {}
+        self.calls = []
+        self.spawned = 0
+
+    def is_alive(self):
+        return self.alive
+
+    def spawn(self):
+        self.alive = True
+        self.spawned += 1
+
+    def call(self, argv):
+        self.calls.append(argv)
+        names = argv[argv.index("-n") + 1:]
+        result = {"started": names} if argv[0] == "start" else self.stop
+        future = concurrent.futures.Future()
+        future.set_result({"ok": True, "result": result})
+        return future
+
+
+class RecoverTest(unittest.TestCase):
+
+    def args(self, command, names):
+        return argparse.Namespace(command=command, plugin=None, name=names,
+                                  config="config.json", runtime="thread",
+                                  loops=1, metrics_port=None, watch=None)
+
+    def test_01_stuck_input_then_worker_dies(self):
+        sup = Supervisor(0, lambda plugin_lst, name_lst: list(name_lst))
+        dying = FakeWorker(0, stop={"stuck": ["a"]})
+        other = FakeWorker(1)
+        sup.workers = [dying, other]
+        sup.command(self.args("start", ["a", "c"]))
+        for name in ("a", "c"):  # both on the worker that dies
+            sup.owner[name] = 0
+
+        result = sup.command(self.args("stop", ["a"]))
+        self.assertEqual(result["stuck"], ["a"])
+        self.assertEqual(sup.owner["a"], 0)
+
+        dying.alive = False
+        sup._recover(dying)
+        self.assertEqual(other.calls[-1][-2:], ["-n", "c"])
+        self.assertEqual(sup.owner, {"c": 1})
+        self.assertEqual(dying.spawned, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
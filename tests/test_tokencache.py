@@ -0,0 +1,81 @@
+"""unittests for tokencache.py"""
+
+import threading
+import time
+import unittest
+
+if __name__ != 'input.tests.test_tokencache':
+    import os, sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..')] + sys.path
+
+from tokencache import TokenCache
+
+
+class FakeAdmin:
+    def __init__(self, token):
+        self.token = token
+
+
+class FakeOrg:
+    def __init__(self, orgid):
+        self.orgid = orgid
+
+    def get_admins(self):
+        return [FakeAdmin(f"token-{self.orgid}")]
+
+
+class FakeBackend:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def find_org(self, _hash, parse=False):
+        with self.lock:
+            self.calls.append(_hash)
+        time.sleep(self.delay)
+        return None if _hash == "unknown" else FakeOrg(_hash)
+
+
+class TokenCacheTest(unittest.TestCase):
+
+    def test_01_one_lookup_per_org(self):
+        backend = FakeBackend()
+        cache = TokenCache(backend)
+        tokens = cache.resolve(["a", "b", "a", "a", "b"])
+
+        self.assertEqual(tokens, {"a": "token-a", "b": "token-b"})
+        self.assertEqual(sorted(backend.calls), ["a", "b"])
+
+        self.assertEqual(cache.get("a"), "token-a")
+        self.assertEqual(len(backend.calls), 2)
+        self.assertEqual(cache.hits, 1)
+
+    def test_02_concurrent(self):
+        backend = FakeBackend(delay=0.2)
+        cache = TokenCache(backend, max_workers=10)
+        start = time.monotonic()
+        cache.resolve([str(i) for i in range(10)])
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_03_ttl(self):
+        backend = FakeBackend()
+        cache = TokenCache(backend, ttl=0)
+        cache.get("a")
+        cache.get("a")
+        self.assertEqual(backend.calls, ["a", "a"])
+
+    def test_04_failure_not_cached(self):
+        backend = FakeBackend()
+        cache = TokenCache(backend)
+        tokens = cache.resolve(["unknown", "a"])
+        self.assertIsInstance(tokens["unknown"], ValueError)
+        self.assertEqual(tokens["a"], "token-a")
+        with self.assertRaises(ValueError):
+            cache.get("unknown")
+        self.assertEqual(backend.calls.count("unknown"), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""unittests for watcher.py"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+if __name__ != 'input.tests.test_watcher':
+    import sys
+    J = os.path.join
+    sys.path = [J(os.path.dirname(__file__), '..')] + sys.path
+
+from watcher import ConfigWatcher, diff_configs
+
+
+def make_config(name, url):
+    return {"data": {"name": [name], "url": [url]}}
+
+
+class DiffTest(unittest.TestCase):
+
+    def test_01_changed_and_removed(self):
+        old = {"a": make_config("a", "ws://1"),
+               "b": make_config("b", "ws://2"),
+               "c": make_config("c", "ws://3")}
+        new = {"a": make_config("a", "ws://1"),
+               "b": make_config("b", "ws://9"),
+               "d": make_config("d", "ws://4")}
+        self.assertEqual(diff_configs(old, new), (["b"], ["c"]))
+
+    def test_02_key_order(self):
+        old = {"a": {"data": {"x": [1], "y": [2]}}}
+        new = {"a": {"data": {"y": [2], "x": [1]}}}
+        self.assertEqual(diff_configs(old, new), ([], []))
+
+
+class ConfigWatcherTest(unittest.TestCase):
+
+    def test_01_poll(self):
+        synced = threading.Semaphore(0)
+        w = ConfigWatcher(synced.release, 0.05)
+        w.start()
+        self.assertTrue(synced.acquire(timeout=2))
+        self.assertTrue(synced.acquire(timeout=2))
+        w.stop()
+        w.join(2)
+        self.assertFalse(w.is_alive())
+
+    def test_02_file_change(self):
+        synced = threading.Event()
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "config.json")
+            with open(filename, "w") as f:
+                f.write("{}")
+            w = ConfigWatcher(synced.set, 60, filename)
+            w.start()
+            time.sleep(0.2)
+            with open(filename, "w") as f:
+                f.write('{"api": {}}')
+            self.assertTrue(synced.wait(5))
+            w.stop()
+            w.join(2)
+
+
+if __name__ == '__main__':
+    unittest.main()
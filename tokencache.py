@@ -0,0 +1,115 @@
+"""
+Cache of org hash to API token, used by `run.py` to start inputs.
+
+Finding the token of an org takes several identity DB round trips
+(``find_org()`` then ``get_admins()``). Inputs of the same org share
+one token, so `TokenCache` resolves every org only once per `ttl`
+seconds, and resolves a batch of orgs concurrently.
+"""
+
+import concurrent.futures
+import logging
+import threading
+import time
+
+
+class TokenCache:
+    """
+    TTL memo of org hash to the token of the first admin of the org.
+
+    Parameters
+    ----------
+    backend : tahoe.identity.IdentityBackend
+    ttl : float, default=300
+        Seconds a resolved token is reused. Failures are not cached.
+    max_workers : int, default=8
+        Orgs resolved at the same time by `resolve()`.
+    """
+
+    def __init__(self, backend, ttl=300, max_workers=8):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.hits = 0
+        self.misses = 0
+
+        self._tokens = {}  # orgid: (token, expiry)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def _lookup(self, orgid):
+        org = self.backend.find_org(_hash=orgid, parse=True)
+        if org is None:
+            raise ValueError(f"Unknown orgid={orgid}!")
+        return org.get_admins()[0].token
+
+    def _cached(self, orgid, now):
+        entry = self._tokens.get(orgid)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        return None
+
+    def get(self, orgid):
+        """Token of one org, from the cache if fresh."""
+
+        result = self.resolve([orgid])[orgid]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def resolve(self, orgids):
+        """
+        Tokens of many orgs. Each distinct org missing from the cache
+        is looked up once, concurrently.
+
+        Returns
+        -------
+        tokens : dict
+            ``{orgid: token}``, or ``{orgid: exception}`` for orgs
+            that failed.
+        """
+
+        now = time.monotonic()
+        result, missing = {}, []
+        with self._lock:
+            for orgid in dict.fromkeys(orgids):
+                token = self._cached(orgid, now)
+                if token is None:
+                    missing.append(orgid)
+                else:
+                    result[orgid] = token
+            self.hits += len(result)
+            self.misses += len(missing)
+
+        if not missing:
+            return result
+
+        n_workers = min(self.max_workers, len(missing))
+        with concurrent.futures.ThreadPoolExecutor(n_workers) as ex:
+            futures = {orgid: ex.submit(self._lookup, orgid)
+                       for orgid in missing}
+
+        expiry = time.monotonic() + self.ttl
+        with self._lock:
+            for orgid, future in futures.items():
+                try:
+                    token = future.result()
+                except Exception as e:
+                    logging.error(f"Failed to get token of org: '{orgid}'!",
+                                  exc_info=True)
+                    result[orgid] = e
+                    continue
+                self._tokens[orgid] = (token, expiry)
+                result[orgid] = token
+        return result
+
+    def invalidate(self, orgid=None):
+        """Forget one org, or every org if `orgid` is ``None``."""
+
+        with self._lock:
+            if orgid is None:
+                self._tokens.clear()
+            else:
+                self._tokens.pop(orgid, None)
@@ -0,0 +1,121 @@
+"""
+Watch input configs and restart only the inputs that changed.
+
+`ConfigWatcher` compares the input configs in the identity DB with the
+configs the running inputs were started with, every `interval`
+seconds and whenever the config file changes (seen with watchdog).
+`run.py` restarts inputs whose config changed and stops inputs whose
+config was deleted. New inputs still need a ``start`` command.
+"""
+
+import json
+import logging
+import os
+import threading
+
+
+def config_key(input_config):
+    """Comparable form of an input config."""
+
+    return json.dumps(input_config, sort_keys=True, default=str)
+
+
+def diff_configs(old, new):
+    """
+    Names of changed and removed inputs.
+
+    Parameters
+    ----------
+    old, new : dict
+        ``{name: input_config}``
+
+    Returns
+    -------
+    changed : list
+        Names in both whose config differs.
+    removed : list
+        Names in `old` only.
+    """
+
+    changed, removed = [], []
+    for name, config in old.items():
+        if name not in new:
+            removed.append(name)
+        elif config_key(config) != config_key(new[name]):
+            changed.append(name)
+    return changed, removed
+
+
+class ConfigWatcher(threading.Thread):
+    """
+    Daemon thread that calls `sync` periodically and on file changes.
+
+    Parameters
+    ----------
+    sync : callable
+        Called with no arguments to compare and apply configs.
+    interval : float
+        Seconds between two polls of the identity DB.
+    filename : str, optional
+        Config file to watch with watchdog. The loadconfig cache
+        notices the change on its own, this only makes the sync
+        happen right away.
+    """
+
+    def __init__(self, sync, interval, filename=None):
+        super().__init__(name="config-watcher", daemon=True)
+        self.sync = sync
+        self.interval = interval
+        self.filename = os.path.abspath(filename) if filename else None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._observer = None
+
+    def _watch_file(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            logging.warning("watchdog not installed, config file changes "
+                            "are seen on the next poll only!")
+            return
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                paths = {getattr(event, 'src_path', None),
+                         getattr(event, 'dest_path', None)}
+                if watcher.filename in paths:
+                    watcher._wake.set()
+
+        self._observer = Observer()
+        self._observer.schedule(Handler(), os.path.dirname(self.filename))
+        self._observer.daemon = True
+        self._observer.start()
+
+    def run(self):
+        if self.filename and os.path.exists(self.filename):
+            self._watch_file()
+
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            try:
+                self.sync()
+            except Exception:
+                logging.error("Config sync failed!", exc_info=True)
+
+        if self._observer is not None:
+            self._observer.stop()
+
+    def poke(self):
+        """Sync now."""
+
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()